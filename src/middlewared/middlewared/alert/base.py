@@ -195,6 +195,8 @@ class AlertSource:
     products = ("CORE", "ENTERPRISE", "SCALE", "SCALE_ENTERPRISE")
     failover_related = False
     run_on_backup_node = True
+    # Seconds `check` is allowed to run before the source is considered hung
+    run_timeout = 120
 
     def __init__(self, middleware):
         self.middleware = middleware
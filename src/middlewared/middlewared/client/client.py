@@ -325,6 +325,10 @@ class Client(object):
         if typ is not None:
             raise
 
+    @property
+    def closed(self):
+        return self._closed.is_set()
+
     def _send(self, data):
         self._ws.send(json.dumps(data))
 
@@ -1,6 +1,6 @@
 import asyncio
 import contextlib
-from collections import OrderedDict
+from collections import defaultdict, deque, OrderedDict
 import copy
 from datetime import datetime
 import enum
@@ -18,6 +18,8 @@ from middlewared.pipe import Pipes
 logger = logging.getLogger(__name__)
 
 LOGS_DIR = '/var/log/jobs'
+# Progress of a job is sent to `core.get_jobs` subscribers at most once per this many seconds
+JOB_PROGRESS_INTERVAL = 0.25
 
 
 class State(enum.Enum):
@@ -28,6 +30,9 @@ class State(enum.Enum):
     ABORTED = 5
 
 
+FINISHED_STATES = (State.SUCCESS, State.FAILED, State.ABORTED)
+
+
 class JobSharedLock(object):
     """
     Shared lock for jobs.
@@ -37,9 +42,12 @@ class JobSharedLock(object):
     """
 
     def __init__(self, queue, name, *, loop=None):
-        self.queue = queue
         self.name = name
         self.jobs = set()
+        # Jobs waiting for this lock in the order they were added
+        self.waiting = deque()
+        # Whether the first job of `waiting` is already scheduled to run
+        self.scheduled = False
         # Once we upgrade to python 3.10 and it starts crashing here, just revert a commit that introduced `loop=loop`
         self.lock = asyncio.Lock(loop=loop)
 
@@ -64,10 +72,16 @@ class JobSharedLock(object):
 
 class JobsQueue(object):
 
-    def __init__(self, middleware):
+    def __init__(self, middleware, progress_interval=JOB_PROGRESS_INTERVAL):
         self.middleware = middleware
         self.deque = JobsDeque()
-        self.queue = []
+        # Jobs that are ready to run (they either have no lock or are the next ones to acquire their lock)
+        self.queue = deque()
+
+        self.progress_interval = progress_interval
+        # Jobs that have a delayed progress update scheduled
+        self.pending_progress = set()
+        self.progress_lock = threading.Lock()
 
         # Event responsible for the job queue schedule loop.
         # This event is set and a new job is potentially ready to run
@@ -90,24 +104,81 @@ class JobsQueue(object):
     def add(self, job):
         self.handle_lock(job)
         if job.options["lock_queue_size"] is not None:
-            queued_jobs = [another_job for another_job in self.queue if another_job.lock is job.lock]
+            if job.lock is None:
+                queued_jobs = [another_job for another_job in self.queue if another_job.lock is None]
+            else:
+                queued_jobs = job.lock.waiting
             if len(queued_jobs) >= job.options["lock_queue_size"]:
                 return queued_jobs[-1]
 
         self.deque.add(job)
-        self.queue.append(job)
+        if job.lock is None:
+            self.queue.append(job)
+        else:
+            job.lock.waiting.append(job)
+            self.schedule_lock(job.lock)
 
         if not job.options["transient"]:
             self.middleware.send_event('core.get_jobs', 'ADDED', id=job.id, fields=job.__encode__())
 
-        # A job has been added to the queue, let the queue scheduler run
-        self.queue_event.set()
+        if self.queue:
+            # A job is ready to run, let the queue scheduler run
+            self.queue_event.set()
 
         return job
 
     def remove(self, job_id):
         self.deque.remove(job_id)
 
+    def filter(self, filters):
+        return self.deque.filter(filters)
+
+    def state_changed(self, job, old_state):
+        self.deque.state_changed(job, old_state)
+
+    def send_changed(self, job, fields):
+        """
+        Send `core.get_jobs` `CHANGED` event for `job` containing only changed `fields`.
+        """
+        if job.options['transient']:
+            return
+
+        self.middleware.send_event('core.get_jobs', 'CHANGED', id=job.id, fields=job.encode_changed(fields))
+
+    def send_progress(self, job):
+        """
+        Send `job` progress no more often than every `progress_interval` seconds. Progress updates that come more
+        often are coalesced and only the latest progress is sent. Can be called from any thread.
+        """
+        if job.options['transient']:
+            return
+
+        with self.progress_lock:
+            if job in self.pending_progress:
+                return
+
+            delay = job.progress_sent_at + self.progress_interval - time.monotonic()
+            if delay > 0:
+                self.pending_progress.add(job)
+            else:
+                job.progress_sent_at = time.monotonic()
+
+        if delay > 0:
+            self.middleware.loop.call_soon_threadsafe(
+                self.middleware.loop.call_later, delay, self._send_pending_progress, job,
+            )
+        else:
+            self.send_changed(job, ['progress'])
+
+    def _send_pending_progress(self, job):
+        with self.progress_lock:
+            self.pending_progress.discard(job)
+            job.progress_sent_at = time.monotonic()
+
+        if job.time_finished is None:
+            # Finished job progress is sent along with the rest of the job
+            self.send_changed(job, ['progress'])
+
     def handle_lock(self, job):
         name = job.get_lock_name()
         if name is None:
@@ -133,9 +204,17 @@ class JobsQueue(object):
         if len(lock.get_jobs()) == 0:
             self.job_locks.pop(lock.name)
 
-        # Once a lock is released there could be another job in the queue
-        # waiting for the same lock
-        self.queue_event.set()
+        # Once a lock is released there could be another job waiting for the same lock
+        self.schedule_lock(lock)
+
+    def schedule_lock(self, lock):
+        """
+        Make the next job waiting for `lock` ready to run if the lock is free.
+        """
+        if lock.waiting and not lock.scheduled and not lock.locked():
+            lock.scheduled = True
+            self.queue.append(lock.waiting[0])
+            self.queue_event.set()
 
     async def next(self):
         """
@@ -144,21 +223,16 @@ class JobsQueue(object):
         while True:
             # Awaits a new event to look for a job
             await self.queue_event.wait()
-            found = None
-            for job in self.queue:
-                # Get job in the queue if it has no lock or its not locked
-                if job.lock is None or not job.lock.locked():
-                    found = job
-                    if job.lock:
-                        await job.lock.acquire()
-                    break
-            if found:
-                # Unlocked job found to run
-                self.queue.remove(found)
+            if self.queue:
+                job = self.queue.popleft()
+                if job.lock:
+                    job.lock.waiting.popleft()
+                    job.lock.scheduled = False
+                    await job.lock.acquire()
                 # If there are no more jobs in the queue, clear the event
                 if len(self.queue) == 0:
                     self.queue_event.clear()
-                return found
+                return job
             else:
                 # No jobs available to run, clear the event
                 self.queue_event.clear()
@@ -173,12 +247,18 @@ class JobsDeque(object):
     """
     A jobs deque to do not keep more than `maxlen` in memory
     with a `id` assigner.
+
+    Jobs are also indexed by their state and method name.
     """
 
     def __init__(self, maxlen=1000):
         self.maxlen = maxlen
         self.count = 0
         self.__dict = OrderedDict()
+        # Finished jobs in the order they have finished (the first one is evicted first)
+        self.__finished = OrderedDict()
+        self.__by_state = defaultdict(dict)
+        self.__by_method = defaultdict(dict)
         with contextlib.suppress(FileNotFoundError):
             shutil.rmtree(LOGS_DIR)
 
@@ -195,18 +275,78 @@ class JobsDeque(object):
         self.count += 1
         job.set_id(self.count)
         if len(self.__dict) > self.maxlen:
-            for old_job_id, old_job in self.__dict.items():
-                if old_job.state in (State.SUCCESS, State.FAILED, State.ABORTED):
-                    self.remove(old_job_id)
-                    break
+            if self.__finished:
+                self.remove(next(iter(self.__finished)))
             else:
                 logger.warning("There are %d jobs waiting or running", len(self.__dict))
         self.__dict[job.id] = job
+        self.__by_state[job.state][job.id] = job
+        self.__by_method[job.method_name][job.id] = job
+        if job.state in FINISHED_STATES:
+            self.__finished[job.id] = job
 
     def remove(self, job_id):
         if job_id in self.__dict:
-            self.__dict[job_id].cleanup()
-            del self.__dict[job_id]
+            job = self.__dict.pop(job_id)
+            job.cleanup()
+            self.__by_state[job.state].pop(job_id, None)
+            by_method = self.__by_method[job.method_name]
+            by_method.pop(job_id, None)
+            if not by_method:
+                del self.__by_method[job.method_name]
+            self.__finished.pop(job_id, None)
+
+    def state_changed(self, job, old_state):
+        if self.__dict.get(job.id) is not job:
+            return
+
+        self.__by_state[old_state].pop(job.id, None)
+        self.__by_state[job.state][job.id] = job
+        if job.state in FINISHED_STATES:
+            self.__finished[job.id] = job
+
+    def filter(self, filters):
+        """
+        Returns jobs that can match `filters` (in `filter_list` format) using the indexes for top-level `=` and `in`
+        filters on `id`, `state` and `method`. Returned jobs still have to be filtered with `filter_list`.
+        """
+        candidates = None
+        for f in filters:
+            if len(f) != 3 or f[1] not in ('=', 'in'):
+                continue
+
+            name, op, value = f
+            if op == '=':
+                values = [value]
+            elif isinstance(value, (list, tuple)):
+                values = value
+            else:
+                continue
+
+            if name == 'id':
+                jobs = {v: self.__dict[v] for v in values if isinstance(v, int) and v in self.__dict}
+            elif name == 'state':
+                jobs = {}
+                for v in values:
+                    if isinstance(v, str) and v in State.__members__:
+                        jobs.update(self.__by_state.get(State.__members__[v], {}))
+            elif name == 'method':
+                jobs = {}
+                for v in values:
+                    if isinstance(v, str):
+                        jobs.update(self.__by_method.get(v, {}))
+            else:
+                continue
+
+            if candidates is None:
+                candidates = jobs
+            else:
+                candidates = {k: v for k, v in candidates.items() if k in jobs}
+
+        if candidates is None:
+            return list(self.__dict.values())
+
+        return [job for job_id, job in sorted(candidates.items())]
 
 
 class Job:
@@ -251,6 +391,8 @@ class Job:
         self.time_finished = None
         self.loop = self.middleware.loop
         self.future = None
+        self.progress_sent_at = 0
+        self.encoded_arguments = None
 
         self.logs_path = None
         self.logs_fd = None
@@ -297,10 +439,12 @@ class Job:
             assert state not in ('WAITING', 'SUCCESS')
         if self.state == State.RUNNING:
             assert state not in ('WAITING', 'RUNNING')
-        assert self.state not in (State.SUCCESS, State.FAILED, State.ABORTED)
+        assert self.state not in FINISHED_STATES
+        old_state = self.state
         self.state = State.__members__[state]
-        if self.state in (State.SUCCESS, State.FAILED, State.ABORTED):
+        if self.state in FINISHED_STATES:
             self.time_finished = datetime.utcnow()
+        self.middleware.jobs.state_changed(self, old_state)
 
     def set_description(self, description):
         """
@@ -311,16 +455,15 @@ class Job:
         """
         if self.description != description:
             self.description = description
-            self.middleware.send_event('core.get_jobs', 'CHANGED', id=self.id, fields=self.__encode__())
+            self.middleware.jobs.send_changed(self, ['description'])
 
     def set_progress(self, percent=None, description=None, extra=None):
         """
         Sets job completion progress. All arguments are optional and only passed arguments will be changed in the
         whole job progress state.
 
-        Don't change this too often as every time an event is sent. Use :class:`middlewared.job.JobProgressBuffer` to
-        throttle progress reporting if you are receiving it from an external source (e.g. network response reading
-        progress).
+        Progress events are sent no more often than every `JobsQueue.progress_interval` seconds, more frequent
+        updates are coalesced.
 
         :param percent: Job progress [0-100]
         :param description: Human-readable description of what the job is currently doing.
@@ -341,15 +484,14 @@ class Job:
                 self.progress['extra'] = extra
                 changed = True
 
-        encoded = self.__encode__()
         if self.on_progress_cb:
             try:
-                self.on_progress_cb(encoded)
+                self.on_progress_cb(self.__encode__())
             except Exception:
                 logger.warning('Failed to run on progress callback', exc_info=True)
 
         if changed:
-            self.middleware.send_event('core.get_jobs', 'CHANGED', id=self.id, fields=encoded)
+            self.middleware.jobs.send_progress(self)
 
     async def wait(self, timeout=None, raise_error=False):
         if timeout is None:
@@ -385,10 +527,10 @@ class Job:
         return self.result
 
     def abort(self):
+        # Jobs that run in a thread can't be cancelled so they should check `aborted` periodically
+        self.aborted = True
         if self.loop is not None and self.future is not None:
             self.loop.call_soon_threadsafe(self.future.cancel)
-        elif self.state == State.WAITING:
-            self.aborted = True
 
     async def run(self, queue):
         """
@@ -405,7 +547,8 @@ class Job:
                 raise asyncio.CancelledError()
             else:
                 self.set_state('RUNNING')
-                self.middleware.send_event('core.get_jobs', 'CHANGED', id=self.id, fields=self.__encode__())
+                # `logs_path` is only known once the job starts
+                self.middleware.jobs.send_changed(self, ['logs_path'])
 
             self.future = asyncio.ensure_future(self.__run_body())
             try:
@@ -514,7 +657,7 @@ class Job:
         return {
             'id': self.id,
             'method': self.method_name,
-            'arguments': self.middleware.dump_args(self.args, method=self.method),
+            'arguments': self.__encode_arguments(),
             'description': self.description,
             'abortable': self.options['abortable'],
             'logs_path': self.logs_path,
@@ -529,6 +672,24 @@ class Job:
             'time_finished': self.time_finished,
         }
 
+    def __encode_arguments(self):
+        # Arguments never change but dumping them is expensive
+        if self.encoded_arguments is None:
+            self.encoded_arguments = self.middleware.dump_args(self.args, method=self.method)
+        return self.encoded_arguments
+
+    def encode_changed(self, fields):
+        """
+        Encode only `fields` of the job (along with its `id` and `state` that are always present).
+        """
+        encoded = {'id': self.id, 'state': self.state.name}
+        for field in fields:
+            if field == 'progress':
+                encoded['progress'] = dict(self.progress)
+            else:
+                encoded[field] = getattr(self, field)
+        return encoded
+
     async def wrap(self, subjob):
         """
         Wrap a job in another job, proxying progress and result/error.
@@ -2,7 +2,7 @@ from .apidocs import app as apidocs_app
 from .client import ejson as json
 from .common.event_source.manager import EventSourceManager
 from .event import Events
-from .job import Job, JobsQueue
+from .job import Job, JobsQueue, JOB_PROGRESS_INTERVAL
 from .pipe import Pipes, Pipe
 from .restful import copy_multipart_to_pipe, RESTfulAPI
 from .settings import conf
@@ -13,6 +13,7 @@ from .utils import osc, sw_version
 from .utils.debug import get_frame_details, get_threads_stacks
 from .utils.lock import SoftHardSemaphore, SoftHardSemaphoreLimit
 from .utils.plugins import LoadPluginsMixin
+from .utils.process_pool import ProcessPool
 from .utils.profile import profile_wrap
 from .utils.service.call import ServiceCallMixin
 from .utils.threading import set_thread_name, IoThreadPoolExecutor
@@ -32,7 +33,6 @@ import asyncio
 import binascii
 from collections import namedtuple
 import concurrent.futures
-import concurrent.futures.process
 import concurrent.futures.thread
 import contextlib
 from dataclasses import dataclass
@@ -64,6 +64,10 @@ from systemd.daemon import notify as systemd_notify
 
 from . import logger
 
+# Maximum number of events waiting to be sent to a websocket client that does not read them fast enough. Method
+# call results are never dropped (their count is limited by the per-connection `SoftHardSemaphore`).
+OUTBOUND_QUEUE_SIZE = 1000
+
 
 @dataclass
 class LoopMonitorIgnoreFrame:
@@ -72,6 +76,25 @@ class LoopMonitorIgnoreFrame:
     cut_below: bool = False
 
 
+def event_message(name, event_type, kwargs):
+    event = {
+        'msg': event_type.lower(),
+        'collection': name,
+    }
+    kwargs = kwargs.copy()
+    if 'id' in kwargs:
+        event['id'] = kwargs.pop('id')
+    if event_type in ('ADDED', 'CHANGED'):
+        if 'fields' in kwargs:
+            event['fields'] = kwargs.pop('fields')
+    if event_type == 'CHANGED':
+        if 'cleared' in kwargs:
+            event['cleared'] = kwargs.pop('cleared')
+    if kwargs:
+        event['extra'] = kwargs
+    return event
+
+
 class Application(object):
 
     def __init__(self, middleware, loop, request, response):
@@ -101,13 +124,31 @@ class Application(object):
         self.__callbacks = defaultdict(list)
         self.__subscribed = {}
 
+        # Messages waiting to be sent as `[serialized, event]` where `event` is only set for events (that can be
+        # coalesced or dropped if the client does not keep up)
+        self._outbound = deque()
+        self._outbound_events = 0
+        self._outbound_ready = asyncio.Event()
+        self._outbound_dropped = 0
+        self._outbound_coalesced = 0
+        self._writer = None
+        self._closed = False
+
     def register_callback(self, name, method):
         assert name in ('on_message', 'on_close')
         self.__callbacks[name].append(method)
 
     def _send(self, data):
-        serialized = json.dumps(data)
-        asyncio.run_coroutine_threadsafe(self.response.send_str(serialized), loop=self.loop)
+        self._send_serialized(json.dumps(data))
+
+    def _send_serialized(self, serialized, event=None):
+        """
+        Queue an already serialized message to be sent. Can be called from any thread.
+
+        :param event: the message itself if it is an event. If the client is not reading events fast enough, queued
+            events will be coalesced or dropped.
+        """
+        self.loop.call_soon_threadsafe(self._enqueue, serialized, event)
         _1KB = 1000
         if len(serialized) > _1KB:
             # no reason to store data in the deque that
@@ -228,12 +269,96 @@ class Application(object):
                     extra_log_files,
                 )
 
+    def _enqueue(self, serialized, event):
+        if self._closed:
+            return
+
+        if event is not None:
+            if self._outbound_events >= OUTBOUND_QUEUE_SIZE:
+                if self.__coalesce_event(event):
+                    return
+
+                self.__drop_oldest_event()
+
+            self._outbound_events += 1
+
+        self._outbound.append([serialized, event])
+        self._outbound_ready.set()
+        if self._writer is None:
+            self._writer = asyncio.ensure_future(self.__write())
+
+    def __coalesce_event(self, event):
+        """
+        Merge `CHANGED` `event` into the event for the same object that is still waiting to be sent.
+        """
+        if event['msg'] != 'changed' or 'id' not in event or event.get('cleared'):
+            return False
+
+        for entry in reversed(self._outbound):
+            queued = entry[1]
+            if queued is None or queued['collection'] != event['collection'] or 'id' not in queued:
+                continue
+
+            if queued['id'] != event['id']:
+                continue
+
+            if queued['msg'] not in ('added', 'changed'):
+                return False
+
+            # Queued event might be shared with other clients so it must not be modified
+            merged = dict(queued, **{k: v for k, v in event.items() if k not in ('msg', 'fields')})
+            if 'fields' in event:
+                if isinstance(queued.get('fields'), dict) and isinstance(event['fields'], dict):
+                    merged['fields'] = dict(queued['fields'], **event['fields'])
+                else:
+                    merged['fields'] = event['fields']
+
+            entry[:] = [json.dumps(merged), merged]
+            self._outbound_coalesced += 1
+            return True
+
+        return False
+
+    def __drop_oldest_event(self):
+        for i, (serialized, queued) in enumerate(self._outbound):
+            if queued is not None:
+                del self._outbound[i]
+                self._outbound_events -= 1
+                break
+
+        if self._outbound_dropped == 0:
+            self.logger.warning('Session %r is not reading events fast enough, dropping them', self.session_id)
+        self._outbound_dropped += 1
+
+    async def __write(self):
+        while True:
+            await self._outbound_ready.wait()
+            self._outbound_ready.clear()
+
+            while self._outbound:
+                serialized, event = self._outbound.popleft()
+                if event is not None:
+                    self._outbound_events -= 1
+
+                try:
+                    await self.response.send_str(serialized)
+                except Exception:
+                    # Connection is being closed, nothing else can be sent
+                    self.__close_outbound()
+                    return
+
+    def __close_outbound(self):
+        self._closed = True
+        self._outbound.clear()
+        self._outbound_events = 0
+
     async def subscribe(self, ident, name):
         shortname, arg = self.middleware.event_source_manager.short_name_arg(name)
         if shortname in self.middleware.event_source_manager.event_sources:
             await self.middleware.event_source_manager.subscribe(self, self.__esm_ident(ident), shortname, arg)
         else:
             self.__subscribed[ident] = name
+            self.middleware.register_event_subscription(self, name)
 
         self._send({
             'msg': 'ready',
@@ -242,7 +367,7 @@ class Application(object):
 
     async def unsubscribe(self, ident):
         if ident in self.__subscribed:
-            self.__subscribed.pop(ident)
+            self.middleware.unregister_event_subscription(self, self.__subscribed.pop(ident))
         elif self.__esm_ident(ident) in self.middleware.event_source_manager.idents:
             await self.middleware.event_source_manager.unsubscribe(self.__esm_ident(ident))
 
@@ -257,22 +382,8 @@ class Application(object):
             )[0] not in self.middleware.event_source_manager.event_sources
         ):
             return
-        event = {
-            'msg': event_type.lower(),
-            'collection': name,
-        }
-        kwargs = kwargs.copy()
-        if 'id' in kwargs:
-            event['id'] = kwargs.pop('id')
-        if event_type in ('ADDED', 'CHANGED'):
-            if 'fields' in kwargs:
-                event['fields'] = kwargs.pop('fields')
-        if event_type == 'CHANGED':
-            if 'cleared' in kwargs:
-                event['cleared'] = kwargs.pop('cleared')
-        if kwargs:
-            event['extra'] = kwargs
-        self._send(event)
+        event = event_message(name, event_type, kwargs)
+        self._send_serialized(json.dumps(event), event)
 
     def on_open(self):
         self.middleware.register_wsclient(self)
@@ -287,8 +398,16 @@ class Application(object):
 
         await self.middleware.event_source_manager.unsubscribe_app(self)
 
+        for name in self.__subscribed.values():
+            self.middleware.unregister_event_subscription(self, name)
+        self.__subscribed.clear()
+
         self.middleware.unregister_wsclient(self)
 
+        self.__close_outbound()
+        if self._writer is not None:
+            self._writer.cancel()
+
     async def on_message(self, message):
         # Run callbacks registered in plugins for on_message
         for method in self.__callbacks['on_message']:
@@ -829,6 +948,7 @@ class Middleware(LoadPluginsMixin, ServiceCallMixin):
     def __init__(
         self, loop_debug=False, loop_monitor=True, overlay_dirs=None, debug_level=None,
         log_handler=None, startup_seq_path=None, trace_malloc=False,
+        process_pool_min_workers=2, process_pool_max_workers=5, job_progress_interval=JOB_PROGRESS_INTERVAL,
         log_format='[%(asctime)s] (%(levelname)s) %(name)s.%(funcName)s():%(lineno)d - %(message)s',
     ):
         super().__init__(overlay_dirs)
@@ -851,8 +971,10 @@ class Middleware(LoadPluginsMixin, ServiceCallMixin):
         self.__thread_id = threading.get_ident()
         self.thread_pool_executor = IoThreadPoolExecutor()
         multiprocessing.set_start_method('spawn')  # Spawn new processes for ProcessPool instead of forking
-        self.__init_procpool()
+        self.__init_procpool(process_pool_min_workers, process_pool_max_workers)
         self.__wsclients = {}
+        # Event name (or `*`) -> websocket clients subscribed to it along with the number of their subscriptions
+        self.__event_subscriptions = defaultdict(dict)
         self.__events = Events()
         self.event_source_manager = EventSourceManager(self)
         self.__event_subs = defaultdict(list)
@@ -863,7 +985,7 @@ class Middleware(LoadPluginsMixin, ServiceCallMixin):
         self.__init_services()
         self.__console_io = False if os.path.exists(self.CONSOLE_ONCE_PATH) else None
         self.__terminate_task = None
-        self.jobs = JobsQueue(self)
+        self.jobs = JobsQueue(self, job_progress_interval)
         self.mocks = {}
         self.socket_messages_queue = deque(maxlen=200)
 
@@ -1082,6 +1204,29 @@ class Middleware(LoadPluginsMixin, ServiceCallMixin):
     def unregister_wsclient(self, client):
         self.__wsclients.pop(client.session_id)
 
+    def register_event_subscription(self, client, name):
+        subscribers = self.__event_subscriptions[name]
+        subscribers[client] = subscribers.get(client, 0) + 1
+
+    def unregister_event_subscription(self, client, name):
+        subscribers = self.__event_subscriptions.get(name)
+        if not subscribers or client not in subscribers:
+            return
+
+        subscribers[client] -= 1
+        if subscribers[client] == 0:
+            del subscribers[client]
+            if not subscribers:
+                del self.__event_subscriptions[name]
+
+    def __event_recipients(self, name):
+        if self.event_source_manager.short_name_arg(name)[0] in self.event_source_manager.event_sources:
+            return list(self.__wsclients.values())
+
+        recipients = dict.fromkeys(list(self.__event_subscriptions.get(name, ())))
+        recipients.update(dict.fromkeys(list(self.__event_subscriptions.get('*', ()))))
+        return list(recipients)
+
     def register_hook(self, name, method, *, blockable=False, inline=False, order=0, raise_error=False, sync=True):
         """
         Register a hook under `name`.
@@ -1205,23 +1350,24 @@ class Middleware(LoadPluginsMixin, ServiceCallMixin):
     async def run_in_thread(self, method, *args, **kwargs):
         return await self.run_in_executor(self.thread_pool_executor, method, *args, **kwargs)
 
-    def __init_procpool(self):
-        self.__procpool = concurrent.futures.ProcessPoolExecutor(
-            max_workers=5,
-            initializer=functools.partial(
-                worker_init, self.overlay_dirs, self.debug_level, self.log_handler
-            ),
+    def __init_procpool(self, min_workers, max_workers):
+        # pid -> latest `worker.WorkerConnection.stats` reported by process pool worker
+        self.worker_stats = {}
+        self.__procpool = ProcessPool(
+            functools.partial(worker_init, self.overlay_dirs, self.debug_level, self.log_handler),
+            min_workers,
+            max_workers,
         )
 
-    async def run_in_proc(self, method, *args, **kwargs):
-        retries = 2
-        for i in range(retries):
-            try:
-                return await self.run_in_executor(self.__procpool, method, *args, **kwargs)
-            except concurrent.futures.process.BrokenProcessPool:
-                if i == retries - 1:
-                    raise
-                self.__init_procpool()
+    async def run_in_proc(self, method, *args, budget_key=None, budget=None, **kwargs):
+        """
+        Run `method` in the process pool. No more than `budget` (defaults to all workers but one) calls sharing
+        the same `budget_key` will run simultaneously.
+        """
+        return await self.__procpool.run(method, *args, key=budget_key, budget=budget, **kwargs)
+
+    def get_process_pool_stats(self):
+        return self.__procpool.stats()
 
     def pipe(self, buffered=False):
         """
@@ -1302,7 +1448,32 @@ class Middleware(LoadPluginsMixin, ServiceCallMixin):
         return await self.run_in_executor(prepared_call.executor, methodobj, *prepared_call.args)
 
     async def _call_worker(self, name, *args, job=None):
-        return await self.run_in_proc(main_worker, name, args, job)
+        serviceobj, methodobj = self._method_lookup(name)
+        result, stats = await self.run_in_proc(
+            main_worker, name, args, job,
+            budget_key=serviceobj._config.namespace, budget=serviceobj._config.process_pool_budget,
+        )
+        self.update_worker_stats(stats)
+        return result
+
+    def update_worker_stats(self, stats):
+        if stats['pid'] not in self.worker_stats:
+            # A new worker was spawned, forget the ones that have exited (or were lost with a broken pool)
+            pids = self.__procpool.pids()
+            for pid in list(self.worker_stats):
+                if pid not in pids:
+                    del self.worker_stats[pid]
+
+        self.worker_stats[stats['pid']] = stats
+
+    def get_worker_stats(self):
+        """
+        Returns connection statistics reported by the live process pool workers.
+        """
+        pids = self.__procpool.pids()
+        return sorted(
+            (stats for pid, stats in self.worker_stats.items() if pid in pids), key=lambda stats: stats['pid'],
+        )
 
     def dump_args(self, args, method=None, method_name=None):
         if method is None:
@@ -1446,11 +1617,16 @@ class Middleware(LoadPluginsMixin, ServiceCallMixin):
 
         self.logger.trace(f'Sending event {name!r}:{event_type!r}:{kwargs!r}')
 
-        for session_id, wsclient in list(self.__wsclients.items()):
-            try:
-                wsclient.send_event(name, event_type, **kwargs)
-            except Exception:
-                self.logger.warn('Failed to send event {} to {}'.format(name, session_id), exc_info=True)
+        recipients = self.__event_recipients(name)
+        if recipients:
+            # Event is serialized once and the same message is sent to every subscribed client
+            event = event_message(name, event_type, kwargs)
+            serialized = json.dumps(event)
+            for wsclient in recipients:
+                try:
+                    wsclient._send_serialized(serialized, event)
+                except Exception:
+                    self.logger.warn('Failed to send event {} to {}'.format(name, wsclient.session_id), exc_info=True)
 
         async def wrap(handler):
             try:
@@ -1729,7 +1905,7 @@ class Middleware(LoadPluginsMixin, ServiceCallMixin):
         asyncio.ensure_future(self.jobs.run())
 
         # Start up middleware worker process pool
-        self.__procpool._start_executor_manager_thread()
+        self.__procpool.start()
 
         runner = web.AppRunner(app, handle_signals=False, access_log=None)
         await runner.setup()
@@ -1753,6 +1929,9 @@ class Middleware(LoadPluginsMixin, ServiceCallMixin):
         self.logger.debug('Accepting connections')
         self._console_write('loading completed\n')
 
+        # Make sure process pool workers have loaded the plugins before they are needed
+        asyncio.ensure_future(self.__procpool.warm())
+
         self.__notify_startup_complete()
 
     def terminate(self):
@@ -1807,6 +1986,8 @@ def main():
     parser.add_argument('--trace-malloc', '-tm', action='store', nargs=2, type=int, default=False)
     parser.add_argument('--overlay-dirs', '-o', action='append')
     parser.add_argument('--disable-debug-mode', action='store_true', default=False)
+    parser.add_argument('--returns-validation-rate', type=int, default=1,
+                        help='Validate return value of one of every N method calls in debug mode (0 to disable)')
     parser.add_argument('--debug-level', choices=[
         'TRACE',
         'DEBUG',
@@ -1818,6 +1999,12 @@ def main():
         'console',
         'file',
     ], default='console')
+    parser.add_argument('--process-pool-min-workers', type=int, default=2,
+                        help='Number of process pool workers started with middleware')
+    parser.add_argument('--process-pool-max-workers', type=int, default=5,
+                        help='Number of process pool workers that can be started under load')
+    parser.add_argument('--job-progress-interval', type=float, default=JOB_PROGRESS_INTERVAL,
+                        help='Minimum interval (in seconds) between job progress events')
     args = parser.parse_args()
 
     pidpath = '/var/run/middlewared.pid'
@@ -1842,6 +2029,7 @@ def main():
             _pidfile.write(f"{str(os.getpid())}\n")
 
     conf.debug_mode = not args.disable_debug_mode
+    conf.returns_validation_rate = args.returns_validation_rate
 
     Middleware(
         loop_debug=args.loop_debug,
@@ -1851,6 +2039,9 @@ def main():
         debug_level=args.debug_level,
         log_handler=args.log_handler,
         startup_seq_path=startup_seq_path,
+        process_pool_min_workers=args.process_pool_min_workers,
+        process_pool_max_workers=args.process_pool_max_workers,
+        job_progress_interval=args.job_progress_interval,
     ).run()
 
 
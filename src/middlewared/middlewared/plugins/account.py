@@ -3,7 +3,8 @@ from middlewared.service import (
     CallError, CRUDService, ValidationErrors, item_method, no_auth_required, pass_app, private, filterable, job
 )
 import middlewared.sqlalchemy as sa
-from middlewared.utils import run, filter_list
+from middlewared.utils import run, filter_getattrs, filter_list
+from middlewared.utils.credentials import hashing_executor
 from middlewared.utils.osc import IS_FREEBSD
 from middlewared.validators import Email
 from middlewared.plugins.smb import SMBBuiltin
@@ -129,7 +130,7 @@ class UserService(CRUDService):
 
     class Config:
         datastore = 'account.bsdusers'
-        datastore_extend = 'user.user_extend'
+        datastore_extend_batch = 'user.user_extend_batch'
         datastore_extend_context = 'user.user_extend_context'
         datastore_prefix = 'bsdusr_'
         cli_namespace = 'account.user'
@@ -142,6 +143,8 @@ class UserService(CRUDService):
         ('rm', {'name': 'home_mode'}),
         ('rm', {'name': 'password'}),
         ('add', Dict('group', additional_attrs=True)),
+        # `null` if not requested with `"extra": {"groups": false}`
+        ('edit', {'name': 'groups', 'method': lambda x: setattr(x, 'null', True)}),
         ('add', Int('id')),
         ('add', Bool('builtin')),
         ('add', Bool('id_type_both')),
@@ -155,19 +158,24 @@ class UserService(CRUDService):
     @private
     async def user_extend_context(self, rows, extra):
         memberships = {}
-        res = await self.middleware.call(
-            'datastore.query', 'account.bsdgroupmembership',
-            [], {'prefix': 'bsdgrpmember_'}
-        )
+        if extra.get('groups', True):
+            res = await self.middleware.call(
+                'datastore.query', 'account.bsdgroupmembership',
+                [], {'prefix': 'bsdgrpmember_', 'relationships': False}
+            )
 
-        for i in res:
-            uid = i['user']['id']
-            if uid in memberships:
-                memberships[uid].append(i['group']['id'])
-            else:
-                memberships[uid] = [i['group']['id']]
+            for i in res:
+                uid = i['user_id']
+                if uid in memberships:
+                    memberships[uid].append(i['group_id'])
+                else:
+                    memberships[uid] = [i['group_id']]
 
-        return {"memberships": memberships}
+        return {
+            "memberships": memberships,
+            "groups": extra.get('groups', True),
+            "sshpubkey": extra.get('sshpubkey', True),
+        }
 
     @private
     def _read_authorized_keys(self, homedir):
@@ -180,17 +188,20 @@ class UserService(CRUDService):
         return rv
 
     @private
-    async def user_extend(self, user, ctx):
+    def user_extend_batch(self, users, ctx):
+        for user in users:
+            if ctx['groups']:
+                user['groups'] = ctx['memberships'].get(user['id'], [])
+            else:
+                user['groups'] = None
 
-        # Normalize email, empty is really null
-        if user['email'] == '':
-            user['email'] = None
+            # Get authorized keys
+            if ctx['sshpubkey']:
+                user['sshpubkey'] = self._read_authorized_keys(user['home'])
+            else:
+                user['sshpubkey'] = None
 
-        user['groups'] = ctx['memberships'].get(user['id'], [])
-        # Get authorized keys
-        user['sshpubkey'] = await self.middleware.run_in_thread(self._read_authorized_keys, user['home'])
-
-        return user
+        return users
 
     @private
     async def user_compress(self, user):
@@ -221,20 +232,16 @@ class UserService(CRUDService):
         `DS` - include users from Directory Service (LDAP or Active Directory) in results
 
         `"extra": {"search_dscache": true}` is a legacy method of querying for directory services users.
+
+        `groups` and `sshpubkey` (which requires reading the `authorized_keys` file from user's home directory) are
+        only retrieved for the users that match `query-filters` and only if they are included in `select` (or no
+        `select` is specified). They can be skipped (and returned as `null`) by passing
+        `{"extra": {"groups": false, "sshpubkey": false}}` in the query options.
         """
         if not filters:
             filters = []
 
         options = options or {}
-        options['extend'] = self._config.datastore_extend
-        options['extend_context'] = self._config.datastore_extend_context
-        options['prefix'] = self._config.datastore_prefix
-
-        datastore_options = options.copy()
-        datastore_options.pop('count', None)
-        datastore_options.pop('get', None)
-        datastore_options.pop('limit', None)
-        datastore_options.pop('offset', None)
 
         extra = options.get('extra', {})
         dssearch = extra.pop('search_dscache', False)
@@ -243,22 +250,42 @@ class UserService(CRUDService):
         if 'DS' in additional_information:
             additional_information.remove('DS')
 
+        if dssearch:
+            return await self.middleware.call('dscache.query', 'USERS', filters, options)
+
+        attrs = {
+            attr.split('.', 1)[0]
+            for attr in filter_getattrs(filters) | {o.lstrip('-') for o in options.get('order_by') or []}
+        }
+        select = options.get('select')
+
+        def requested(field):
+            if field in attrs:
+                # Needs to be known before filtering
+                return True
+
+            if options.get('count'):
+                return False
+
+            return extra.get(field, True) and (not select or field in select)
+
         username_sid = {}
-        if 'SMB' in additional_information:
+        if 'SMB' in additional_information and (requested('nt_name') or requested('sid')):
             for u in await self.middleware.call("smb.passdb_list", True):
                 username_sid.update({u['Unix username']: {
                     'nt_name': u['NT username'],
                     'sid': u['User SID'],
                 }})
 
-        if dssearch:
-            return await self.middleware.call('dscache.query', 'USERS', filters, options)
-
         result = await self.middleware.call(
-            'datastore.query', self._config.datastore, [], datastore_options
+            'datastore.query', self._config.datastore, [], {'prefix': self._config.datastore_prefix}
         )
 
         for entry in result:
+            # Normalize email, empty is really null
+            if entry['email'] == '':
+                entry['email'] = None
+
             entry.update({'local': True, 'id_type_both': False})
             if username_sid:
                 smb_entry = username_sid.get(entry['username'], {
@@ -271,6 +298,17 @@ class UserService(CRUDService):
             else:
                 entry.update({'nt_name': None, 'sid': None})
 
+        lazy = {'groups': requested('groups'), 'sshpubkey': requested('sshpubkey')}
+        if filters and not attrs & set(lazy):
+            # Only extend the users that will be returned
+            result = await self.middleware.run_in_thread(filter_list, result, filters)
+
+        if result:
+            context = await self.middleware.call(
+                self._config.datastore_extend_context, result, dict(extra, **lazy),
+            )
+            result = await self.middleware.run_in_thread(self.user_extend_batch, result, context)
+
         return await self.middleware.run_in_thread(
             filter_list, result, filters, options
         )
@@ -1069,7 +1107,7 @@ class UserService(CRUDService):
             return
         password = data.pop('password')
         if password:
-            data['unixhash'] = crypted_password(password)
+            data['unixhash'] = await self.middleware.run_in_executor(hashing_executor, crypted_password, password)
             # See http://samba.org.ru/samba/docs/man/manpages/smbpasswd.5.html
             data['smbhash'] = f'{data["username"]}:{data["uid"]}:{"X" * 32}'
             data['smbhash'] += f':{nt_password(password)}:[U         ]:LCT-{int(time.time()):X}:'
@@ -1433,16 +1471,22 @@ class GroupService(CRUDService):
                 )
             }
             to_remove = set(existing.keys()) - set(data['users'])
-            for i in to_remove:
-                await self.middleware.call('datastore.delete', 'account.bsdgroupmembership', existing[i]['id'])
+            operations = [
+                {'type': 'DELETE', 'name': 'account.bsdgroupmembership', 'id_or_filters': existing[i]['id']}
+                for i in to_remove
+            ]
 
             to_add = set(data['users']) - set(existing.keys()) - primary_users
-            for i in to_add:
-                await self.middleware.call(
-                    'datastore.insert',
-                    'account.bsdgroupmembership',
-                    {'bsdgrpmember_group': pk, 'bsdgrpmember_user': i},
-                )
+            operations.extend([
+                {
+                    'type': 'INSERT',
+                    'name': 'account.bsdgroupmembership',
+                    'data': {'bsdgrpmember_group': pk, 'bsdgrpmember_user': i},
+                }
+                for i in to_add
+            ])
+            if operations:
+                await self.middleware.call('datastore.bulk', operations)
 
         await self.middleware.call('service.reload', 'user')
 
@@ -1,3 +1,4 @@
+import asyncio
 from collections import defaultdict, namedtuple
 import copy
 from datetime import datetime, timezone
@@ -33,7 +34,6 @@ from middlewared.service import (
 from middlewared.service_exception import CallError
 import middlewared.sqlalchemy as sa
 from middlewared.validators import validate_schema
-from middlewared.utils import bisect
 from middlewared.utils.plugins import load_modules, load_classes
 from middlewared.utils.python import get_middlewared_dir
 
@@ -45,6 +45,12 @@ ALERT_SERVICES_FACTORIES = {}
 
 AlertSourceLock = namedtuple("AlertSourceLock", ["source_name", "expires_at"])
 
+# How many alert sources can run simultaneously
+ALERT_SOURCES_CONCURRENCY = 8
+# Alert sources that could not be started within this many seconds of `alert.process_alerts` start are postponed
+# until the next run
+ALERT_SOURCES_DEADLINE = 45
+
 SEND_ALERTS_ON_READY = False
 
 
@@ -130,6 +136,94 @@ class AlertPolicy:
         return gone_alerts, new_alerts
 
 
+class AlertStore:
+    """
+    Alerts indexed by uuid, by deduplication key `(node, source, klass, key)`, by source and by class. Iterating
+    yields alerts in the order they were added.
+
+    Alerts must not change their `uuid`, `node`, `source`, `klass` or `key` while they are in the store.
+    """
+
+    def __init__(self, alerts=()):
+        self.by_uuid = {}
+        self.by_key = {}
+        self.by_source = defaultdict(dict)
+        self.by_klass = defaultdict(dict)
+
+        for alert in alerts:
+            if alert.uuid not in self.by_uuid:
+                self.add(alert)
+
+    def __iter__(self):
+        return iter(self.by_uuid.values())
+
+    def __len__(self):
+        return len(self.by_uuid)
+
+    def __contains__(self, uuid):
+        return uuid in self.by_uuid
+
+    def get(self, uuid):
+        return self.by_uuid.get(uuid)
+
+    def get_by_key(self, node, source, klass, key):
+        return self.by_key.get((node, source, klass, key))
+
+    def source_alerts(self, source, node=None):
+        return [alert for alert in self.by_source.get(source, {}).values() if node is None or alert.node == node]
+
+    def klass_alerts(self, klass, node=None):
+        return [alert for alert in self.by_klass.get(klass, {}).values() if node is None or alert.node == node]
+
+    def add(self, alert):
+        """
+        Add `alert` replacing the alert with the same uuid (if any). The added alert becomes the last one.
+        """
+        existing_alert = self.by_uuid.get(alert.uuid)
+        if existing_alert is not None:
+            self.remove(existing_alert)
+
+        self.by_uuid[alert.uuid] = alert
+        self.by_key.setdefault(self._key(alert), alert)
+        self.by_source[alert.source][alert.uuid] = alert
+        self.by_klass[alert.klass][alert.uuid] = alert
+
+    def remove(self, alert):
+        alert = self.by_uuid.pop(alert.uuid)
+
+        source_alerts = self.by_source[alert.source]
+        source_alerts.pop(alert.uuid)
+        if not source_alerts:
+            self.by_source.pop(alert.source)
+
+        klass_alerts = self.by_klass[alert.klass]
+        klass_alerts.pop(alert.uuid)
+        if not klass_alerts:
+            self.by_klass.pop(alert.klass)
+
+        key = self._key(alert)
+        if self.by_key.get(key) is alert:
+            self.by_key.pop(key)
+            # Duplicate alert (i.e. loaded from the database) now becomes the one this key refers to
+            for other_alert in source_alerts.values():
+                if self._key(other_alert) == key:
+                    self.by_key[key] = other_alert
+                    break
+
+    def replace_source(self, source, alerts):
+        """
+        Replace all alerts produced by `source` with `alerts`.
+        """
+        for alert in list(self.by_source.get(source, {}).values()):
+            self.remove(alert)
+
+        for alert in alerts:
+            self.add(alert)
+
+    def _key(self, alert):
+        return alert.node, alert.source, alert.klass, alert.key
+
+
 def get_alert_level(alert, classes):
     return AlertLevel[classes.get(alert.klass.name, {}).get("level", alert.klass.level.name)]
 
@@ -192,6 +286,10 @@ class AlertService(Service):
 
         self.blocked_failover_alerts_until = 0
 
+        # Alert sources that are still running (possibly hung) along with their start time
+        self.alert_source_tasks = {}
+        self.alert_source_stats = {}
+
     @private
     async def load(self):
         main_sources_dir = os.path.join(get_middlewared_dir(), "alert", "source")
@@ -223,15 +321,20 @@ class AlertService(Service):
             if await self.middleware.call("failover.node") == "B":
                 self.node = "B"
 
-        self.alerts = []
+        self.alerts = AlertStore()
+        # uuid -> (database id, row) of the alerts that are stored in the database or `None` if the database
+        # contents are unknown and need to be rewritten completely.
+        self.persisted_alerts = None
         if load:
+            persisted_alerts = {}
             for alert in await self.middleware.call("datastore.query", "system.alert"):
-                del alert["id"]
+                id = alert.pop("id")
 
                 try:
                     alert["klass"] = AlertClass.class_by_name[alert["klass"]]
                 except KeyError:
                     self.logger.info("Alert class %r is no longer present", alert["klass"])
+                    persisted_alerts = None
                     continue
 
                 alert["_uuid"] = alert.pop("uuid")
@@ -241,8 +344,16 @@ class AlertService(Service):
 
                 alert = Alert(**alert)
 
-                if not any(a.uuid == alert.uuid for a in self.alerts):
-                    self.alerts.append(alert)
+                if alert.uuid in self.alerts:
+                    persisted_alerts = None
+                    continue
+
+                self.alerts.add(alert)
+                if persisted_alerts is not None:
+                    persisted_alerts[alert.uuid] = id, self.__alert_row(alert)
+
+            # Stale rows (duplicate or of unknown classes) will be removed by the next flush
+            self.persisted_alerts = persisted_alerts
 
         self.alert_source_last_run = defaultdict(lambda: datetime.min)
 
@@ -379,12 +490,6 @@ class AlertService(Service):
 
         return nodes
 
-    def __alert_by_uuid(self, uuid):
-        try:
-            return [a for a in self.alerts if a.uuid == uuid][0]
-        except IndexError:
-            return None
-
     @accepts(Str("uuid"))
     @returns()
     async def dismiss(self, uuid):
@@ -392,13 +497,12 @@ class AlertService(Service):
         Dismiss `id` alert.
         """
 
-        alert = self.__alert_by_uuid(uuid)
+        alert = self.alerts.get(uuid)
         if alert is None:
             return
 
         if issubclass(alert.klass, DismissableAlertClass):
-            related_alerts, unrelated_alerts = bisect(lambda a: (a.node, a.klass) == (alert.node, alert.klass),
-                                                      self.alerts)
+            related_alerts = self.alerts.klass_alerts(alert.klass, alert.node)
             left_alerts = await alert.klass(self.middleware).dismiss(related_alerts, alert)
             for deleted_alert in related_alerts:
                 if deleted_alert not in left_alerts:
@@ -424,7 +528,7 @@ class AlertService(Service):
         Restore `id` alert which had been dismissed.
         """
 
-        alert = self.__alert_by_uuid(uuid)
+        alert = self.alerts.get(uuid)
         if alert is None:
             return
 
@@ -625,6 +729,7 @@ class AlertService(Service):
             if source_lock.expires_at <= time.monotonic():
                 await self.unblock_source(k)
 
+        due = []
         for alert_source in ALERT_SOURCES.values():
             if product_type not in alert_source.products:
                 continue
@@ -635,81 +740,120 @@ class AlertService(Service):
             if not alert_source.schedule.should_run(datetime.utcnow(), self.alert_source_last_run[alert_source.name]):
                 continue
 
+            due.append(alert_source)
+
+        deadline = time.monotonic() + ALERT_SOURCES_DEADLINE
+
+        backup_node_sources = []
+        if run_on_backup_node:
+            backup_node_sources = [
+                alert_source.name
+                for alert_source in due
+                if alert_source.run_on_backup_node and not self.blocked_sources[alert_source.name]
+            ]
+        # Alert sources on the backup node run at the same time as the local ones
+        backup_node_results = asyncio.ensure_future(self.__run_sources_on_backup_node(backup_node_sources))
+
+        semaphore = asyncio.Semaphore(ALERT_SOURCES_CONCURRENCY)
+        results = await asyncio.gather(*[
+            self.__run_scheduled_source(alert_source, master_node, semaphore, deadline)
+            for alert_source in due
+        ])
+        backup_node_results = await backup_node_results
+
+        for alert_source, alerts_a in zip(due, results):
+            if alerts_a is None:
+                # Postponed until the next run
+                continue
+
+            for alert in alerts_a:
+                alert.node = master_node
+
+            alerts_b = []
+            if run_on_backup_node and alert_source.run_on_backup_node:
+                alerts_b = backup_node_results.get(alert_source.name)
+                if alerts_b is None:
+                    alerts_b = self.alerts.source_alerts(alert_source.name, backup_node)
+
+            for alert in alerts_b:
+                alert.node = backup_node
+
+            for alert in alerts_a + alerts_b:
+                self.__handle_alert(alert)
+
+            self.alerts.replace_source(alert_source.name, alerts_a + alerts_b)
+
+    async def __run_scheduled_source(self, alert_source, master_node, semaphore, deadline):
+        async with semaphore:
+            if time.monotonic() > deadline:
+                self.logger.debug("Postponing alert source %r because alert sources run deadline has passed",
+                                  alert_source.name)
+                return None
+
             self.alert_source_last_run[alert_source.name] = datetime.utcnow()
 
-            alerts_a = [alert
-                        for alert in self.alerts
-                        if alert.node == master_node and alert.source == alert_source.name]
-            locked = False
+            alerts = self.alerts.source_alerts(alert_source.name, master_node)
             if self.blocked_sources[alert_source.name]:
                 self.logger.debug("Not running alert source %r because it is blocked", alert_source.name)
-                locked = True
             else:
                 self.logger.trace("Running alert source: %r", alert_source.name)
 
                 try:
-                    alerts_a = await self.__run_source(alert_source.name)
+                    alerts = await self.__run_source_with_timeout(alert_source.name)
                 except UnavailableException:
                     pass
-            for alert in alerts_a:
-                alert.node = master_node
 
-            alerts_b = []
-            if run_on_backup_node and alert_source.run_on_backup_node:
-                try:
-                    alerts_b = [alert
-                                for alert in self.alerts
-                                if alert.node == backup_node and alert.source == alert_source.name]
-                    try:
-                        if not locked:
-                            alerts_b = await self.middleware.call("failover.call_remote", "alert.run_source",
-                                                                  [alert_source.name])
-
-                            alerts_b = [Alert(**dict({k: v for k, v in alert.items()
-                                                      if k in ["args", "datetime", "last_occurrence", "dismissed",
-                                                               "mail"]},
-                                                     klass=AlertClass.class_by_name[alert["klass"]],
-                                                     _source=alert["source"],
-                                                     _key=alert["key"]))
-                                        for alert in alerts_b]
-                    except CallError as e:
-                        if e.errno in [errno.ECONNABORTED, errno.ECONNREFUSED, errno.ECONNRESET, errno.EHOSTDOWN,
-                                       errno.ETIMEDOUT, CallError.EALERTCHECKERUNAVAILABLE]:
-                            pass
-                        else:
-                            raise
-                except ReserveFDException:
-                    self.logger.debug('Failed to reserve a privileged port')
-                except Exception:
-                    alerts_b = [
-                        Alert(AlertSourceRunFailedOnBackupNodeAlertClass,
-                              args={
-                                  "source_name": alert_source.name,
-                                  "traceback": traceback.format_exc(),
-                              },
-                              _source=alert_source.name)
-                    ]
+            return alerts
 
-            for alert in alerts_b:
-                alert.node = backup_node
+    async def __run_sources_on_backup_node(self, source_names):
+        """
+        Returns a dict of alerts for each alert source from `source_names` that ran on the backup node. Sources
+        that were not run (because the node is unreachable or the checker is unavailable) are not included.
+        """
+        if not source_names:
+            return {}
 
-            for alert in alerts_a + alerts_b:
-                self.__handle_alert(alert)
+        try:
+            try:
+                results = await self.middleware.call(
+                    "failover.call_remote", "alert.run_sources", [source_names, ALERT_SOURCES_DEADLINE],
+                    {"timeout": ALERT_SOURCES_DEADLINE + max(ALERT_SOURCES[name].run_timeout for name in source_names)},
+                )
+            except CallError as e:
+                if e.errno in [errno.ECONNABORTED, errno.ECONNREFUSED, errno.ECONNRESET, errno.EHOSTDOWN,
+                               errno.ETIMEDOUT]:
+                    return {}
+                else:
+                    raise
+        except ReserveFDException:
+            self.logger.debug('Failed to reserve a privileged port')
+            return {}
+        except Exception:
+            return {
+                source_name: [
+                    Alert(AlertSourceRunFailedOnBackupNodeAlertClass,
+                          args={
+                              "source_name": source_name,
+                              "traceback": traceback.format_exc(),
+                          },
+                          _source=source_name)
+                ]
+                for source_name in source_names
+            }
 
-            self.alerts = (
-                [a for a in self.alerts if a.source != alert_source.name] +
-                alerts_a +
-                alerts_b
-            )
+        return {
+            source_name: [Alert(**dict({k: v for k, v in alert.items()
+                                        if k in ["args", "datetime", "last_occurrence", "dismissed", "mail"]},
+                                       klass=AlertClass.class_by_name[alert["klass"]],
+                                       _source=alert["source"],
+                                       _key=alert["key"]))
+                          for alert in alerts]
+            for source_name, alerts in results.items()
+            if alerts is not None
+        }
 
     def __handle_alert(self, alert):
-        try:
-            existing_alert = [
-                a for a in self.alerts
-                if (a.node, a.source, a.klass, a.key) == (alert.node, alert.source, alert.klass, alert.key)
-            ][0]
-        except IndexError:
-            existing_alert = None
+        existing_alert = self.alerts.get_by_key(alert.node, alert.source, alert.klass, alert.key)
 
         if existing_alert is None:
             alert.uuid = self.__uuid()
@@ -728,7 +872,11 @@ class AlertService(Service):
             alert.dismissed = existing_alert.dismissed
 
     def __expire_alerts(self):
-        self.alerts = list(filter(lambda alert: not self.__should_expire_alert(alert), self.alerts))
+        for klass in list(self.alerts.by_klass):
+            if issubclass(klass, OneShotAlertClass) and klass.expires_after is not None:
+                for alert in self.alerts.klass_alerts(klass):
+                    if self.__should_expire_alert(alert):
+                        self.alerts.remove(alert)
 
     def __should_expire_alert(self, alert):
         if issubclass(alert.klass, OneShotAlertClass):
@@ -741,10 +889,41 @@ class AlertService(Service):
     async def run_source(self, source_name):
         try:
             return [dict(alert.__dict__, klass=alert.klass.name)
-                    for alert in await self.__run_source(source_name)]
+                    for alert in await self.__run_source_with_timeout(source_name)]
         except UnavailableException:
             raise CallError("This alert checker is unavailable", CallError.EALERTCHECKERUNAVAILABLE)
 
+    @private
+    async def run_sources(self, source_names, deadline=ALERT_SOURCES_DEADLINE):
+        """
+        Run `source_names` alert sources concurrently. Returns a dict with a list of alerts for each source or
+        `None` if the source is unavailable or could not be started within `deadline` seconds.
+        """
+        deadline = time.monotonic() + deadline
+        semaphore = asyncio.Semaphore(ALERT_SOURCES_CONCURRENCY)
+
+        async def run(source_name):
+            async with semaphore:
+                if time.monotonic() > deadline:
+                    return None
+
+                try:
+                    return [dict(alert.__dict__, klass=alert.klass.name)
+                            for alert in await self.__run_source_with_timeout(source_name)]
+                except UnavailableException:
+                    return None
+
+        return dict(zip(source_names, await asyncio.gather(*map(run, source_names))))
+
+    @accepts()
+    @returns(Dict('alert_source_stats', additional_attrs=True))
+    async def source_stats(self):
+        """
+        Returns run statistics for every alert source that has run on this node: the time of the `last_run`, its
+        `duration` in seconds and whether it has `timed_out`.
+        """
+        return self.alert_source_stats
+
     @private
     async def block_source(self, source_name, timeout=3600):
         if source_name not in ALERT_SOURCES:
@@ -766,6 +945,47 @@ class AlertService(Service):
         # This values come from observation from support of how long a M-series boot can take.
         self.blocked_failover_alerts_until = time.monotonic() + 900
 
+    async def __run_source_with_timeout(self, source_name):
+        """
+        Run alert source for no longer than its `run_timeout`. If it times out, it is left running in the
+        background (it can't be safely interrupted if it runs in a thread) and it will not be started again until
+        it finishes.
+        """
+        alert_source = ALERT_SOURCES[source_name]
+
+        if source_name in self.alert_source_tasks:
+            task, started_at = self.alert_source_tasks[source_name]
+        else:
+            task = asyncio.ensure_future(self.__run_source(source_name))
+            started_at = time.monotonic()
+            self.alert_source_tasks[source_name] = task, started_at
+            # Several callers may be waiting for the same task, the one that finishes last must not be left behind
+            task.add_done_callback(lambda task: self.alert_source_tasks.pop(source_name, None))
+
+        await asyncio.wait([task], timeout=alert_source.run_timeout)
+
+        timed_out = not task.done()
+        self.alert_source_stats[source_name] = {
+            "last_run": datetime.utcnow(),
+            "duration": time.monotonic() - started_at,
+            "timed_out": timed_out,
+        }
+
+        if timed_out:
+            self.logger.warning("Alert source %r has been running for %d seconds", source_name,
+                                time.monotonic() - started_at)
+            return [
+                Alert(AlertSourceRunFailedAlertClass,
+                      args={
+                          "source_name": source_name,
+                          "traceback": f"Alert check has been running for more than {alert_source.run_timeout} "
+                                       "seconds",
+                      },
+                      _source=source_name)
+            ]
+
+        return task.result()
+
     async def __run_source(self, source_name):
         alert_source = ALERT_SOURCES[source_name]
 
@@ -807,13 +1027,47 @@ class AlertService(Service):
             if await self.middleware.call('failover.status') == 'BACKUP':
                 return
 
-        await self.middleware.call("datastore.delete", "system.alert", [])
+        persisted_alerts = self.persisted_alerts
+        if persisted_alerts is None:
+            operations = [{"type": "DELETE", "name": "system.alert", "id_or_filters": []}]
+            persisted_alerts = {}
+        else:
+            operations = []
 
+        rows = {}
+        inserted = []
         for alert in self.alerts:
-            d = alert.__dict__.copy()
-            d["klass"] = d["klass"].name
-            del d["mail"]
-            await self.middleware.call("datastore.insert", "system.alert", d)
+            row = rows[alert.uuid] = self.__alert_row(alert)
+            if alert.uuid in persisted_alerts:
+                id, persisted_row = persisted_alerts[alert.uuid]
+                changed = {k: v for k, v in row.items() if persisted_row.get(k) != v}
+                if changed:
+                    operations.append({"type": "UPDATE", "name": "system.alert", "id_or_filters": id,
+                                       "data": changed})
+            else:
+                operations.append({"type": "INSERT", "name": "system.alert", "data": row})
+                inserted.append(alert.uuid)
+
+        removed = [id for uuid, (id, persisted_row) in persisted_alerts.items() if uuid not in rows]
+        if removed:
+            operations.append({"type": "DELETE", "name": "system.alert", "id_or_filters": [["id", "in", removed]]})
+
+        if not operations:
+            return
+
+        results = await self.middleware.call("datastore.bulk", operations)
+
+        ids = {uuid: id for uuid, (id, persisted_row) in persisted_alerts.items()}
+        ids.update(zip(inserted, [
+            result for operation, result in zip(operations, results) if operation["type"] == "INSERT"
+        ]))
+        self.persisted_alerts = {uuid: (ids[uuid], row) for uuid, row in rows.items()}
+
+    def __alert_row(self, alert):
+        row = copy.deepcopy(alert.__dict__)
+        row["klass"] = row["klass"].name
+        del row["mail"]
+        return row
 
     @private
     @accepts(Str("klass"), Any("args", null=True))
@@ -838,7 +1092,7 @@ class AlertService(Service):
 
         self.__handle_alert(alert)
 
-        self.alerts = [a for a in self.alerts if a.uuid != alert.uuid] + [alert]
+        self.alerts.add(alert)
 
         await self.middleware.call("alert.send_alerts")
 
@@ -854,8 +1108,7 @@ class AlertService(Service):
         if not issubclass(klass, OneShotAlertClass):
             raise CallError(f"Alert class {klass!r} is not a one-shot alert source")
 
-        related_alerts, unrelated_alerts = bisect(lambda a: (a.node, a.klass) == (self.node, klass),
-                                                  self.alerts)
+        related_alerts = self.alerts.klass_alerts(klass, self.node)
         left_alerts = await klass(self.middleware).delete(related_alerts, query)
         deleted = False
         for deleted_alert in related_alerts:
@@ -9,6 +9,7 @@ from passlib.hash import pbkdf2_sha256
 from middlewared.schema import accepts, Bool, Dict, Int, List, Str, Patch
 from middlewared.service import CRUDService, private, ValidationErrors
 import middlewared.sqlalchemy as sa
+from middlewared.utils.credentials import hashing_executor, VerifiedCredentialsCache
 
 
 class APIKeyModel(sa.Model):
@@ -54,6 +55,7 @@ class ApiKey:
 class ApiKeyService(CRUDService):
 
     keys = {}
+    verified_keys = VerifiedCredentialsCache()
 
     class Config:
         namespace = "api_key"
@@ -89,7 +91,7 @@ class ApiKeyService(CRUDService):
         await self._validate("api_key_create", data)
 
         key = self._generate()
-        data["key"] = pbkdf2_sha256.encrypt(key)
+        data["key"] = await self.middleware.run_in_executor(hashing_executor, pbkdf2_sha256.encrypt, key)
 
         data["created_at"] = datetime.utcnow()
 
@@ -130,7 +132,7 @@ class ApiKeyService(CRUDService):
         key = None
         if reset:
             key = self._generate()
-            new["key"] = pbkdf2_sha256.encrypt(key)
+            new["key"] = await self.middleware.run_in_executor(hashing_executor, pbkdf2_sha256.encrypt, key)
 
         await self.middleware.call(
             "datastore.update",
@@ -189,8 +191,11 @@ class ApiKeyService(CRUDService):
         except KeyError:
             return None
 
-        if not pbkdf2_sha256.verify(key, db_key["key"]):
-            return None
+        if not self.verified_keys.verified(key_id, key, db_key["key"]):
+            if not await self.middleware.run_in_executor(hashing_executor, pbkdf2_sha256.verify, key, db_key["key"]):
+                return None
+
+            self.verified_keys.add(key_id, key, db_key["key"])
 
         return ApiKey(db_key)
 
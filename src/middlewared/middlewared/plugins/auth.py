@@ -1,6 +1,4 @@
-import crypt
 from datetime import datetime, timedelta
-import hmac
 import random
 import re
 import socket
@@ -18,6 +16,7 @@ from middlewared.service import (
     pass_app, private, cli_private, CallError,
 )
 import middlewared.sqlalchemy as sa
+from middlewared.utils.credentials import hashing_executor, verify_unixhash, VerifiedCredentialsCache
 from middlewared.validators import Range
 
 
@@ -263,6 +262,8 @@ class AuthService(Service):
 
     token_manager = TokenManager()
 
+    verified_credentials = VerifiedCredentialsCache()
+
     def __init__(self, *args, **kwargs):
         super(AuthService, self).__init__(*args, **kwargs)
         self.session_manager.middleware = self.middleware
@@ -335,7 +336,16 @@ class AuthService(Service):
             return False
         if user['bsdusr_unixhash'] in ('x', '*'):
             return False
-        return hmac.compare_digest(crypt.crypt(password, user['bsdusr_unixhash']), user['bsdusr_unixhash'])
+
+        if self.verified_credentials.verified(username, password, user['bsdusr_unixhash']):
+            return True
+
+        if not await self.middleware.run_in_executor(hashing_executor, verify_unixhash, password,
+                                                     user['bsdusr_unixhash']):
+            return False
+
+        self.verified_credentials.add(username, password, user['bsdusr_unixhash'])
+        return True
 
     @accepts(Int('ttl', default=600, null=True), Dict('attrs', additional_attrs=True))
     @returns(Str('token'))
@@ -355,6 +365,20 @@ class AuthService(Service):
 
         return token.token
 
+    @private
+    def use_token(self, token_id):
+        """
+        Returns attributes of valid token `token_id` (and prolongs its lifetime) or `None`.
+        """
+        token = self.token_manager.get(token_id)
+        if token is None:
+            return None
+
+        token.notify_used()
+        return {
+            'attributes': token.attributes,
+        }
+
     @private
     def get_token(self, token_id):
         try:
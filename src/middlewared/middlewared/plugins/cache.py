@@ -1,15 +1,26 @@
 from middlewared.schema import Any, Str, Ref, Int, Dict, Bool, accepts
-from middlewared.service import Service, private, job, filterable
+from middlewared.service import Service, private, job, filterable, periodic
 from middlewared.utils import filter_list
 from middlewared.service_exception import CallError, MatchNotFound
 
-from collections import namedtuple
+from collections import defaultdict, namedtuple, OrderedDict
+import heapq
 import os
+import re
+import sys
+import threading
 import time
 import pwd
 import grp
 import json
 
+# Maximum number of entries with a timeout in local cache
+CACHE_SIZE = 10000
+# How often expired entries are removed from local cache (seconds)
+EXPIRE_INTERVAL = 60
+
+CacheEntry = namedtuple('Cache', ['value', 'timeout'])
+
 
 class ClusterCacheService(Service):
     tdb_options = {
@@ -173,6 +184,148 @@ class ClusterCacheService(Service):
         return filter_list(parsed, filters, options)
 
 
+def cache_namespace(key):
+    """
+    Keys are conventionally prefixed with the name of the plugin that owns them (`failover_status`, `update.applied`)
+    """
+    return re.split(r'[._]', key, 1)[0]
+
+
+def estimate_size(value, seen=None):
+    """
+    Approximate memory used by `value` and the objects it contains.
+    """
+    if seen is None:
+        seen = set()
+
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(estimate_size(k, seen) + estimate_size(v, seen) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(estimate_size(v, seen) for v in value)
+
+    return size
+
+
+class LocalCache:
+    """
+    Thread-safe cache holding at most `size` entries with a timeout. Least recently used of them are evicted first when
+    it is full. Entries without a timeout hold process state (e.g. `failover_status`) and are never evicted, they are
+    kept separately and do not count towards `size`.
+
+    Entries with a timeout are also kept in a heap ordered by expiration time so that `expire` only has to visit the
+    entries that have actually expired. Heap items of the entries that were overwritten or removed are skipped (and
+    the heap is rebuilt if there are too many of them).
+    """
+
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self.entries = OrderedDict()
+        self.persistent_entries = {}
+        self.expirations = []
+        self.stats = defaultdict(lambda: {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0})
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self.lock:
+            return self._get(key, time.monotonic()) is not None
+
+    def get(self, key):
+        """
+        Raises:
+            KeyError: not found in the cache or has expired
+        """
+        with self.lock:
+            stats = self.stats[cache_namespace(key)]
+            entry = self._get(key, time.monotonic())
+            if entry is None:
+                stats['misses'] += 1
+                raise KeyError(key)
+
+            stats['hits'] += 1
+            if entry.timeout:
+                self.entries.move_to_end(key)
+            return entry.value
+
+    def put(self, key, value, timeout=0):
+        with self.lock:
+            if timeout == 0:
+                self.entries.pop(key, None)
+                self.persistent_entries[key] = CacheEntry(value, timeout)
+                return
+
+            self.persistent_entries.pop(key, None)
+
+            timeout = time.monotonic() + timeout
+            heapq.heappush(self.expirations, (timeout, key))
+
+            self.entries[key] = CacheEntry(value, timeout)
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.size:
+                evicted, entry = self.entries.popitem(last=False)
+                self.stats[cache_namespace(evicted)]['evictions'] += 1
+
+            if len(self.expirations) > 2 * len(self.entries) + 100:
+                self.expirations = [(entry.timeout, k) for k, entry in self.entries.items()]
+                heapq.heapify(self.expirations)
+
+    def pop(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None) or self.persistent_entries.pop(key, None)
+
+        if entry is not None:
+            return entry.value
+
+    def expire(self):
+        """
+        Remove all the expired entries.
+        """
+        now = time.monotonic()
+        with self.lock:
+            while self.expirations and self.expirations[0][0] <= now:
+                timeout, key = heapq.heappop(self.expirations)
+                entry = self.entries.get(key)
+                if entry is not None and entry.timeout == timeout:
+                    del self.entries[key]
+                    self.stats[cache_namespace(key)]['expirations'] += 1
+
+    def namespaces_stats(self):
+        with self.lock:
+            entries = list(self.entries.items()) + list(self.persistent_entries.items())
+            result = {namespace: dict(stats, entries=0, bytes=0) for namespace, stats in self.stats.items()}
+
+        for key, entry in entries:
+            stats = result.setdefault(
+                cache_namespace(key),
+                {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'entries': 0, 'bytes': 0},
+            )
+            stats['entries'] += 1
+            stats['bytes'] += estimate_size(key) + estimate_size(entry.value)
+
+        return result
+
+    def _get(self, key, now):
+        entry = self.persistent_entries.get(key)
+        if entry is not None:
+            return entry
+
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+
+        if now >= entry.timeout:
+            del self.entries[key]
+            self.stats[cache_namespace(key)]['expirations'] += 1
+            return None
+
+        return entry
+
+
 class CacheService(Service):
 
     class Config:
@@ -180,8 +333,7 @@ class CacheService(Service):
 
     def __init__(self, *args, **kwargs):
         super(CacheService, self).__init__(*args, **kwargs)
-        self.__cache = {}
-        self.kv_tuple = namedtuple('Cache', ['value', 'timeout'])
+        self.__cache = LocalCache()
 
     @accepts(Str('key'))
     def has_key(self, key):
@@ -198,49 +350,37 @@ class CacheService(Service):
         Raises:
             KeyError: not found in the cache
         """
-
-        if self.__cache[key].timeout > 0:
-            self.get_timeout(key)
-
-        return self.__cache[key].value
+        return self.__cache.get(key)
 
     @accepts(Str('key'), Any('value'), Int('timeout', default=0))
     def put(self, key, value, timeout):
         """
         Put `key` of `value` in the cache.
-        """
-
-        if timeout != 0:
-            timeout = time.monotonic() + timeout
 
-        v = self.kv_tuple(value=value, timeout=timeout)
-        self.__cache[key] = v
+        When the cache is full, least recently used entry is evicted.
+        """
+        self.__cache.put(key, value, timeout)
 
     @accepts(Str('key'))
     def pop(self, key):
         """
         Removes and returns `key` from cache.
         """
-        cache = self.__cache.pop(key, None)
-
-        if cache is not None:
-            cache = cache.value
+        return self.__cache.pop(key)
 
-        return cache
-
-    @private
-    def get_timeout(self, key):
+    @accepts()
+    def stats(self):
         """
-        Check if 'key' has expired
+        Returns cache usage statistics for each keys namespace (the part of the key before the first `.` or `_`):
+        `hits`, `misses`, `evictions` (because the cache was full), `expirations`, number of `entries` currently
+        stored and approximate memory they use in `bytes`.
         """
-        now = time.monotonic()
-        value, timeout = self.__cache[key]
+        return self.__cache.namespaces_stats()
 
-        if now >= timeout:
-            # Bust the cache
-            del self.__cache[key]
-
-            raise KeyError(f'{key} has expired')
+    @periodic(EXPIRE_INTERVAL, run_on_start=False)
+    @private
+    def expire(self):
+        self.__cache.expire()
 
     @private
     def get_or_put(self, key, timeout, method):
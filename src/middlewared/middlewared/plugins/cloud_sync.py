@@ -1,6 +1,7 @@
 from middlewared.alert.base import Alert, AlertCategory, AlertClass, AlertLevel, OneShotAlertClass
 from middlewared.common.attachment import LockableFSAttachmentDelegate
 from middlewared.rclone.base import BaseRcloneRemote
+from middlewared.rclone.rcd import RcloneRcd, stats_progress
 from middlewared.schema import accepts, Bool, Cron, Dict, Int, List, Patch, Str
 from middlewared.service import (
     CallError, CRUDService, ValidationErrors, filterable, item_method, job, private, TaskPathService,
@@ -10,6 +11,7 @@ from middlewared.utils import Popen, run
 from middlewared.utils.lang import undefined
 from middlewared.utils.plugins import load_modules, load_classes
 from middlewared.utils.python import get_middlewared_dir
+from middlewared.utils.size import format_size
 from middlewared.validators import Range, Time
 from middlewared.validators import validate_schema
 
@@ -37,11 +39,21 @@ RE_TRANSF1 = re.compile(r"Transferred:\s*(?P<progress_1>.+), (?P<progress>[0-9]+
 RE_TRANSF2 = re.compile(r"Transferred:\s*(?P<progress_1>.+, )(?P<progress>[0-9]+)%, (?P<progress_2>.+)$")
 RE_CHECKS = re.compile(r"Checks:\s*(?P<checks>[0-9 /]+)(, (?P<progress>[0-9]+)%)?$")
 
+DROPBOX_RESTRICTED_CONTENT_MESSAGE = (
+    "Dropbox sync failed due to restricted content being present in one of the folders. This may include\n"
+    "copyrighted content or the DropBox manual PDF that appears in the home directory after signing up.\n"
+    "All other files were synchronized, but no deletions were performed as synchronization is considered\n"
+    "unsuccessful. Please inspect logs to determine which files are considered restricted and exclude them\n"
+    "from your synchronization. If you think that files are restricted erroneously, contact\n"
+    "Dropbox Support: https://www.dropbox.com/support\n"
+)
+
 REMOTES = {}
 
 OAUTH_URL = "https://www.truenas.com/oauth"
 
-RcloneConfigTuple = namedtuple("RcloneConfigTuple", ["config_path", "remote_path", "extra_args"])
+RcloneConfigTuple = namedtuple("RcloneConfigTuple", ["config_path", "remote_path", "extra_args", "sections",
+                                                     "filter_path"])
 
 logger = logging.getLogger(__name__)
 
@@ -69,6 +81,8 @@ class RcloneConfig:
 
         remote_path = None
         extra_args = []
+        filter_path = None
+        sections = {}
 
         if "attributes" in self.cloud_sync:
             config.update(dict(self.cloud_sync["attributes"], **await self.provider.get_task_extra(self.cloud_sync)))
@@ -80,16 +94,16 @@ class RcloneConfig:
             remote_path = f"remote:{remote_path}"
 
             if self.cloud_sync["encryption"]:
-                self.tmp_file.write("[encrypted]\n")
-                self.tmp_file.write("type = crypt\n")
-                self.tmp_file.write(f"remote = {remote_path}\n")
-                self.tmp_file.write("filename_encryption = {}\n".format(
-                    "standard" if self.cloud_sync["filename_encryption"] else "off"))
-                self.tmp_file.write("password = {}\n".format(
-                    rclone_encrypt_password(self.cloud_sync["encryption_password"])))
+                encrypted = {
+                    "type": "crypt",
+                    "remote": remote_path,
+                    "filename_encryption": "standard" if self.cloud_sync["filename_encryption"] else "off",
+                    "password": rclone_encrypt_password(self.cloud_sync["encryption_password"]),
+                }
                 if self.cloud_sync["encryption_salt"]:
-                    self.tmp_file.write("password2 = {}\n".format(
-                        rclone_encrypt_password(self.cloud_sync["encryption_salt"])))
+                    encrypted["password2"] = rclone_encrypt_password(self.cloud_sync["encryption_salt"])
+
+                sections["encrypted"] = encrypted
 
                 remote_path = "encrypted:/"
 
@@ -109,17 +123,21 @@ class RcloneConfig:
             self.tmp_file_filter = tempfile.NamedTemporaryFile(mode="w+")
             self.tmp_file_filter.write("\n".join(rclone_filter))
             self.tmp_file_filter.flush()
-            extra_args.extend(["--filter-from", self.tmp_file_filter.name])
+            filter_path = self.tmp_file_filter.name
+            extra_args.extend(["--filter-from", filter_path])
 
-        self.tmp_file.write("[remote]\n")
-        for k, v in config.items():
-            self.tmp_file.write(f"{k} = {v}\n")
+        sections["remote"] = config
+
+        for name, section in sections.items():
+            self.tmp_file.write(f"[{name}]\n")
+            for k, v in section.items():
+                self.tmp_file.write(f"{k} = {v}\n")
 
         self.tmp_file.flush()
 
         self.config = config
 
-        return RcloneConfigTuple(self.tmp_file.name, remote_path, extra_args)
+        return RcloneConfigTuple(self.tmp_file.name, remote_path, extra_args, sections, filter_path)
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         if self.config is not None:
@@ -153,7 +171,7 @@ def check_local_path(path, *, check_mountpoint=True, error_text_path=None):
             raise CallError(f"Directory {error_text_path!r} must reside within volume mount point")
 
 
-async def rclone(middleware, job, cloud_sync, dry_run):
+async def rclone(middleware, job, cloud_sync, dry_run, rcd=None):
     await middleware.call("network.general.will_perform_activity", "cloud_sync")
 
     if await middleware.call("filesystem.is_cluster_path", cloud_sync["path"]):
@@ -168,6 +186,11 @@ async def rclone(middleware, job, cloud_sync, dry_run):
         path = cloud_sync["path"]
         await middleware.run_in_thread(check_local_path, path)
 
+    if rcd is not None and (cloud_sync["bwlimit"] or cloud_sync["args"].strip()):
+        # Bandwidth limit and arbitrary command line arguments are process-wide settings
+        job.middleware.logger.debug("Cloud sync task options are not supported by rclone rcd, running rclone process")
+        rcd = None
+
     # Use a temporary file to store rclone file
     async with RcloneConfig(cloud_sync) as config:
         args = [
@@ -220,9 +243,11 @@ async def rclone(middleware, job, cloud_sync, dry_run):
                     dataset["properties"]["mountpoint"]["value"], ".zfs", "snapshot", snapshot_name, relpath
                 ))
 
-            args.extend([path, config.remote_path])
+            src, dst = path, config.remote_path
         else:
-            args.extend([config.remote_path, path])
+            src, dst = config.remote_path, path
+
+        args.extend([src, dst])
 
         env = {}
         for k, v in (
@@ -240,48 +265,28 @@ async def rclone(middleware, job, cloud_sync, dry_run):
 
         await run_script(job, env, cloud_sync["pre_script"], "Pre-script")
 
-        job.middleware.logger.debug("Running %r", args)
-        proc = await Popen(
-            args,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-        )
-        check_cloud_sync = asyncio.ensure_future(rclone_check_progress(job, proc))
-        cancelled_error = None
         try:
-            try:
-                await proc.wait()
-            except asyncio.CancelledError as e:
-                cancelled_error = e
-                try:
-                    await middleware.call("service.terminate_process", proc.pid)
-                except CallError as e:
-                    job.middleware.logger.warning(f"Error terminating rclone on cloud sync abort: {e!r}")
+            if rcd is None:
+                await rclone_process(middleware, job, args)
+                remote_config = None
+            else:
+                remote_config = await rclone_rcd(rcd, job, cloud_sync, config, src, dst, dry_run)
         finally:
-            await asyncio.wait_for(check_cloud_sync, None)
-
-        if snapshot:
-            await middleware.call("zfs.snapshot.delete", f"{snapshot['dataset']}@{snapshot['name']}")
-
-        if cancelled_error is not None:
-            raise cancelled_error
-        if proc.returncode != 0:
-            message = "".join(job.internal_data.get("messages", []))
-            if message and proc.returncode != 1:
-                if message and not message.endswith("\n"):
-                    message += "\n"
-                message += f"rclone failed with exit code {proc.returncode}"
-            raise CallError(message)
+            if snapshot:
+                await middleware.call("zfs.snapshot.delete", f"{snapshot['dataset']}@{snapshot['name']}")
 
         await run_script(job, env, cloud_sync["post_script"], "Post-script")
 
         refresh_credentials = REMOTES[cloud_sync["credentials"]["provider"]].refresh_credentials
         if refresh_credentials:
+            if remote_config is None:
+                ini = configparser.ConfigParser()
+                ini.read(config.config_path)
+                remote_config = ini["remote"]
+
             credentials_attributes = cloud_sync["credentials"]["attributes"].copy()
             updated = False
-            ini = configparser.ConfigParser()
-            ini.read(config.config_path)
-            for key, value in ini["remote"].items():
+            for key, value in remote_config.items():
                 if (key in refresh_credentials and
                         key in credentials_attributes and
                         credentials_attributes[key] != value):
@@ -294,6 +299,100 @@ async def rclone(middleware, job, cloud_sync, dry_run):
                 })
 
 
+async def rclone_process(middleware, job, args):
+    job.middleware.logger.debug("Running %r", args)
+    proc = await Popen(
+        args,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+    )
+    check_cloud_sync = asyncio.ensure_future(rclone_check_progress(job, proc))
+    cancelled_error = None
+    try:
+        try:
+            await proc.wait()
+        except asyncio.CancelledError as e:
+            cancelled_error = e
+            try:
+                await middleware.call("service.terminate_process", proc.pid)
+            except CallError as e:
+                job.middleware.logger.warning(f"Error terminating rclone on cloud sync abort: {e!r}")
+    finally:
+        await asyncio.wait_for(check_cloud_sync, None)
+
+    if cancelled_error is not None:
+        raise cancelled_error
+    if proc.returncode != 0:
+        message = "".join(job.internal_data.get("messages", []))
+        if message and proc.returncode != 1:
+            if message and not message.endswith("\n"):
+                message += "\n"
+            message += f"rclone failed with exit code {proc.returncode}"
+        raise CallError(message)
+
+
+async def rclone_rcd(rcd, job, cloud_sync, config, src, dst, dry_run):
+    """
+    Run cloud sync task using persistent `rclone rcd` and return the (possibly refreshed) remote config.
+    """
+    options = {"DryRun": dry_run}
+
+    if cloud_sync["attributes"].get("fast_list"):
+        options["UseListR"] = True
+
+    if cloud_sync["transfers"]:
+        options["Transfers"] = cloud_sync["transfers"]
+
+    params = {"_config": options}
+    if config.filter_path:
+        params["_filter"] = {"FilterFrom": [config.filter_path]}
+
+    def progress(stats):
+        job.set_progress(*stats_progress(stats))
+
+    def transferred(transfers):
+        for transfer in transfers:
+            if transfer["error"]:
+                message = f"{transfer['name']}: {transfer['error']}\n"
+                job.internal_data["messages"] = job.internal_data.get("messages", [])[-4:] + [message]
+                if "path/restricted_content/" in transfer["error"]:
+                    job.internal_data["dropbox__restricted_content"] = True
+            elif transfer["checked"]:
+                continue
+            else:
+                message = f"{transfer['name']}: Transferred {format_size(transfer['size'])}\n"
+
+            job.logs_fd.write(message.encode("utf-8", "ignore"))
+
+    async with rcd.remotes(config.sections) as remotes:
+        src = remotes.path(src)
+        dst = remotes.path(dst)
+        if cloud_sync["follow_symlinks"]:
+            # `-L` is an option of the local backend
+            if cloud_sync["direction"] == "PUSH":
+                src = f":local,copy_links:{src}"
+            else:
+                dst = f":local,copy_links:{dst}"
+
+        method = f"sync/{cloud_sync['transfer_mode'].lower()}"
+        job.middleware.logger.debug("Running rclone rcd %r from %r to %r", method, src, dst)
+        status, stats = await rcd.run_job(method, dict(params, srcFs=src, dstFs=dst), progress, transferred)
+
+        job.logs_fd.write(f"{stats_progress(stats)[1] or 'Nothing to transfer'}\n".encode("utf-8", "ignore"))
+
+        remote_config = await rcd.call("config/get", name=remotes.names["remote"])
+
+    if job.internal_data.get("dropbox__restricted_content"):
+        job.internal_data["messages"] = [DROPBOX_RESTRICTED_CONTENT_MESSAGE]
+        job.logs_fd.write(("\n" + DROPBOX_RESTRICTED_CONTENT_MESSAGE).encode("utf-8", "ignore"))
+
+    if not status["success"]:
+        message = "".join(job.internal_data.get("messages", []))
+        raise CallError(message + status["error"])
+
+    return remote_config
+
+
 async def run_script(job, env, hook, script_name):
     hook = hook.strip()
     if not hook:
@@ -453,16 +552,8 @@ async def rclone_check_progress(job, proc):
             job.logs_fd.write(result.encode("utf-8", "ignore"))
 
     if dropbox__restricted_content:
-        message = (
-            "Dropbox sync failed due to restricted content being present in one of the folders. This may include\n"
-            "copyrighted content or the DropBox manual PDF that appears in the home directory after signing up.\n"
-            "All other files were synchronized, but no deletions were performed as synchronization is considered\n"
-            "unsuccessful. Please inspect logs to determine which files are considered restricted and exclude them\n"
-            "from your synchronization. If you think that files are restricted erroneously, contact\n"
-            "Dropbox Support: https://www.dropbox.com/support\n"
-        )
-        job.internal_data["messages"] = [message]
-        job.logs_fd.write(("\n" + message).encode("utf-8", "ignore"))
+        job.internal_data["messages"] = [DROPBOX_RESTRICTED_CONTENT_MESSAGE]
+        job.logs_fd.write(("\n" + DROPBOX_RESTRICTED_CONTENT_MESSAGE).encode("utf-8", "ignore"))
 
 
 def rclone_encrypt_password(password):
@@ -733,6 +824,7 @@ class CloudSyncService(TaskPathService):
 
     local_fs_lock_manager = FsLockManager()
     remote_fs_lock_manager = FsLockManager()
+    rcd = RcloneRcd()
     share_task_type = 'CloudSync'
 
     class Config:
@@ -1073,6 +1165,37 @@ class CloudSyncService(TaskPathService):
     async def ls(self, config, path):
         await self.middleware.call("network.general.will_perform_activity", "cloud_sync")
 
+        try:
+            await self.rcd.start()
+        except CallError as e:
+            self.logger.warning("Unable to start rclone rcd, listing remote using rclone process: %r", e)
+            return await self.ls_process(config, path)
+
+        decrypt_filenames = config.get("encryption") and config.get("filename_encryption")
+        async with RcloneConfig(config) as config:
+            async with self.rcd.remotes(config.sections) as remotes:
+                try:
+                    result = (await self.rcd.call("operations/list", fs=remotes.path(f"remote:{path}"),
+                                                  remote=""))["list"]
+                except CallError as e:
+                    raise CallError(e.errmsg, extra={"excerpt": lsjson_error_excerpt(e.errmsg)})
+
+                if decrypt_filenames and result:
+                    try:
+                        decrypted = (await self.rcd.call("operations/list", fs=remotes.path("encrypted:"),
+                                                         remote="", opt={"showEncrypted": True}))["list"]
+                    except CallError:
+                        decrypted = []
+
+                    decrypted_names = {item["Encrypted"]: item["Name"] for item in decrypted}
+                    for item in result:
+                        if item["Name"] in decrypted_names:
+                            item["Decrypted"] = decrypted_names[item["Name"]]
+
+                return result
+
+    @private
+    async def ls_process(self, config, path):
         decrypt_filenames = config.get("encryption") and config.get("filename_encryption")
         async with RcloneConfig(config) as config:
             proc = await run(["rclone", "--config", config.config_path, "lsjson", "remote:" + path],
@@ -1109,6 +1232,7 @@ class CloudSyncService(TaskPathService):
         Dict(
             "cloud_sync_sync_options",
             Bool("dry_run", default=False),
+            Str("backend", enum=["PROCESS", "RCD"], default="PROCESS"),
             register=True,
         )
     )
@@ -1116,6 +1240,10 @@ class CloudSyncService(TaskPathService):
     async def sync(self, job, id, options):
         """
         Run the cloud_sync job `id`, syncing the local data to remote.
+
+        `backend` `RCD` runs the transfer in a persistent `rclone rcd` process instead of spawning a new `rclone`
+        process. Progress then reports exact transferred bytes, files, ETA and per-transfer rates in `extra`. Tasks
+        that use `bwlimit` or `args` are always run in a separate process.
         """
 
         cloud_sync = await self.get_instance(id)
@@ -1170,7 +1298,8 @@ class CloudSyncService(TaskPathService):
             async with self.remote_fs_lock_manager.lock(f"{credentials['id']}/{remote_path}", remote_direction):
                 job.set_progress(0, "Starting")
                 try:
-                    await rclone(self.middleware, job, cloud_sync, options["dry_run"])
+                    await rclone(self.middleware, job, cloud_sync, options["dry_run"],
+                                 self.rcd if options["backend"] == "RCD" else None)
                     if "id" in cloud_sync:
                         await self.middleware.call("alert.oneshot_delete", "CloudSyncTaskFailed", cloud_sync["id"])
                 except Exception:
@@ -1199,6 +1328,10 @@ class CloudSyncService(TaskPathService):
         await self.middleware.call("core.job_abort", cloud_sync["job"]["id"])
         return True
 
+    @private
+    async def terminate(self):
+        await self.rcd.stop()
+
     @accepts()
     async def providers(self):
         """
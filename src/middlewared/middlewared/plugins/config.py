@@ -53,6 +53,7 @@ class ConfigService(Service):
 
         If none of these options are set, the bundle is not generated and the database file is provided.
         """
+        await self.middleware.call('datastore.checkpoint')
 
         if all(not options[k] for k in options):
             bundle = False
@@ -249,7 +250,7 @@ class ConfigService(Service):
         seconds.
         """
         job.set_progress(0, 'Replacing database file')
-        shutil.copy('/data/factory-v1.db', FREENAS_DATABASE)
+        self.middleware.call_sync('datastore.replace', '/data/factory-v1.db', True)
 
         job.set_progress(10, 'Running database upload hooks')
         self.middleware.call_hook_sync('config.on_upload', FREENAS_DATABASE)
@@ -257,7 +258,8 @@ class ConfigService(Service):
         if self.middleware.call_sync('failover.licensed'):
             job.set_progress(30, 'Sending database to the other node')
             try:
-                self.middleware.call_sync('failover.send_small_file', FREENAS_DATABASE)
+                # Replaces the database on the other node the same way
+                self.middleware.call_sync('failover.send_database')
 
                 self.middleware.call_sync(
                     'failover.call_remote', 'core.call_hook', ['config.on_upload', [FREENAS_DATABASE]],
@@ -312,4 +314,5 @@ class ConfigService(Service):
         if not os.path.exists(dirname):
             os.makedirs(dirname)
 
+        self.middleware.call_sync('datastore.checkpoint')
         shutil.copy(FREENAS_DATABASE, newfile)
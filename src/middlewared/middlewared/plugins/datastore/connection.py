@@ -1,12 +1,23 @@
 from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+import os
 import re
+import shutil
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.util import LRUCache
 
-from middlewared.service import private, Service
+from middlewared.service import private, Service, threaded
 
 from middlewared.plugins.config import FREENAS_DATABASE
 
+COMPILED_CACHE_SIZE = 500
+# Number of read-only connections (and threads) serving `datastore.fetchall`
+READ_CONNECTIONS = 4
+# Only VACUUM on startup when at least this fraction of database pages is unused
+VACUUM_FREELIST_THRESHOLD = 0.25
+
 
 def regexp(expr, item):
     if item is None:
@@ -16,33 +27,77 @@ def regexp(expr, item):
     return reg.search(item) is not None
 
 
+class BulkResult:
+    """
+    Bind value placeholder that is replaced with the last insert rowid of the `index`-th statement of the same
+    `datastore.execute_write_bulk` batch.
+    """
+
+    __slots__ = ('index',)
+
+    def __init__(self, index):
+        self.index = index
+
+
 class DatastoreService(Service):
 
     class Config:
         private = True
 
+    # Single writer. Every statement that modifies the database is executed here, in order
     thread_pool = ThreadPoolExecutor(1)
+    read_thread_pool = ThreadPoolExecutor(READ_CONNECTIONS)
 
     engine = None
     connection = None
+    read_engine = None
+    compiled_cache = None
 
     @private
     async def setup(self):
         await self.middleware.run_in_executor(self.thread_pool, self._setup)
 
-    def _setup(self):
-        if self.engine is not None:
-            self.engine.dispose()
+    def _close(self):
+        if self.read_engine is not None:
+            self.read_engine.dispose()
+            self.read_engine = None
 
         if self.connection is not None:
             self.connection.close()
+            self.connection = None
+
+        if self.engine is not None:
+            self.engine.dispose()
+
+    def _setup(self):
+        self._close()
 
         self.engine = create_engine(f'sqlite:///{FREENAS_DATABASE}')
 
-        self.connection = self.engine.connect()
+        # `datastore.query` reuses prepared statements for queries of the same shape, cache their compiled form
+        self.compiled_cache = LRUCache(COMPILED_CACHE_SIZE)
+        self.connection = self.engine.connect().execution_options(compiled_cache=self.compiled_cache)
         self.connection.connection.create_function("REGEXP", 2, regexp)
         self.connection.connection.execute("PRAGMA foreign_keys=ON")
-        self.connection.connection.execute("VACUUM")
+        # Readers do not block the writer (and vice versa) in WAL mode
+        self.connection.connection.execute("PRAGMA journal_mode=WAL")
+
+        page_count = self.connection.connection.execute("PRAGMA page_count").fetchone()[0]
+        freelist_count = self.connection.connection.execute("PRAGMA freelist_count").fetchone()[0]
+        if page_count and freelist_count / page_count >= VACUUM_FREELIST_THRESHOLD:
+            self.logger.debug("Vacuuming database: %d of %d pages are free", freelist_count, page_count)
+            self.connection.connection.execute("VACUUM")
+
+        if FREENAS_DATABASE != ":memory:":
+            self.read_engine = create_engine(
+                f'sqlite:///file:{FREENAS_DATABASE}?mode=ro&uri=true',
+                poolclass=QueuePool, pool_size=READ_CONNECTIONS, max_overflow=0,
+                connect_args={"check_same_thread": False},
+            )
+            event.listen(self.read_engine, "connect", self._on_read_connect)
+
+    def _on_read_connect(self, dbapi_connection, connection_record):
+        dbapi_connection.create_function("REGEXP", 2, regexp)
 
     @private
     async def execute(self, *args):
@@ -54,6 +109,11 @@ class DatastoreService(Service):
         options.setdefault('ha_sync', True)
         options.setdefault('return_last_insert_rowid', False)
 
+        sql, binds = self._compile(stmt)
+
+        return await self.middleware.run_in_executor(self.thread_pool, self._execute_write, sql, binds, options)
+
+    def _compile(self, stmt):
         compiled = stmt.compile(self.engine)
 
         sql = compiled.string
@@ -62,12 +122,12 @@ class DatastoreService(Service):
             bind = compiled.binds[param]
             value = bind.value
             bind_processor = compiled.binds[param].type.bind_processor(self.engine.dialect)
-            if bind_processor:
+            if bind_processor and not isinstance(value, BulkResult):
                 binds.append(bind_processor(value))
             else:
                 binds.append(value)
 
-        return await self.middleware.run_in_executor(self.thread_pool, self._execute_write, sql, binds, options)
+        return sql, binds
 
     def _execute_write(self, sql, binds, options):
         result = self.connection.execute(sql, binds)
@@ -79,9 +139,105 @@ class DatastoreService(Service):
 
         return result
 
+    @private
+    async def execute_write_bulk(self, statements, options=None):
+        """
+        Execute a list of `(stmt, stmt_options)` in a single transaction. Consecutive statements that compile to the
+        same SQL are executed using `executemany`.
+
+        `stmt_options` may contain:
+        * `return_last_insert_rowid`: the result for this statement will be its last insert rowid. `BulkResult`
+          placeholders can be used to bind this value in the following statements.
+        * `rowcount`: the number of rows this statement is expected to affect. The transaction is rolled back if
+          the actual number differs.
+
+        Returns a list of results (last insert rowid or `None`) for each statement. The whole batch is passed to
+        the `datastore.post_execute_write_bulk` hook once.
+        """
+        options = options or {}
+        options.setdefault('ha_sync', True)
+
+        compiled = []
+        for stmt, stmt_options in statements:
+            sql, binds = self._compile(stmt)
+            compiled.append((sql, binds, stmt_options))
+
+        return await self.middleware.run_in_executor(self.thread_pool, self._execute_write_bulk, compiled, options)
+
+    def _execute_write_bulk(self, statements, options):
+        results = []
+        executed = []
+        with self.connection.begin():
+            i = 0
+            while i < len(statements):
+                sql, binds, stmt_options = statements[i]
+                binds = [results[v.index] if isinstance(v, BulkResult) else v for v in binds]
+
+                if stmt_options.get('return_last_insert_rowid'):
+                    result = self.connection.execute(sql, binds)
+                    self._check_bulk_rowcount(sql, result, stmt_options.get('rowcount'))
+                    results.append(result.lastrowid)
+                    executed.append([sql, [binds]])
+                    i += 1
+                    continue
+
+                group = [tuple(binds)]
+                rowcount = stmt_options.get('rowcount')
+                i += 1
+                while i < len(statements):
+                    next_sql, next_binds, next_options = statements[i]
+                    if (
+                        next_sql != sql or
+                        next_options.get('return_last_insert_rowid') or
+                        (next_options.get('rowcount') is None) != (rowcount is None)
+                    ):
+                        break
+
+                    group.append(tuple(results[v.index] if isinstance(v, BulkResult) else v for v in next_binds))
+                    if rowcount is not None:
+                        rowcount += next_options['rowcount']
+                    i += 1
+
+                if len(group) == 1:
+                    result = self.connection.execute(sql, list(group[0]))
+                else:
+                    result = self.connection.execute(sql, group)
+                self._check_bulk_rowcount(sql, result, rowcount)
+
+                results.extend([None] * len(group))
+                executed.append([sql, [list(binds) for binds in group]])
+
+        self.middleware.call_hook_inline("datastore.post_execute_write_bulk", executed, options)
+
+        return results
+
+    def _check_bulk_rowcount(self, sql, result, rowcount):
+        if rowcount is not None and result.rowcount != rowcount:
+            raise RuntimeError(f'{result.rowcount} rows were affected by {sql!r}, expected {rowcount}')
+
+    @private
+    async def execute_bulk(self, statements):
+        """
+        Execute a list of `[sql, [params, ...]]` in a single transaction. This is used to replay
+        `datastore.execute_write_bulk` batches on the other controller.
+        """
+        return await self.middleware.run_in_executor(self.thread_pool, self._execute_bulk, statements)
+
+    def _execute_bulk(self, statements):
+        with self.connection.begin():
+            for sql, params in statements:
+                if len(params) == 1:
+                    self.connection.execute(sql, params[0])
+                else:
+                    self.connection.execute(sql, [tuple(p) for p in params])
+
     @private
     async def fetchall(self, *args):
-        return await self.middleware.run_in_executor(self.thread_pool, self._fetchall, *args)
+        if self.read_engine is None:
+            # In-memory database can't be shared between connections
+            return await self.middleware.run_in_executor(self.thread_pool, self._fetchall, *args)
+
+        return await self.middleware.run_in_executor(self.read_thread_pool, self._fetchall_read, *args)
 
     def _fetchall(self, query, params=None):
         cursor = self.connection.execute(query, params or [])
@@ -89,3 +245,51 @@ class DatastoreService(Service):
             return cursor.fetchall()
         finally:
             cursor.close()
+
+    def _fetchall_read(self, query, params=None):
+        with self.read_engine.connect() as connection:
+            cursor = connection.execution_options(compiled_cache=self.compiled_cache).execute(query, params or [])
+            try:
+                return cursor.fetchall()
+            finally:
+                cursor.close()
+
+    @private
+    @threaded(thread_pool)
+    def checkpoint(self):
+        """
+        Move all changes from the write-ahead log into the database file itself. Must be called before the
+        database file is copied or replaced.
+        """
+        self._checkpoint()
+
+    def _checkpoint(self):
+        self.connection.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    @private
+    @threaded(thread_pool)
+    def replace(self, path, keep_source=False):
+        """
+        Replace the database file with `path` (copy it if `keep_source` is true) and reopen it.
+
+        Connections to the old database are closed first and its `-wal` and `-shm` files are removed so that they are
+        not applied to the new database.
+        """
+        self._checkpoint()
+        self._close()
+
+        if keep_source:
+            shutil.copy(path, FREENAS_DATABASE)
+        else:
+            os.rename(path, FREENAS_DATABASE)
+
+        for suffix in ('-wal', '-shm'):
+            with suppress(FileNotFoundError):
+                os.unlink(FREENAS_DATABASE + suffix)
+
+        self._setup()
+
+    @private
+    async def terminate(self):
+        if self.connection is not None:
+            await self.middleware.run_in_executor(self.thread_pool, self._checkpoint)
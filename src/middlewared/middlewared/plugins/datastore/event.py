@@ -51,6 +51,23 @@ class DatastoreService(Service):
                 fields=fields[0],
             )
 
+    async def send_update_events_bulk(self, datastore, ids):
+        for options in self.events[datastore]:
+            query_options = {}
+            if options.get("extra"):
+                query_options["extra"] = options["extra"]
+
+            # Rows that got deleted in the meantime are skipped just like in `send_update_events`
+            for fields in await self.middleware.call(
+                f"{options['plugin']}.query", [[options["id"], "in", ids]], query_options,
+            ):
+                await self._send_event(
+                    options,
+                    "CHANGED",
+                    id=fields[options["id"]],
+                    fields=fields,
+                )
+
     async def send_delete_events(self, datastore, id):
         for options in self.events[datastore]:
             await self._send_event(
@@ -1,11 +1,19 @@
 import operator
 
+from sqlalchemy import bindparam
+
+from middlewared.utils.lang import undefined
+
 from .schema import SchemaMixin
 
 
 def in_(col, value):
     has_nulls = None in value
     value = [v for v in value if v is not None]
+    return in_expr(col, value, has_nulls)
+
+
+def in_expr(col, value, has_nulls):
     expr = col.in_(value)
     if has_nulls:
         expr = expr | (col == None)  # noqa
@@ -15,14 +23,76 @@ def in_(col, value):
 def nin(col, value):
     has_nulls = None in value
     value = [v for v in value if v is not None]
+    return nin_expr(col, value, has_nulls)
+
+
+def nin_expr(col, value, has_nulls):
     expr = ~col.in_(value)
     if has_nulls:
         expr = expr & (col != None)  # noqa
     return expr
 
 
+def filter_bind_value(op, value):
+    """
+    Returns the value that should be bound as a query parameter for filter operation `op` or `undefined` if
+    `value` affects the SQL text itself (`NULL` comparisons, empty `IN` lists).
+    """
+    if op in ('in', 'nin'):
+        value = [v for v in value if v is not None]
+        if not value:
+            return undefined
+        return value
+
+    if value is None:
+        return undefined
+
+    return value
+
+
+def filters_shape(filters):
+    """
+    Returns a hashable representation of `filters` that does not depend on bound values: two filter lists with
+    the same shape produce the same SQL text and only differ in query parameters.
+    """
+    shape = []
+    for f in filters:
+        if not isinstance(f, (list, tuple)):
+            raise ValueError('Filter must be a list or tuple: {0}'.format(f))
+        if len(f) == 3:
+            name, op, value = f
+            if op in ('in', 'nin'):
+                shape.append((name, op, None in value, filter_bind_value(op, value) is undefined))
+            else:
+                shape.append((name, op, value is None))
+        elif len(f) == 2:
+            shape.append((f[0], filters_shape(f[1])))
+        else:
+            raise ValueError('Invalid filter {0}'.format(f))
+    return tuple(shape)
+
+
+def filters_params(filters, params):
+    """
+    Fill `params` with bound values for `filters` the same way `FilterMixin._filters_to_queryset` does.
+    """
+    for f in filters:
+        if len(f) == 3:
+            name, op, value = f
+            value = filter_bind_value(op, value)
+            if value is not undefined:
+                params[f'filter_{len(params)}'] = value
+        else:
+            filters_params(f[1], params)
+    return params
+
+
 class FilterMixin(SchemaMixin):
-    def _filters_to_queryset(self, filters, table, prefix, aliases):
+    def _filters_to_queryset(self, filters, table, prefix, aliases, params=None):
+        """
+        If `params` dict is passed, filter values are not embedded into the resulting expressions. They are
+        replaced with bind parameters and their values are stored in `params` instead.
+        """
         opmap = {
             '=': operator.eq,
             '!=': operator.ne,
@@ -53,13 +123,24 @@ class FilterMixin(SchemaMixin):
                 if op not in opmap:
                     raise ValueError('Invalid operation: {0}'.format(op))
 
-                q = opmap[op](col, value)
+                bind_value = undefined if params is None else filter_bind_value(op, value)
+                if bind_value is undefined:
+                    q = opmap[op](col, value)
+                else:
+                    key = f'filter_{len(params)}'
+                    params[key] = bind_value
+                    if op in ('in', 'nin'):
+                        bind = bindparam(key, type_=col.type, expanding=True)
+                        q = {'in': in_expr, 'nin': nin_expr}[op](col, bind, None in value)
+                    else:
+                        q = opmap[op](col, bindparam(key, type_=col.type))
+
                 rv.append(q)
             elif len(f) == 2:
                 op, value = f
                 if op == 'OR':
                     or_value = None
-                    for value in self._filters_to_queryset(value, table, prefix, aliases):
+                    for value in self._filters_to_queryset(value, table, prefix, aliases, params):
                         if or_value is None:
                             or_value = value
                         else:
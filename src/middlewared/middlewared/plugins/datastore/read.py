@@ -1,4 +1,5 @@
 from collections import defaultdict
+import functools
 import re
 
 from sqlalchemy import and_, func, select
@@ -6,15 +7,23 @@ from sqlalchemy.sql import Alias
 from sqlalchemy.sql.elements import UnaryExpression
 from sqlalchemy.sql.expression import nullsfirst, nullslast
 from sqlalchemy.sql.operators import desc_op, nullsfirst_op, nullslast_op
+from sqlalchemy.util import LRUCache
 
 from middlewared.schema import accepts, Bool, Dict, Int, List, Ref, Str
 from middlewared.service import Service
 from middlewared.service_exception import MatchNotFound
+from middlewared.utils.asyncio_ import asyncio_map
 
-from .filter import FilterMixin
+from .filter import FilterMixin, filters_params, filters_shape
 from .schema import SchemaMixin
 
 
+# How many rows can be extended simultaneously when `extend` (and not `extend_batch`) is used
+EXTEND_CONCURRENCY = 10
+# How many distinct query shapes to keep prepared statements for
+QUERY_CACHE_SIZE = 500
+
+
 def regexp(expr, item):
     reg = re.compile(expr, re.I)
     return reg.search(item) is not None
@@ -25,6 +34,14 @@ class DatastoreService(Service, FilterMixin, SchemaMixin):
     class Config:
         private = True
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Prepared `select` statements keyed by table and query shape. Reusing the very same statement object lets
+        # `datastore.fetchall` hit its compiled SQL cache so only the parameters need to be bound.
+        self.query_cache = LRUCache(QUERY_CACHE_SIZE)
+        self.joins_cache = {}
+        self.row_serializers = {}
+
     @accepts(
         Str('name'),
         List('query-filters', register=True),
@@ -32,6 +49,7 @@ class DatastoreService(Service, FilterMixin, SchemaMixin):
             'query-options',
             Bool('relationships', default=True),
             Str('extend', default=None, null=True),
+            Str('extend_batch', default=None, null=True),
             Str('extend_context', default=None, null=True),
             Str('prefix', default=None, null=True),
             Dict('extra', additional_attrs=True),
@@ -64,6 +82,10 @@ class DatastoreService(Service, FilterMixin, SchemaMixin):
 
         `[ ['username', '=', 'root' ] ]`
 
+        `extend` method is called for every row (with up to `EXTEND_CONCURRENCY` rows being extended at the same
+        time) while `extend_batch` method, if specified, is called once with the list of all rows and must return
+        the list of extended rows. Both receive `extend_context` value as a second argument if it is specified.
+
         .. examples(websocket)::
 
           Querying for username "root" and returning a single item:
@@ -83,13 +105,69 @@ class DatastoreService(Service, FilterMixin, SchemaMixin):
         options = options.copy()
 
         aliases = {}
+        if options['relationships'] and not options['count']:
+            aliases = self._get_queryset_joins(table)
+
+        try:
+            key = (
+                name, filters_shape(filters), options['relationships'], options['count'], options['prefix'],
+                tuple(options['order_by']), options['offset'], options['limit'],
+            )
+            hash(key)
+        except (TypeError, ValueError):
+            # Malformed or unhashable filters, `_filters_to_queryset` will report them
+            key = None
+
+        params = {}
+        qs = self.query_cache.get(key) if key is not None else None
+        if qs is None:
+            qs = self._build_query(table, filters, options, aliases, params)
+            if key is not None:
+                self.query_cache[key] = qs
+        else:
+            filters_params(filters, params)
+
+        if options['count']:
+            return (await self.middleware.call("datastore.fetchall", qs, params))[0][0]
+
+        result = await self.middleware.call("datastore.fetchall", qs, params)
+
+        relationships = [{} for row in result]
+        if options['relationships']:
+            # This will only fetch many-to-many relationships for primary table, not for joins, but that's enough
+            relationships = await self._fetch_many_to_many(table, result)
+
+        result = await self._queryset_serialize(
+            result,
+            table, aliases, relationships, options['extend'], options['extend_batch'], options['extend_context'],
+            options['prefix'], options['select'], options['extra'],
+        )
+
+        if options['get']:
+            try:
+                return result[0]
+            except IndexError:
+                raise MatchNotFound() from None
+
+        return result
+
+    @accepts(Str('name'), Ref('query-options'))
+    async def config(self, name, options):
+        """
+        Get configuration settings object for a given `name`.
+
+        This is a shortcut for `query(name, {"get": true})`.
+        """
+        options['get'] = True
+        return await self.query(name, [], options)
+
+    def _build_query(self, table, filters, options, aliases, params):
         if options['count']:
             qs = select([func.count(self._get_pk(table))])
         else:
             columns = list(table.c)
             from_ = table
             if options['relationships']:
-                aliases = self._get_queryset_joins(table)
                 for foreign_key, alias in aliases.items():
                     columns.extend(list(alias.c))
                     from_ = from_.outerjoin(alias, alias.c[foreign_key.column.name] == foreign_key.parent)
@@ -99,10 +177,10 @@ class DatastoreService(Service, FilterMixin, SchemaMixin):
         prefix = options['prefix']
 
         if filters:
-            qs = qs.where(and_(*self._filters_to_queryset(filters, table, prefix, aliases)))
+            qs = qs.where(and_(*self._filters_to_queryset(filters, table, prefix, aliases, params)))
 
         if options['count']:
-            return (await self.middleware.call("datastore.fetchall", qs))[0][0]
+            return qs
 
         order_by = options['order_by']
         if order_by:
@@ -154,38 +232,16 @@ class DatastoreService(Service, FilterMixin, SchemaMixin):
         if options['limit']:
             qs = qs.limit(options['limit'])
 
-        result = await self.middleware.call("datastore.fetchall", qs)
-
-        relationships = [{} for row in result]
-        if options['relationships']:
-            # This will only fetch many-to-many relationships for primary table, not for joins, but that's enough
-            relationships = await self._fetch_many_to_many(table, result)
-
-        result = await self._queryset_serialize(
-            result,
-            table, aliases, relationships, options['extend'], options['extend_context'], options['prefix'],
-            options['select'], options['extra'],
-        )
-
-        if options['get']:
-            try:
-                return result[0]
-            except IndexError:
-                raise MatchNotFound() from None
-
-        return result
-
-    @accepts(Str('name'), Ref('query-options'))
-    async def config(self, name, options):
-        """
-        Get configuration settings object for a given `name`.
-
-        This is a shortcut for `query(name, {"get": true})`.
-        """
-        options['get'] = True
-        return await self.query(name, [], options)
+        return qs
 
     def _get_queryset_joins(self, table):
+        try:
+            return self.joins_cache[table]
+        except KeyError:
+            result = self.joins_cache[table] = self._build_queryset_joins(table)
+            return result
+
+    def _build_queryset_joins(self, table):
         result = {}
         for column in table.c:
             if column.foreign_keys:
@@ -197,12 +253,13 @@ class DatastoreService(Service, FilterMixin, SchemaMixin):
 
                 result[foreign_key] = alias
                 if foreign_key.column.table != (table.original if isinstance(table, Alias) else table):
-                    result.update(self._get_queryset_joins(alias))
+                    result.update(self._build_queryset_joins(alias))
 
         return result
 
     async def _queryset_serialize(
-        self, qs, table, aliases, relationships, extend, extend_context, field_prefix, select, extra_options,
+        self, qs, table, aliases, relationships, extend, extend_batch, extend_context, field_prefix, select,
+        extra_options,
     ):
         rows = []
         for i, row in enumerate(qs):
@@ -213,10 +270,23 @@ class DatastoreService(Service, FilterMixin, SchemaMixin):
         else:
             extend_context_value = None
 
-        return [
-            await self._extend(data, extend, extend_context, extend_context_value, select)
-            for data in rows
-        ]
+        if extend_batch and rows:
+            if extend_context:
+                rows = await self.middleware.call(extend_batch, rows, extend_context_value)
+            else:
+                rows = await self.middleware.call(extend_batch, rows)
+        elif extend and rows:
+            rows = await asyncio_map(
+                functools.partial(self._extend, extend=extend, extend_context=extend_context,
+                                  extend_context_value=extend_context_value),
+                rows,
+                EXTEND_CONCURRENCY,
+            )
+
+        if not select:
+            return rows
+        else:
+            return [{k: v for k, v in data.items() if k in select} for data in rows]
 
     def _serialize(self, obj, table, aliases, relationships, field_prefix):
         data = self._serialize_row(obj, table, aliases)
@@ -224,29 +294,49 @@ class DatastoreService(Service, FilterMixin, SchemaMixin):
 
         return {self._strip_prefix(k, field_prefix): v for k, v in data.items()}
 
-    async def _extend(self, data, extend, extend_context, extend_context_value, select):
-        if extend:
-            if extend_context:
-                data = await self.middleware.call(extend, data, extend_context_value)
-            else:
-                data = await self.middleware.call(extend, data)
-
-        if not select:
-            return data
+    async def _extend(self, data, extend, extend_context, extend_context_value):
+        if extend_context:
+            return await self.middleware.call(extend, data, extend_context_value)
         else:
-            return {k: v for k, v in data.items() if k in select}
+            return await self.middleware.call(extend, data)
 
     def _strip_prefix(self, k, field_prefix):
         return k[len(field_prefix):] if field_prefix and k.startswith(field_prefix) else k
 
     def _serialize_row(self, obj, table, aliases):
-        data = {}
+        columns, foreign_keys = self._get_row_serializer(table, aliases)
 
-        for column in table.c:
-            # aliases == {} when we are loading without relationships, let's leave fk values in that case
-            if not column.foreign_keys or not aliases:
-                data[str(column.name)] = obj[column]
+        data = {name: obj[column] for name, column in columns}
+
+        for name, column, alias, alias_pk in foreign_keys:
+            data[name] = (
+                self._serialize_row(obj, alias, aliases)
+                if obj[column] is not None and obj[alias_pk] is not None
+                else None
+            )
 
+        return data
+
+    def _get_row_serializer(self, table, aliases):
+        """
+        Returns `(columns, foreign_keys)` tuples describing how to serialize a `table` row so that we do not need
+        to inspect table columns and foreign keys for every row.
+        """
+        # `aliases` are cached per table by `_get_queryset_joins` so their identity is stable
+        key = (table, id(aliases) if aliases else None)
+        try:
+            return self.row_serializers[key]
+        except KeyError:
+            pass
+
+        # aliases == {} when we are loading without relationships, let's leave fk values in that case
+        columns = tuple(
+            (str(column.name), column)
+            for column in table.c
+            if not column.foreign_keys or not aliases
+        )
+
+        foreign_keys = []
         for foreign_key, alias in aliases.items():
             column = foreign_key.parent
 
@@ -256,13 +346,10 @@ class DatastoreService(Service, FilterMixin, SchemaMixin):
             if not column.name.endswith('_id'):
                 raise RuntimeError('Foreign key column must end with _id')
 
-            data[column.name[:-3]] = (
-                self._serialize_row(obj, alias, aliases)
-                if obj[column] is not None and obj[self._get_pk(alias)] is not None
-                else None
-            )
+            foreign_keys.append((column.name[:-3], column, alias, self._get_pk(alias)))
 
-        return data
+        result = self.row_serializers[key] = columns, tuple(foreign_keys)
+        return result
 
     async def _fetch_many_to_many(self, table, rows):
         pk = self._get_pk(table)
@@ -1,9 +1,12 @@
 from sqlalchemy import and_, types
 from sqlalchemy.sql import sqltypes
 
-from middlewared.schema import accepts, Any, Bool, Dict, Str
+from collections import defaultdict
+
+from middlewared.schema import accepts, Any, Bool, Dict, List, Str
 from middlewared.service import Service
 
+from .connection import BulkResult
 from .filter import FilterMixin
 from .schema import SchemaMixin
 
@@ -24,7 +27,9 @@ real world testing, this has shown to take roughly 82 seconds to update
 The database was on a NVMe disk. The solution to this is adding the
 `send_events` key. If this is set to False, then an event will not be
 sent for the db operation. It is the callers responsibility to emit an event
-after all the db operations are complete.
+after all the db operations are complete. Alternatively, `datastore.bulk`
+with `coalesce_events` can be used: it sends a single event per changed row
+and queries all updated rows at once.
 """
 
 
@@ -48,17 +53,9 @@ class DatastoreService(Service, FilterMixin, SchemaMixin):
         Insert a new entry to `name`.
         """
         table = self._get_table(name)
-        insert, relationships = self._extract_relationships(table, options['prefix'], data)
-
-        for column in table.c:
-            if column.default is not None:
-                insert.setdefault(column.name, column.default.arg)
-            if not column.nullable:
-                if isinstance(column.type, (types.String, types.Text)):
-                    insert.setdefault(column.name, '')
+        insert, relationships, return_last_insert_rowid = self._prepare_insert(table, options['prefix'], data)
 
         pk_column = self._get_pk(table)
-        return_last_insert_rowid = type(pk_column.type) == sqltypes.Integer
         result = await self.middleware.call(
             'datastore.execute_write',
             table.insert().values(**insert),
@@ -79,6 +76,19 @@ class DatastoreService(Service, FilterMixin, SchemaMixin):
 
         return pk
 
+    def _prepare_insert(self, table, prefix, data):
+        insert, relationships = self._extract_relationships(table, prefix, data)
+
+        for column in table.c:
+            if column.default is not None:
+                insert.setdefault(column.name, column.default.arg)
+            if not column.nullable:
+                if isinstance(column.type, (types.String, types.Text)):
+                    insert.setdefault(column.name, '')
+
+        return_last_insert_rowid = type(self._get_pk(table).type) == sqltypes.Integer
+        return insert, relationships, return_last_insert_rowid
+
     @accepts(
         Str('name'),
         Any('id_or_filters'),
@@ -95,23 +105,7 @@ class DatastoreService(Service, FilterMixin, SchemaMixin):
         Update an entry `id` in `name`.
         """
         table = self._get_table(name)
-        data = data.copy()
-
-        if isinstance(id_or_filters, list):
-            rows = await self.middleware.call('datastore.query', name, id_or_filters, {'prefix': options['prefix']})
-            if len(rows) != 1:
-                raise RuntimeError(f'{len(rows)} found, expecting one')
-
-            id = rows[0][self._get_pk(table).name]
-        else:
-            id = id_or_filters
-
-        for column in table.c:
-            if column.foreign_keys:
-                if column.name[:-3] in data:
-                    data[column.name] = data.pop(column.name[:-3])
-
-        update, relationships = self._extract_relationships(table, options['prefix'], data)
+        id, update, relationships = await self._prepare_update(name, table, id_or_filters, options['prefix'], data)
 
         if update:
             result = await self.middleware.call(
@@ -131,6 +125,26 @@ class DatastoreService(Service, FilterMixin, SchemaMixin):
 
         return id
 
+    async def _prepare_update(self, name, table, id_or_filters, prefix, data):
+        data = data.copy()
+
+        if isinstance(id_or_filters, list):
+            rows = await self.middleware.call('datastore.query', name, id_or_filters, {'prefix': prefix})
+            if len(rows) != 1:
+                raise RuntimeError(f'{len(rows)} found, expecting one')
+
+            id = rows[0][self._get_pk(table).name]
+        else:
+            id = id_or_filters
+
+        for column in table.c:
+            if column.foreign_keys:
+                if column.name[:-3] in data:
+                    data[column.name] = data.pop(column.name[:-3])
+
+        update, relationships = self._extract_relationships(table, prefix, data)
+        return id, update, relationships
+
     def _extract_relationships(self, table, prefix, data):
         relationships = self._get_relationships(table)
 
@@ -145,7 +159,13 @@ class DatastoreService(Service, FilterMixin, SchemaMixin):
 
         return insert, insert_relationships
 
-    async def _handle_relationships(self, pk, relationships):
+    async def _handle_relationships(self, pk, relationships, options=None):
+        statements = self._relationships_statements(pk, relationships)
+        if statements:
+            await self.middleware.call('datastore.execute_write_bulk', statements, options)
+
+    def _relationships_statements(self, pk, relationships):
+        statements = []
         for relationship, values in relationships:
             assert len(relationship.synchronize_pairs) == 1
             assert len(relationship.secondary_synchronize_pairs) == 1
@@ -153,19 +173,18 @@ class DatastoreService(Service, FilterMixin, SchemaMixin):
             local_pk, relationship_local_pk = relationship.synchronize_pairs[0]
             remote_pk, relationship_remote_pk = relationship.secondary_synchronize_pairs[0]
 
-            await self.middleware.call(
-                'datastore.execute_write',
-                relationship_local_pk.table.delete().where(relationship_local_pk == pk)
-            )
+            statements.append((relationship_local_pk.table.delete().where(relationship_local_pk == pk), {}))
 
             for value in values:
-                await self.middleware.call(
-                    'datastore.execute_write',
+                statements.append((
                     relationship_local_pk.table.insert().values({
                         relationship_local_pk.name: pk,
                         relationship_remote_pk.name: value,
-                    })
-                )
+                    }),
+                    {},
+                ))
+
+        return statements
 
     def _where_clause(self, table, id_or_filters, options):
         if isinstance(id_or_filters, list):
@@ -201,3 +220,130 @@ class DatastoreService(Service, FilterMixin, SchemaMixin):
             await self.middleware.call('datastore.send_delete_events', name, id_or_filters)
 
         return True
+
+    @accepts(
+        List('operations', items=[
+            Dict(
+                'operation',
+                Str('type', enum=['INSERT', 'UPDATE', 'DELETE'], required=True),
+                Str('name', required=True),
+                Any('id_or_filters'),
+                Dict('data', additional_attrs=True),
+            ),
+        ]),
+        Dict(
+            'options',
+            Bool('ha_sync', default=True),
+            Str('prefix', default=''),
+            Bool('send_events', default=True),
+            Bool('coalesce_events', default=False),
+        ),
+    )
+    async def bulk(self, operations, options):
+        """
+        Execute a list of `INSERT`, `UPDATE` and `DELETE` `operations` in a single transaction.
+
+        Each operation takes the same arguments as `datastore.insert` (`name`, `data`), `datastore.update`
+        (`name`, `id_or_filters`, `data`) or `datastore.delete` (`name`, `id_or_filters`). If any of them fails,
+        none of them is applied. Returns a list of per-operation results identical to what the corresponding
+        single-row method would have returned.
+
+        If `coalesce_events` is set, only one event is sent per changed row and all rows updated in one table are
+        queried at once.
+        """
+        statements = []
+        # `BulkResult` in `results` refers to the last insert rowid of the corresponding statement
+        results = []
+        events = []
+        for operation in operations:
+            table = self._get_table(operation['name'])
+            if operation['type'] == 'INSERT':
+                insert, relationships, return_last_insert_rowid = self._prepare_insert(
+                    table, options['prefix'], operation['data'],
+                )
+                statements.append((
+                    table.insert().values(**insert),
+                    {'return_last_insert_rowid': return_last_insert_rowid},
+                ))
+                if return_last_insert_rowid:
+                    pk = BulkResult(len(statements) - 1)
+                else:
+                    pk = insert[self._get_pk(table).name]
+
+                statements.extend(self._relationships_statements(pk, relationships))
+                results.append(pk)
+                events.append(('ADDED', operation['name'], insert, pk))
+            elif operation['type'] == 'UPDATE':
+                id, update, relationships = await self._prepare_update(
+                    operation['name'], table, operation['id_or_filters'], options['prefix'], operation['data'],
+                )
+                if update:
+                    statements.append((
+                        table.update().values(**update).where(
+                            self._where_clause(table, id, {'prefix': options['prefix']})
+                        ),
+                        {'rowcount': 1},
+                    ))
+                    events.append(('CHANGED', operation['name'], None, id))
+
+                statements.extend(self._relationships_statements(id, relationships))
+                results.append(id)
+            elif operation['type'] == 'DELETE':
+                id_or_filters = operation['id_or_filters']
+                statements.append((
+                    table.delete().where(self._where_clause(table, id_or_filters, {'prefix': options['prefix']})),
+                    {},
+                ))
+                if not isinstance(id_or_filters, list):
+                    events.append(('REMOVED', operation['name'], None, id_or_filters))
+
+                results.append(True)
+
+        rowids = []
+        if statements:
+            rowids = await self.middleware.call(
+                'datastore.execute_write_bulk', statements, {'ha_sync': options['ha_sync']},
+            )
+
+        results = [rowids[result.index] if isinstance(result, BulkResult) else result for result in results]
+
+        if options['send_events']:
+            await self._send_bulk_events(events, options['coalesce_events'])
+
+        return results
+
+    async def _send_bulk_events(self, events, coalesce):
+        if not coalesce:
+            for type, name, row, id in events:
+                await self._send_bulk_event(type, name, row, id)
+
+            return
+
+        # Only the last operation on a row matters: an updated row that was deleted afterwards should only be
+        # reported as removed and an inserted row that was updated afterwards should only be reported as added.
+        coalesced = {}
+        for type, name, row, id in events:
+            key = name, id.index if isinstance(id, BulkResult) else id
+            if type == 'CHANGED' and key in coalesced:
+                continue
+
+            coalesced.pop(key, None)
+            coalesced[key] = type, name, row, id
+
+        updated = defaultdict(list)
+        for type, name, row, id in coalesced.values():
+            if type == 'CHANGED':
+                updated[name].append(id)
+            else:
+                await self._send_bulk_event(type, name, row, id)
+
+        for name, ids in updated.items():
+            await self.middleware.call('datastore.send_update_events_bulk', name, ids)
+
+    async def _send_bulk_event(self, type, name, row, id):
+        if type == 'ADDED':
+            await self.middleware.call('datastore.send_insert_events', name, row)
+        elif type == 'CHANGED':
+            await self.middleware.call('datastore.send_update_events', name, id)
+        else:
+            await self.middleware.call('datastore.send_delete_events', name, id)
@@ -82,6 +82,9 @@ class DiskService(Service, ServiceChangeMixin):
         seen_disks = {}
         changed = set()
         deleted = set()
+        # Database changes are written in bulk (a single transaction) and enclosures are synced after that
+        operations = []
+        enclosure_sync = []
         encs = await self.middleware.call('enclosure.query')
         for disk in (
             await self.middleware.call('datastore.query', 'storage.disk', [], {'order_by': ['disk_expiretime']})
@@ -97,9 +100,7 @@ class DiskService(Service, ServiceChangeMixin):
                 # If we cant translate the identifier to a device, give up
                 if not disk['disk_expiretime']:
                     disk['disk_expiretime'] = datetime.utcnow() + timedelta(days=self.DISK_EXPIRECACHE_DAYS)
-                    await self.middleware.call(
-                        'datastore.update', 'storage.disk', disk['disk_identifier'], disk, {'send_events': False}
-                    )
+                    operations.append(self._update_operation(disk))
                     changed.add(disk['disk_identifier'])
                 elif disk['disk_expiretime'] < datetime.utcnow():
                     # Disk expire time has surpassed, go ahead and remove it
@@ -107,9 +108,9 @@ class DiskService(Service, ServiceChangeMixin):
                         asyncio.ensure_future(self.middleware.call(
                             'kmip.reset_sed_disk_password', disk['disk_identifier'], disk['disk_kmip_uid']
                         ))
-                    await self.middleware.call(
-                        'datastore.delete', 'storage.disk', disk['disk_identifier'], {'send_events': False}
-                    )
+                    operations.append({
+                        'type': 'DELETE', 'name': 'storage.disk', 'id_or_filters': disk['disk_identifier'],
+                    })
                     deleted.add(disk['disk_identifier'])
                 continue
             else:
@@ -126,19 +127,16 @@ class DiskService(Service, ServiceChangeMixin):
             # Do not issue unnecessary updates, they are slow on HA systems and cause severe boot delays
             # when lots of drives are present
             if self._disk_changed(disk, original_disk):
-                await self.middleware.call(
-                    'datastore.update', 'storage.disk', disk['disk_identifier'], disk, {'send_events': False}
-                )
+                operations.append(self._update_operation(disk))
                 changed.add(disk['disk_identifier'])
 
-            try:
-                await self.middleware.call('enclosure.sync_disk', disk['disk_identifier'], encs)
-            except Exception:
-                self.middleware.logger.error('Unhandled exception in enclosure.sync_disk for %r',
-                                             disk['disk_identifier'], exc_info=True)
+            enclosure_sync.append(disk['disk_identifier'])
 
             seen_disks[name] = disk
 
+        # Disks that are not seen yet are looked up in the updated database
+        await self._flush_sync(operations, enclosure_sync, encs)
+
         qs = None
         for name in sys_disks:
             if name not in seen_disks:
@@ -160,19 +158,15 @@ class DiskService(Service, ServiceChangeMixin):
                     # Do not issue unnecessary updates, they are slow on HA systems and cause severe boot delays
                     # when lots of drives are present
                     if self._disk_changed(disk, original_disk):
-                        await self.middleware.call(
-                            'datastore.update', 'storage.disk', disk['disk_identifier'], disk, {'send_events': False}
-                        )
+                        operations.append(self._update_operation(disk))
                         changed.add(disk['disk_identifier'])
                 else:
-                    await self.middleware.call('datastore.insert', 'storage.disk', disk, {'send_events': False})
+                    operations.append({'type': 'INSERT', 'name': 'storage.disk', 'data': disk})
                     changed.add(disk['disk_identifier'])
 
-                try:
-                    await self.middleware.call('enclosure.sync_disk', disk['disk_identifier'], encs)
-                except Exception:
-                    self.middleware.logger.error('Unhandled exception in enclosure.sync_disk for %r',
-                                                 disk['disk_identifier'], exc_info=True)
+                enclosure_sync.append(disk['disk_identifier'])
+
+        await self._flush_sync(operations, enclosure_sync, encs)
 
         if changed or deleted:
             await self.middleware.call('disk.restart_services_after_sync')
@@ -184,6 +178,22 @@ class DiskService(Service, ServiceChangeMixin):
 
         return 'OK'
 
+    def _update_operation(self, disk):
+        return {'type': 'UPDATE', 'name': 'storage.disk', 'id_or_filters': disk['disk_identifier'], 'data': disk}
+
+    async def _flush_sync(self, operations, enclosure_sync, encs):
+        if operations:
+            await self.middleware.call('datastore.bulk', operations, {'send_events': False})
+            operations.clear()
+
+        for identifier in enclosure_sync:
+            try:
+                await self.middleware.call('enclosure.sync_disk', identifier, encs)
+            except Exception:
+                self.middleware.logger.error('Unhandled exception in enclosure.sync_disk for %r', identifier,
+                                             exc_info=True)
+        enclosure_sync.clear()
+
     def _disk_changed(self, disk, original_disk):
         # storage_disk.disk_size is a string
         return dict(disk, disk_size=None if disk.get('disk_size') is None else str(disk['disk_size'])) != original_disk
@@ -8,17 +8,26 @@ from middlewared.utils.mako import get_template
 import asyncio
 from collections import defaultdict
 from contextlib import suppress
-import imp
+import hashlib
+import importlib.util
+import itertools
 import os
 import stat
+import time
 
 DEFAULT_ETC_PERMS = 0o644
+# How many groups can be generated at the same time by `etc.generate_checkpoint`
+GENERATE_CONCURRENCY = 8
 
 
 class FileShouldNotExist(Exception):
     pass
 
 
+def file_state(st):
+    return st.st_ino, st.st_size, st.st_mtime_ns, st.st_mode, st.st_uid, st.st_gid
+
+
 class MakoRenderer(object):
 
     def __init__(self, service):
@@ -55,11 +64,29 @@ class PyRenderer(object):
 
     def __init__(self, service):
         self.service = service
+        self.modules = {}
+
+    def load_module(self, path):
+        """
+        Renderer modules are only loaded once (or when they are modified).
+        """
+        filename = f'{path}.py'
+        mtime = os.stat(filename).st_mtime_ns
+        try:
+            module, loaded_mtime = self.modules[path]
+            if loaded_mtime == mtime:
+                return module
+        except KeyError:
+            pass
+
+        spec = importlib.util.spec_from_file_location(os.path.basename(path), filename)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        self.modules[path] = module, mtime
+        return module
 
     async def render(self, path, ctx):
-        name = os.path.basename(path)
-        find = imp.find_module(name, [os.path.dirname(path)])
-        mod = imp.load_module(name, *find)
+        mod = await self.service.middleware.run_in_thread(self.load_module, path)
         args = [self.service, self.service.middleware]
         if ctx is not None:
             args.append(ctx)
@@ -337,6 +364,21 @@ class EtcService(Service):
             {'type': 'py', 'path': 'libvirt', 'checkpoint': None},
         ],
     }
+    # Groups that must be generated before the group when generating a checkpoint. Other groups are generated
+    # concurrently.
+    DEPENDENCIES = {
+        'ftp': ['ssl'],
+        'kmip': ['ssl'],
+        'ldap': ['ssl'],
+        'nginx': ['ssl'],
+        'openvpn_client': ['ssl'],
+        'openvpn_server': ['ssl'],
+        's3': ['ssl'],
+        'syslogd': ['ssl'],
+        'webdav': ['ssl'],
+        'smb_share': ['smb'],
+        'cni': ['k3s'],
+    }
     LOCKS = defaultdict(asyncio.Lock)
 
     checkpoints = ['initial', 'interface_sync', 'post_init', 'pool_import', 'pre_interface_sync']
@@ -353,15 +395,13 @@ class EtcService(Service):
             'mako': MakoRenderer(self),
             'py': PyRenderer(self),
         }
+        # Content digest and resulting file state of the files we have written
+        self.written = {}
+        self.timings = {}
 
     async def gather_ctx(self, methods):
-        rv = {}
-        for m in methods:
-            method = m['method']
-            args = m.get('args', [])
-            rv[method] = await self.middleware.call(method, *args)
-
-        return rv
+        results = await asyncio.gather(*[self.middleware.call(m['method'], *m.get('args', [])) for m in methods])
+        return {m['method']: result for m, result in zip(methods, results)}
 
     def set_etc_file_perms(self, fd, entry):
         perm_changed = False
@@ -397,6 +437,17 @@ class EtcService(Service):
     def make_changes(self, full_path, entry, rendered):
         mode = entry.get('mode', DEFAULT_ETC_PERMS)
 
+        if isinstance(rendered, str):
+            rendered = rendered.encode()
+
+        digest = hashlib.sha256(rendered).digest()
+        written = self.written.get(full_path)
+        if written is not None and written[0] == digest:
+            # File was not modified since we have written the same contents (and set its permissions)
+            with suppress(FileNotFoundError):
+                if file_state(os.stat(full_path)) == written[1]:
+                    return False
+
         def opener(path, flags):
             return os.open(path, os.O_CREAT | os.O_RDWR, mode=mode)
 
@@ -407,6 +458,7 @@ class EtcService(Service):
         with open(full_path, "w", opener=opener) as f:
             perms_changed = self.set_etc_file_perms(f.fileno(), entry)
             contents_changed = write_if_changed(f.fileno(), rendered)
+            self.written[full_path] = digest, file_state(os.fstat(f.fileno()))
 
         return perms_changed or contents_changed
 
@@ -423,59 +475,100 @@ class EtcService(Service):
                 ctx = None
                 entries = group
 
-            for entry in entries:
-                renderer = self._renderers.get(entry['type'])
-                if renderer is None:
-                    raise ValueError(f'Unknown type: {entry["type"]}')
+            entries = [entry for entry in entries if self.entry_in_checkpoint(entry, checkpoint)]
 
-                if 'platform' in entry and entry['platform'].upper() != osc.SYSTEM:
-                    continue
+            # Mako templates only render files so consecutive ones are rendered concurrently. Python renderers may
+            # have side effects (or depend on the files written before them), so they are run in order.
+            for is_mako, batch in itertools.groupby(entries, key=lambda entry: entry['type'] == 'mako'):
+                if is_mako:
+                    await asyncio.gather(*[self.generate_entry(entry, ctx) for entry in batch])
+                else:
+                    for entry in batch:
+                        await self.generate_entry(entry, ctx)
 
-                if checkpoint:
-                    checkpoint_system = f'checkpoint_{osc.SYSTEM.lower()}'
-                    if checkpoint_system in entry:
-                        entry_checkpoint = entry[checkpoint_system]
-                    else:
-                        entry_checkpoint = entry.get('checkpoint', 'initial')
-                    if entry_checkpoint != checkpoint:
-                        continue
+    def entry_in_checkpoint(self, entry, checkpoint):
+        if entry['type'] not in self._renderers:
+            raise ValueError(f'Unknown type: {entry["type"]}')
 
-                path = os.path.join(self.files_dir, entry.get('local_path') or entry['path'])
-                entry_path = entry['path']
-                if entry_path.startswith('local/'):
-                    entry_path = entry_path[len('local/'):]
-                outfile = f'/etc/{entry_path}'
+        if 'platform' in entry and entry['platform'].upper() != osc.SYSTEM:
+            return False
 
-                try:
-                    rendered = await renderer.render(path, ctx)
-                except FileShouldNotExist:
-                    self.logger.debug(f'{entry["type"]}:{entry["path"]} file removed.')
+        if checkpoint:
+            checkpoint_system = f'checkpoint_{osc.SYSTEM.lower()}'
+            if checkpoint_system in entry:
+                entry_checkpoint = entry[checkpoint_system]
+            else:
+                entry_checkpoint = entry.get('checkpoint', 'initial')
+            if entry_checkpoint != checkpoint:
+                return False
 
-                    with suppress(FileNotFoundError):
-                        await self.middleware.run_in_thread(os.unlink, outfile)
+        return True
 
-                    continue
-                except Exception:
-                    self.logger.error(f'Failed to render {entry["type"]}:{entry["path"]}', exc_info=True)
-                    continue
+    async def generate_entry(self, entry, ctx):
+        renderer = self._renderers[entry['type']]
 
-                if rendered is None:
-                    continue
+        path = os.path.join(self.files_dir, entry.get('local_path') or entry['path'])
+        entry_path = entry['path']
+        if entry_path.startswith('local/'):
+            entry_path = entry_path[len('local/'):]
+        outfile = f'/etc/{entry_path}'
 
-                changes = await self.middleware.run_in_thread(self.make_changes, outfile, entry, rendered)
+        start = time.monotonic()
+        try:
+            rendered = await renderer.render(path, ctx)
+        except FileShouldNotExist:
+            self.logger.debug(f'{entry["type"]}:{entry["path"]} file removed.')
+
+            with suppress(FileNotFoundError):
+                await self.middleware.run_in_thread(os.unlink, outfile)
 
-                if not changes:
-                    self.logger.debug(f'No new changes for {outfile}')
+            return
+        except Exception:
+            self.logger.error(f'Failed to render {entry["type"]}:{entry["path"]}', exc_info=True)
+            return
+        finally:
+            render_time = time.monotonic() - start
+
+        if rendered is None:
+            self.timings[outfile] = {'render': render_time, 'write': None}
+            return
+
+        start = time.monotonic()
+        changes = await self.middleware.run_in_thread(self.make_changes, outfile, entry, rendered)
+        write_time = time.monotonic() - start
+        self.timings[outfile] = {'render': render_time, 'write': write_time}
+
+        if changes:
+            self.logger.debug(f'{outfile} rendered in {render_time:.3f}s, written in {write_time:.3f}s')
+        else:
+            self.logger.debug(f'No new changes for {outfile} (rendered in {render_time:.3f}s)')
 
     async def generate_checkpoint(self, checkpoint):
         if checkpoint not in await self.get_checkpoints():
             raise CallError(f'"{checkpoint}" not recognised')
 
-        for name in self.GROUPS.keys():
+        semaphore = asyncio.BoundedSemaphore(GENERATE_CONCURRENCY)
+        generated = {name: asyncio.Event() for name in self.GROUPS}
+
+        async def generate(name):
             try:
-                await self.generate(name, checkpoint)
+                for dependency in self.DEPENDENCIES.get(name, []):
+                    await generated[dependency].wait()
+
+                async with semaphore:
+                    await self.generate(name, checkpoint)
             except Exception:
                 self.logger.error(f'Failed to generate {name} group', exc_info=True)
+            finally:
+                generated[name].set()
+
+        await asyncio.gather(*[generate(name) for name in self.GROUPS])
+
+    async def get_timings(self):
+        """
+        Returns how long did it take to render (and write) each file the last time it was generated.
+        """
+        return self.timings
 
     async def get_checkpoints(self):
         return self.checkpoints
@@ -405,14 +405,14 @@ class FailoverService(ConfigService):
         # Journal thread will see that this is special value and will clear journal.
         SQL_QUEUE.put(None)
 
+        self.middleware.call_sync('datastore.checkpoint')
         token = self.middleware.call_sync('failover.call_remote', 'auth.generate_token')
         self.middleware.call_sync('failover.sendfile', token, FREENAS_DATABASE, FREENAS_DATABASE + '.sync')
         self.middleware.call_sync('failover.call_remote', 'failover.receive_database')
 
     @private
     def receive_database(self):
-        os.rename(FREENAS_DATABASE + '.sync', FREENAS_DATABASE)
-        self.middleware.call_sync('datastore.setup')
+        self.middleware.call_sync('datastore.replace', FREENAS_DATABASE + '.sync')
 
     @private
     def send_small_file(self, path, dest=None):
@@ -1,11 +1,13 @@
 from asyncio import ensure_future
-from pickle import dump, load
+from collections import deque
+from itertools import islice
+from pickle import dumps, loads
 from os import rename
+from struct import pack, unpack_from
 from errno import ECONNREFUSED, ECONNRESET
 from queue import Queue, Empty
 from threading import Thread
 from logging import getLogger
-from contextlib import suppress
 from time import sleep
 from prctl import set_name
 
@@ -18,6 +20,9 @@ JOURNAL_THREAD = None
 
 
 class JournalSync:
+    # Maximum number of journal entries that are sent to the other node in a single transaction
+    batch_size = 500
+
     def __init__(self, middleware, sql_queue, journal):
         self.middleware = middleware
         self.sql_queue = sql_queue
@@ -76,16 +81,25 @@ class JournalSync:
 
     def _flush_journal(self):
         while self.journal:
-            query, params = self.journal.peek()
+            batch = self.journal.peek(self.batch_size)
+
+            statements = []
+            for query, params in batch:
+                if isinstance(query, list):
+                    # `datastore.execute_write_bulk` batch
+                    statements.extend(query)
+                else:
+                    statements.append([query, [params]])
 
             try:
-                self.middleware.call_sync('failover.call_remote', 'datastore.sql', [query, params])
+                self.middleware.call_sync('failover.call_remote', 'datastore.execute_bulk', [statements])
             except Exception as e:
                 if isinstance(e, CallError) and e.errno in [ECONNREFUSED, ECONNRESET]:
                     logger.trace('Skipping journal sync, node down')
                 else:
                     if not self.last_query_failed:
-                        logger.exception('Failed to run query %s: %r', query, e)
+                        logger.exception('Failed to run %d queries starting with %s: %r', len(statements),
+                                         statements[0][0], e)
                         self.last_query_failed = True
 
                     self.middleware.call_sync('alert.oneshot_create', 'FailoverSyncFailed', None)
@@ -96,7 +110,9 @@ class JournalSync:
 
                 self.middleware.call_sync('alert.oneshot_delete', 'FailoverSyncFailed', None)
 
-                self.journal.shift()
+                self.journal.shift(len(batch))
+                # Do not replay this batch again if we crash while syncing the rest of the journal
+                self.journal.write()
 
         return True
 
@@ -142,21 +158,33 @@ class JournalSync:
 
 
 class Journal:
+    """
+    Queries that were not synced to the other node yet.
+
+    The journal file is append-only: it is a sequence of length-prefixed pickled records. A record is either a
+    journal entry (a tuple) or a number of entries that were removed from the head of the journal (an int).
+    The file is rewritten only when it becomes empty or when most of its records describe entries that are
+    already gone.
+    """
+
     path = '/data/ha-journal'
+    # Rewrite the journal file once it has at least this many stale records (and they outnumber live ones)
+    compact_threshold = 1000
 
     def __init__(self):
-        self.journal = []
-        with suppress(FileNotFoundError):
-            with open(self.path, 'rb') as f:
-                try:
-                    self.journal = load(f)
-                except EOFError:
-                    # file is empty
-                    pass
-                except Exception:
-                    logger.warning('Failed to read journal', exc_info=True)
-
-        self.persisted_journal = self.journal.copy()
+        self.journal = deque()
+        # Records that were not written to the journal file yet
+        self.pending = []
+        # Number of records in the journal file
+        self.records = 0
+        self.needs_compaction = False
+        try:
+            self._read()
+        except FileNotFoundError:
+            pass
+        except Exception:
+            logger.warning('Failed to read journal', exc_info=True)
+            self.needs_compaction = True
 
     def __bool__(self):
         return bool(self.journal)
@@ -168,29 +196,94 @@ class Journal:
     def __len__(self):
         return len(self.journal)
 
-    def peek(self):
-        return self.journal[0]
+    def peek(self, count=None):
+        if count is None:
+            return self.journal[0]
+
+        return list(islice(self.journal, count))
+
+    def shift(self, count=1):
+        for i in range(count):
+            self.journal.popleft()
 
-    def shift(self):
-        self.journal = self.journal[1:]
+        self.pending.append(count)
 
     def append(self, item):
         self.journal.append(item)
+        self.pending.append(item)
 
     def clear(self):
-        self.journal = []
+        self.journal.clear()
+        self.pending = []
+        if self.records:
+            # Records that were already written must not be replayed when the journal is reloaded
+            self.needs_compaction = True
 
     def write(self):
-        if self.persisted_journal != self.journal:
-            self._write()
-            self.persisted_journal = self.journal.copy()
+        if self.journal:
+            if not self.pending and not self.needs_compaction:
+                return
+        elif not self.records and not self.needs_compaction:
+            # Nothing was persisted and there is nothing to persist
+            self.pending = []
+            return
+
+        self._write()
 
     def _write(self):
-        tmp_file = f'{self.path}.tmp'
-        with open(tmp_file, 'wb') as f:
-            dump(self.journal, f)
+        stale = self.records + len(self.pending) - len(self.journal)
+        if (
+            self.needs_compaction or
+            not self.journal or
+            (stale >= self.compact_threshold and stale > len(self.journal))
+        ):
+            tmp_file = f'{self.path}.tmp'
+            with open(tmp_file, 'wb') as f:
+                f.write(b''.join(map(self._record, self.journal)))
+
+            rename(tmp_file, self.path)
+            self.records = len(self.journal)
+        else:
+            with open(self.path, 'ab') as f:
+                f.write(b''.join(map(self._record, self.pending)))
 
-        rename(tmp_file, self.path)
+            self.records += len(self.pending)
+
+        self.pending = []
+        self.needs_compaction = False
+
+    def _read(self):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+
+        if data[:1] == b'\x80':
+            # Legacy format: the whole journal pickled as a list
+            self.journal.extend(loads(data))
+            self.needs_compaction = True
+            return
+
+        offset = 0
+        while offset < len(data):
+            if offset + 4 > len(data) or offset + 4 + unpack_from('>I', data, offset)[0] > len(data):
+                logger.warning('Journal file is truncated, discarding last %d bytes', len(data) - offset)
+                self.needs_compaction = True
+                break
+
+            length = unpack_from('>I', data, offset)[0]
+            record = loads(data[offset + 4:offset + 4 + length])
+            offset += 4 + length
+            self.records += 1
+
+            if isinstance(record, int):
+                for i in range(record):
+                    self.journal.popleft()
+            else:
+                self.journal.append(record)
+
+    @staticmethod
+    def _record(value):
+        data = dumps(value)
+        return pack('>I', len(data)) + data
 
 
 class JournalSyncThread(Thread):
@@ -238,6 +331,14 @@ def hook_datastore_execute_write(middleware, sql, params, options):
     SQL_QUEUE.put((sql, params))
 
 
+def hook_datastore_execute_write_bulk(middleware, statements, options):
+    if not options['ha_sync']:
+        return
+
+    # The whole batch is a single journal entry so that it is replayed in a single transaction
+    SQL_QUEUE.put((statements, None))
+
+
 async def _event_system(middleware, *args, **kwargs):
     global JOURNAL_THREAD
     licensed = await middleware.call('failover.licensed')
@@ -251,5 +352,6 @@ async def setup(middleware):
         return
 
     middleware.register_hook('datastore.post_execute_write', hook_datastore_execute_write, inline=True)
+    middleware.register_hook('datastore.post_execute_write_bulk', hook_datastore_execute_write_bulk, inline=True)
     middleware.register_hook('system.post_license_update', _event_system)  # catch license change
     ensure_future(_event_system(middleware))  # start thread on middlewared service start/restart
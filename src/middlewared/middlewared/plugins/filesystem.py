@@ -2,11 +2,12 @@ import binascii
 import errno
 import functools
 import grp
+import itertools
+import json
 import os
 import pathlib
 import pwd
 import shutil
-import stat as statlib
 import time
 
 import pyinotify
@@ -15,9 +16,12 @@ from middlewared.event import EventSource
 from middlewared.plugins.pwenc import PWENC_FILE_SECRET
 from middlewared.plugins.cluster_linux.utils import CTDBConfig, FuseConfig
 from middlewared.plugins.filesystem_ import chflags, stat_x
+from middlewared.plugins.filesystem_.listdir import iter_directory, set_acl
 from middlewared.schema import accepts, Bool, Dict, Float, Int, List, Ref, returns, Path, Str
 from middlewared.service import private, CallError, filterable_returns, Service, job
-from middlewared.utils import filter_list
+from middlewared.utils import filter_getattrs, filter_list
+from middlewared.utils.filters import compile_filters
+from middlewared.validators import Range
 from middlewared.plugins.filesystem_.acl_base import ACLType
 
 
@@ -139,39 +143,56 @@ class FilesystemService(Service):
           uid(int): user id of entry owner
           gid(int): group id of entry onwer
           acl(bool): extended ACL is present on file
-        """
 
-        def stat_entry(entry):
-            out = {'st': None, 'etype': None}
-            try:
-                out['st'] = entry.lstat()
-            except Exception:
-                return None
+        Directory is read lazily so large directories should be paged using `limit` and `offset` (or
+        `[["name", ">", <last name>]]` filter) along with `order_by`: only `offset + limit` entries are kept in
+        memory. `filesystem.listdir_stream` can be used to retrieve all the entries without building the list.
 
-            if statlib.S_ISDIR(out['st'].st_mode):
-                out['etype'] = 'DIRECTORY'
+        `acl` is only checked for the returned entries. It can be skipped (and returned as `null`) by passing
+        `{"extra": {"acl": false}}` in the query options.
+        """
+        path, file_type, only_mounts = self.listdir_prepare(path, filters)
+        if file_type is False:
+            return filter_list([], filters, options)
+
+        acl = options.get('extra', {}).get('acl', True)
+        attrs = filter_getattrs(filters) | {o.lstrip('-') for o in options.get('order_by') or []}
+        if acl and 'acl' in attrs:
+            # Needs to be known before filtering
+            entries = map(lambda entry: set_acl([entry])[0], iter_directory(path, file_type, only_mounts))
+            acl = False
+        else:
+            entries = iter_directory(path, file_type, only_mounts)
 
-            elif statlib.S_ISLNK(out['st'].st_mode):
-                out['etype'] = 'SYMLINK'
-                try:
-                    out['st'] = entry.stat()
-                except Exception:
-                    return None
+        select = options.get('select')
+        if acl and select:
+            # `realpath` is required to check the ACL
+            options = {k: v for k, v in options.items() if k != 'select'}
 
-            elif statlib.S_ISREG(out['st'].st_mode):
-                out['etype'] = 'FILE'
+        rv = filter_list(entries, filters, options)
+        if not acl or options.get('count'):
+            return rv
 
-            else:
-                out['etype'] = 'OTHER'
+        if options.get('get'):
+            set_acl([rv])
+        else:
+            set_acl(rv)
 
-            if dir_only and out['etype'] != 'DIRECTORY':
-                return None
+        if select:
+            if options.get('get'):
+                return {s: rv[s] for s in select if s in rv}
+            return [{s: entry[s] for s in select if s in entry} for entry in rv]
 
-            elif file_only and out['etype'] != 'FILE':
-                return None
+        return rv
 
-            return out
+    @private
+    def listdir_prepare(self, path, filters):
+        """
+        Validate `filesystem.listdir` `path` and determine which entries it should list based on `filters`.
 
+        Returns absolute `path`, file type to list (`None` for all types, `False` for none) and whether only mount
+        points should be listed.
+        """
         path = self.resolve_cluster_path(path)
         path = pathlib.Path(path)
         if not path.exists():
@@ -197,50 +218,73 @@ class FilesystemService(Service):
             else:
                 file_only = True
 
-        rv = []
         if dir_only and file_only:
-            return rv
+            file_type = False
+        elif dir_only:
+            file_type = 'DIRECTORY'
+        elif file_only:
+            file_type = 'FILE'
+        else:
+            file_type = None
 
-        only_top_level = path.absolute() == pathlib.Path('/mnt')
-        for entry in path.iterdir():
-            st = stat_entry(entry)
-            if st is None:
-                continue
+        # sometimes (on failures) the top-level directory
+        # where the zpool is mounted does not get removed
+        # after the zpool is exported. WebUI calls this
+        # specifying `/mnt` as the path. This is used when
+        # configuring shares in the "Path" drop-down. To
+        # prevent shares from being configured to point to
+        # a path that doesn't exist on a zpool, we'll
+        # filter these here.
+        only_mounts = path.absolute() == pathlib.Path('/mnt')
 
-            if only_top_level and not entry.is_mount():
-                # sometimes (on failures) the top-level directory
-                # where the zpool is mounted does not get removed
-                # after the zpool is exported. WebUI calls this
-                # specifying `/mnt` as the path. This is used when
-                # configuring shares in the "Path" drop-down. To
-                # prevent shares from being configured to point to
-                # a path that doesn't exist on a zpool, we'll
-                # filter these here.
-                continue
-            if 'ix-applications' in entry.parts:
-                continue
+        return path.absolute().as_posix(), file_type, only_mounts
+
+    @accepts(
+        Str('path', required=True),
+        Ref('query-filters'),
+        Dict(
+            'options',
+            Bool('acl', default=True),
+            Int('batch_size', default=1000, validators=[Range(min=1)]),
+        ),
+    )
+    @returns()
+    @job(pipes=['output'])
+    def listdir_stream(self, job, path, filters, options):
+        """
+        Job to stream the contents of a directory (see `filesystem.listdir`) without building the whole list in
+        memory.
+
+        Entries matching `filters` are written to the output pipe as JSON objects, one per line, in directory order.
+        `acl` is checked for every `batch_size` entries at once and can be skipped by setting `acl` to `false`.
+        """
+        path, file_type, only_mounts = self.listdir_prepare(path, filters)
+        if file_type is False:
+            return
 
-            etype = st['etype']
-            stat = st['st']
-            realpath = entry.resolve().as_posix() if etype == 'SYMLINK' else entry.absolute().as_posix()
-
-            data = {
-                'name': entry.name,
-                'path': entry.as_posix().replace(
-                    f'{FuseConfig.FUSE_PATH_BASE.value}/', FuseConfig.FUSE_PATH_SUBST.value
-                ),
-                'realpath': realpath,
-                'type': etype,
-                'size': stat.st_size,
-                'mode': stat.st_mode,
-                'acl': False if self.acl_is_trivial(realpath) else True,
-                'uid': stat.st_uid,
-                'gid': stat.st_gid,
-            }
-
-            rv.append(data)
-
-        return filter_list(rv, filters=filters or [], options=options or {})
+        entries = iter_directory(path, file_type, only_mounts)
+        acl = options['acl']
+        if acl and 'acl' in filter_getattrs(filters):
+            # Needs to be known before filtering
+            entries = map(lambda entry: set_acl([entry])[0], entries)
+            acl = False
+
+        predicate = compile_filters(filters).predicate
+        if predicate is not None:
+            entries = filter(predicate, entries)
+
+        count = 0
+        while True:
+            batch = list(itertools.islice(entries, options['batch_size']))
+            if not batch:
+                break
+
+            if acl:
+                set_acl(batch)
+
+            job.pipes.output.w.write(''.join(json.dumps(entry) + '\n' for entry in batch).encode())
+            count += len(batch)
+            job.set_progress(None, f'{count} entries listed')
 
     @accepts(Str('path'))
     @returns(Dict(
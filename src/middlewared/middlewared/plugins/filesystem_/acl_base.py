@@ -173,7 +173,7 @@ class ACLBase(ServicePartBase):
         )
     )
     @returns()
-    @job(lock="perm_change")
+    @job(lock="perm_change", abortable=True)
     def setacl(self, job, data):
         """
         Set ACL of a given path. Takes the following parameters:
@@ -274,7 +274,7 @@ class ACLBase(ServicePartBase):
         )
     )
     @returns()
-    @job(lock="perm_change")
+    @job(lock="perm_change", abortable=True)
     def chown(self, job, data):
         """
         Change owner or group of file at `path`.
@@ -306,7 +306,7 @@ class ACLBase(ServicePartBase):
         )
     )
     @returns()
-    @job(lock="perm_change")
+    @job(lock="perm_change", abortable=True)
     def setperm(self, job, data):
         """
         Set unix permissions on given `path`.
@@ -7,28 +7,64 @@ from pathlib import Path
 
 from middlewared.service import private, CallError, ValidationErrors, Service
 from .acl_base import ACLBase, ACLType
+from .perm_walk import PermWalk
+
+# How often running `acltool` checks if its job was aborted (seconds)
+ACLTOOL_ABORT_CHECK_INTERVAL = 0.5
 
 
 class FilesystemService(Service, ACLBase):
 
     @private
-    def acltool(self, path, action, uid, gid, options):
-
+    def acltool(self, path, action, uid, gid, options, job=None):
+        """
+        If `job` is specified, `acltool` is killed once it is aborted so that it does not keep changing permissions
+        after the job (and its lock) has been released.
+        """
         flags = "-r"
         flags += "x" if options.get('traverse') else ""
         flags += "C" if options.get('do_chmod') else ""
         flags += "P" if options.get('posixacl') else ""
 
-        acltool = subprocess.run([
+        with subprocess.Popen([
             '/usr/bin/nfs4xdr_winacl',
             '-a', action,
             '-O', str(uid), '-G', str(gid),
             flags,
             '-c', path,
-            '-p', path], check=False, capture_output=True
-        )
+            '-p', path], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        ) as acltool:
+            while True:
+                try:
+                    stdout, stderr = acltool.communicate(timeout=ACLTOOL_ABORT_CHECK_INTERVAL)
+                    break
+                except subprocess.TimeoutExpired:
+                    if job is not None and job.aborted:
+                        acltool.kill()
+                        acltool.communicate()
+                        raise CallError(f'{path}: recursive permissions change aborted', errno.EINTR)
+
         if acltool.returncode != 0:
-            raise CallError(f"acltool [{action}] on path {path} failed with error: [{acltool.stderr.decode().strip()}]")
+            raise CallError(f"acltool [{action}] on path {path} failed with error: [{stderr.decode().strip()}]")
+
+    @private
+    def perm_walk(self, job, path, action, uid, gid, options, mode=None):
+        """
+        Natively run recursive `acltool` `action` on POSIX1e or ACL-less `path`.
+        """
+        walk = PermWalk(
+            path, action, uid, gid, mode, traverse=options.get('traverse', False),
+            progress_cb=lambda description: job.set_progress(None, description),
+            is_aborted=lambda: job.aborted,
+        )
+        return walk.run()
+
+    @private
+    def recursive_count(self, path, traverse=False):
+        """
+        Count files and directories a recursive permissions change of `path` would process.
+        """
+        return PermWalk(path, 'chown', traverse=traverse, dry_run=True).run()
 
     def _common_perm_path_validate(self, schema, data, verrors):
         is_cluster = self.middleware.call_sync('filesystem.is_cluster_path', data['path'])
@@ -131,8 +167,7 @@ class FilesystemService(Service, ACLBase):
             return
 
         job.set_progress(10, f'Recursively changing owner of {data["path"]}.')
-        options['posixacl'] = True
-        self.acltool(data['path'], 'chown', uid, gid, options)
+        self.perm_walk(job, data['path'], 'chown', uid, gid, options)
         job.set_progress(100, 'Finished changing owner.')
 
     @private
@@ -205,9 +240,11 @@ class FilesystemService(Service, ACLBase):
 
         action = 'clone' if mode else 'strip'
         job.set_progress(10, f'Recursively setting permissions on {data["path"]}.')
-        options['posixacl'] = not is_nfs4acl
-        options['do_chmod'] = True
-        self.acltool(data['path'], action, uid, gid, options)
+        if is_nfs4acl:
+            options['do_chmod'] = True
+            self.acltool(data['path'], action, uid, gid, options, job)
+        else:
+            self.perm_walk(job, data['path'], action, uid, gid, options, mode)
         job.set_progress(100, 'Finished setting permissions.')
 
     async def default_acl_choices(self, path):
@@ -440,7 +477,7 @@ class FilesystemService(Service, ACLBase):
             return
 
         self.acltool(path, 'clone' if not do_strip else 'strip',
-                     uid, gid, options)
+                     uid, gid, options, job)
 
         job.set_progress(100, 'Finished setting NFSv4 ACL.')
 
@@ -599,10 +636,8 @@ class FilesystemService(Service, ACLBase):
             job.set_progress(100, 'Finished setting POSIX1e ACL.')
             return
 
-        options['posixacl'] = True
-        self.acltool(data['path'],
-                     'clone' if not do_strip else 'strip',
-                     uid, gid, options)
+        job.set_progress(60, f'Recursively setting POSIX1e ACL on {path}.')
+        self.perm_walk(job, path, 'clone' if not do_strip else 'strip', uid, gid, options)
 
         job.set_progress(100, 'Finished setting POSIX1e ACL.')
 
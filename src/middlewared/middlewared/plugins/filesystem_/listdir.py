@@ -0,0 +1,90 @@
+import os
+import pathlib
+
+from middlewared.plugins.cluster_linux.utils import FuseConfig
+
+from .acl_base import ACLType
+
+
+def entry_type(entry):
+    """
+    Returns `path_entry` type of `os.DirEntry` using the file type returned by `readdir` (no `stat` is needed for that
+    on most of the filesystems).
+    """
+    try:
+        if entry.is_symlink():
+            return 'SYMLINK'
+        if entry.is_dir(follow_symlinks=False):
+            return 'DIRECTORY'
+        if entry.is_file(follow_symlinks=False):
+            return 'FILE'
+    except OSError:
+        return None
+
+    return 'OTHER'
+
+
+def iter_directory(path, file_type=None, only_mounts=False):
+    """
+    Lazily yields `path_entry` (without `acl`) for every entry of directory `path`.
+
+    :param file_type: only yield entries of this type (`DIRECTORY` or `FILE`). Other entries are skipped without
+        calling `stat` on them.
+    :param only_mounts: only yield entries that are mount points.
+
+    Nothing is yielded for `ix-applications` or anything inside it as it is a system managed dataset.
+    """
+    if 'ix-applications' in pathlib.Path(path).parts:
+        return
+
+    with os.scandir(path) as it:
+        for entry in it:
+            etype = entry_type(entry)
+            if etype is None:
+                continue
+
+            if file_type is not None and etype != file_type:
+                continue
+
+            if entry.name == 'ix-applications':
+                continue
+
+            if only_mounts and not os.path.ismount(entry.path):
+                continue
+
+            try:
+                # `DirEntry` caches `stat` result so it is only called once
+                st = entry.stat(follow_symlinks=True)
+            except OSError:
+                continue
+
+            if etype == 'SYMLINK':
+                realpath = os.path.realpath(entry.path)
+            else:
+                realpath = entry.path
+
+            yield {
+                'name': entry.name,
+                'path': entry.path.replace(f'{FuseConfig.FUSE_PATH_BASE.value}/', FuseConfig.FUSE_PATH_SUBST.value),
+                'realpath': realpath,
+                'type': etype,
+                'size': st.st_size,
+                'mode': st.st_mode,
+                'acl': None,
+                'uid': st.st_uid,
+                'gid': st.st_gid,
+            }
+
+
+def set_acl(entries):
+    """
+    Fill in `acl` field of `path_entry` list `entries`.
+    """
+    acl_xattrs = ACLType.xattr_names()
+    for entry in entries:
+        try:
+            entry['acl'] = bool(acl_xattrs & set(os.listxattr(entry['realpath'])))
+        except OSError:
+            entry['acl'] = None
+
+    return entries
@@ -0,0 +1,275 @@
+import errno
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from middlewared.service_exception import CallError
+
+POSIX_ACL_ACCESS = 'system.posix_acl_access'
+POSIX_ACL_DEFAULT = 'system.posix_acl_default'
+
+DIR_FLAGS = os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW
+FILE_FLAGS = os.O_RDONLY | os.O_NOFOLLOW | os.O_NONBLOCK
+
+
+class PermWalk:
+    """
+    Recursively changes owner, mode and POSIX1e ACL of a directory tree. This is a native replacement for the
+    `acltool` (`nfs4xdr_winacl`) actions on POSIX1e and ACL-less filesystems:
+
+    * `chown`: change owner of every file to `uid`/`gid` (`-1` leaves it unchanged).
+    * `strip`: remove ACL from every file and set `mode` if it is specified.
+    * `clone`: set ACL of every file and directory inherited from the default ACL of `path` (or, if it has none,
+      strip ACLs and set `mode` like `strip` does).
+
+    Subtrees are distributed across `workers` threads. Every change is done relative to an open directory file
+    descriptor so that a path being replaced by a symlink can't redirect it.
+
+    `dry_run` only counts files and directories that would be changed.
+    """
+
+    def __init__(self, path, action, uid=-1, gid=-1, mode=None, traverse=False, dry_run=False, workers=None,
+                 progress_cb=None, progress_interval=1, is_aborted=None):
+        if action not in ('chown', 'strip', 'clone'):
+            raise ValueError(f'Invalid action: {action!r}')
+
+        self.path = path
+        self.action = action
+        self.uid = uid
+        self.gid = gid
+        self.mode = mode
+        self.traverse = traverse
+        self.dry_run = dry_run
+        self.workers = workers or min(8, os.cpu_count() or 1)
+        self.progress_cb = progress_cb
+        self.progress_interval = progress_interval
+        self.is_aborted = is_aborted or (lambda: False)
+
+        self.root_dev = None
+        # Default ACL of `path` that will be set as access ACL (and default ACL for directories) for `clone`
+        self.acl = None
+
+        self.files = 0
+        self.directories = 0
+        self.started_at = None
+        self.progress_at = 0
+
+        self.executor = None
+        self.lock = threading.Lock()
+        self.done = threading.Condition(self.lock)
+        self.running = 0
+        self.error = None
+
+    def run(self):
+        """
+        Apply the changes and return the number of `files` and `directories` processed.
+        """
+        self.started_at = time.monotonic()
+
+        fd = os.open(self.path, DIR_FLAGS)
+        try:
+            self.root_dev = os.fstat(fd).st_dev
+            if self.action == 'clone':
+                try:
+                    self.acl = os.getxattr(fd, POSIX_ACL_DEFAULT)
+                except OSError as e:
+                    if e.errno not in (errno.ENODATA, errno.EOPNOTSUPP):
+                        raise
+
+            # `path` is the source of the ACL, it is only stripped if there is nothing to clone
+            self.apply(fd, None, True, self.acl is None)
+            self.directories += 1
+        except Exception:
+            os.close(fd)
+            raise
+
+        with ThreadPoolExecutor(self.workers, thread_name_prefix='perm_walk') as self.executor:
+            self.submit(fd)
+            with self.done:
+                while self.running:
+                    self.done.wait()
+
+        if self.error is not None:
+            raise self.error
+
+        if self.is_aborted():
+            raise CallError(f'{self.path}: recursive permissions change aborted', errno.EINTR)
+
+        self.report_progress(True)
+        return {'files': self.files, 'directories': self.directories}
+
+    def submit(self, fd):
+        with self.lock:
+            self.running += 1
+
+        self.executor.submit(self.walk, fd)
+
+    def can_submit(self):
+        # Do not keep too many directories open waiting for a worker
+        return self.running < self.workers * 2
+
+    def walk(self, fd):
+        """
+        Process directory `fd` and all of its subdirectories (except for those that are submitted to other
+        workers). Only one file descriptor per directory level is kept open.
+        """
+        stack = []
+        try:
+            self.enter_directory(stack, fd)
+            while stack and not self.stopped():
+                fd, subdirectories = stack[-1]
+                if not subdirectories:
+                    os.close(fd)
+                    stack.pop()
+                    continue
+
+                child = self.open_directory(fd, subdirectories.pop())
+                if child is None:
+                    continue
+
+                try:
+                    self.apply(child, None, True, True)
+                except Exception:
+                    os.close(child)
+                    raise
+
+                with self.lock:
+                    self.directories += 1
+
+                if self.can_submit():
+                    self.submit(child)
+                else:
+                    self.enter_directory(stack, child)
+        except Exception as e:
+            with self.lock:
+                if self.error is None:
+                    if isinstance(e, OSError):
+                        e = CallError(f'{e.filename or self.path}: {e.strerror}', e.errno)
+                    self.error = e
+        finally:
+            for fd, subdirectories in stack:
+                os.close(fd)
+
+            with self.done:
+                self.running -= 1
+                if not self.running:
+                    self.done.notify_all()
+
+    def enter_directory(self, stack, fd):
+        try:
+            subdirectories = self.process_directory(fd)
+        except Exception:
+            os.close(fd)
+            raise
+
+        stack.append((fd, subdirectories))
+
+    def process_directory(self, fd):
+        """
+        Apply changes to all non-directory entries of directory `fd` and return the names of its subdirectories.
+        """
+        subdirectories = []
+        files = 0
+        with os.scandir(fd) as it:
+            for entry in it:
+                if self.stopped():
+                    break
+
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirectories.append(entry.name)
+                        continue
+
+                    self.apply(fd, entry.name, False, entry.is_file(follow_symlinks=False))
+                except FileNotFoundError:
+                    continue
+
+                files += 1
+
+        with self.lock:
+            self.files += files
+
+        self.report_progress()
+        return subdirectories
+
+    def open_directory(self, fd, name):
+        try:
+            child = os.open(name, DIR_FLAGS, dir_fd=fd)
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            if e.errno in (errno.ENOTDIR, errno.ELOOP):
+                # Replaced with something else since it was listed
+                return None
+            raise
+
+        if not self.traverse and os.fstat(child).st_dev != self.root_dev:
+            # Mountpoint of another filesystem (i.e. child dataset)
+            os.close(child)
+            return None
+
+        return child
+
+    def apply(self, fd, name, is_dir, set_acl):
+        """
+        Apply changes to directory `fd` (if `name` is `None`) or to its entry `name`. `set_acl` is `False` for
+        entries which ACL and mode should not be changed (symlinks and special files).
+        """
+        if self.dry_run:
+            return
+
+        if name is not None and set_acl and self.action != 'chown':
+            # ACL can only be set by file descriptor (or path)
+            fd = os.open(name, FILE_FLAGS, dir_fd=fd)
+            try:
+                return self.apply(fd, None, is_dir, set_acl)
+            finally:
+                os.close(fd)
+
+        if name is None:
+            if self.uid != -1 or self.gid != -1:
+                os.chown(fd, self.uid, self.gid)
+        else:
+            if self.uid != -1 or self.gid != -1:
+                os.chown(name, self.uid, self.gid, dir_fd=fd, follow_symlinks=False)
+            return
+
+        if self.action == 'chown' or not set_acl:
+            return
+
+        if self.action == 'clone' and self.acl is not None:
+            os.setxattr(fd, POSIX_ACL_ACCESS, self.acl)
+            if is_dir:
+                os.setxattr(fd, POSIX_ACL_DEFAULT, self.acl)
+            return
+
+        for xattr in (POSIX_ACL_ACCESS, POSIX_ACL_DEFAULT):
+            try:
+                os.removexattr(fd, xattr)
+            except OSError as e:
+                if e.errno not in (errno.ENODATA, errno.EOPNOTSUPP):
+                    raise
+
+        if self.mode is not None:
+            os.chmod(fd, self.mode)
+
+    def stopped(self):
+        return self.error is not None or self.is_aborted()
+
+    def report_progress(self, force=False):
+        if self.progress_cb is None:
+            return
+
+        now = time.monotonic()
+        if not force and now - self.progress_at < self.progress_interval:
+            return
+
+        with self.lock:
+            if not force and now - self.progress_at < self.progress_interval:
+                return
+            self.progress_at = now
+
+        elapsed = max(now - self.started_at, 0.001)
+        files = self.files + self.directories
+        self.progress_cb(f'{files} files processed ({int(files / elapsed)} files/s)')
@@ -260,7 +260,7 @@ class PoolService(CRUDService):
 
     class Config:
         datastore = 'storage.volume'
-        datastore_extend = 'pool.pool_extend'
+        datastore_extend_batch = 'pool.pool_extend_batch'
         datastore_extend_context = 'pool.pool_extend_context'
         datastore_prefix = 'vol_'
         event_send = False
@@ -543,17 +543,29 @@ class PoolService(CRUDService):
         }
 
     @private
-    def pool_extend(self, pool, context):
+    def pool_extend_batch(self, pools, context):
+        """
+        Query all the zpools at once instead of doing one `zfs.pool.query` call per pool.
+        """
+        if len(pools) == 1:
+            zpool_filters = [('id', '=', pools[0]['name'])]
+        else:
+            zpool_filters = [('id', 'in', [pool['name'] for pool in pools])]
+        try:
+            zpools = {zpool['name']: zpool for zpool in self.middleware.call_sync('zfs.pool.query', zpool_filters)}
+        except Exception:
+            zpools = {}
+
+        return [self.pool_extend(pool, context, zpools.get(pool['name'])) for pool in pools]
+
+    @private
+    def pool_extend(self, pool, context, zpool):
 
         """
         If pool is encrypted we need to check if the pool is imported
         or if all geli providers exist.
         """
         pool['path'] = f'/mnt/{pool["name"]}'
-        try:
-            zpool = self.middleware.call_sync('zfs.pool.query', [('id', '=', pool['name'])])[0]
-        except Exception:
-            zpool = None
 
         if zpool:
             pool.update({
@@ -3054,14 +3066,21 @@ class PoolDatasetService(CRUDService):
         making it match whatever pool.dataset.{create,update} uses as input.
         """
 
+        # `zfs.dataset.query` shares `children` subtrees between flattened datasets so we must not modify
+        # them in place and every shared child only needs to be transformed once.
+        transformed_children = {}
+        internal_user_props = self._internal_user_props()
+
         def transform(dataset):
+            dataset = dict(dataset)
+            properties = dataset.pop('properties')
             for orig_name, new_name, method in get_props_of_interest_mapping():
-                if orig_name not in dataset['properties']:
+                if orig_name not in properties:
                     continue
                 i = new_name or orig_name
-                dataset[i] = dataset['properties'][orig_name]
+                dataset[i] = properties[orig_name]
                 if method:
-                    dataset[i]['value'] = method(dataset[i]['value'])
+                    dataset[i] = dict(dataset[i], value=method(dataset[i]['value']))
 
             if 'mountpoint' in dataset:
                 # This is treated specially to keep backwards compatibility with API
@@ -3070,9 +3089,8 @@ class PoolDatasetService(CRUDService):
                 dataset['mountpoint'] = None
 
             dataset['user_properties'] = {
-                k: v for k, v in dataset['properties'].items() if ':' in k and k not in self._internal_user_props()
+                k: v for k, v in properties.items() if ':' in k and k not in internal_user_props
             }
-            del dataset['properties']
 
             if all(k in dataset for k in ('encrypted', 'key_loaded')):
                 dataset['locked'] = dataset['encrypted'] and not dataset['key_loaded']
@@ -3080,7 +3098,9 @@ class PoolDatasetService(CRUDService):
             if retrieve_children:
                 rv = []
                 for child in filter_list(dataset['children'], children_filters):
-                    rv.append(transform(child))
+                    if id(child) not in transformed_children:
+                        transformed_children[id(child)] = transform(child)
+                    rv.append(transformed_children[id(child)])
                 dataset['children'] = rv
 
             return dataset
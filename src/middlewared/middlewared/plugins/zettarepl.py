@@ -343,6 +343,8 @@ class ZettareplService(Service):
             self.queue.put(("config", config))
 
     def update_tasks(self):
+        self.middleware.call_sync("zettarepl.invalidate_snapshot_owners_index")
+
         try:
             definition, hold_tasks = self.middleware.call_sync("zettarepl.get_definition")
         except Exception as e:
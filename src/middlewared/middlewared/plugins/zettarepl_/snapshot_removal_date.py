@@ -2,6 +2,7 @@ import asyncio
 from collections import defaultdict
 from datetime import datetime
 import subprocess
+import threading
 
 import isodate
 
@@ -13,17 +14,100 @@ from zettarepl.snapshot.task.snapshot_owner import PeriodicSnapshotTaskSnapshotO
 from zettarepl.snapshot.task.task import PeriodicSnapshotTask
 from zettarepl.transport.local import LocalShell
 
+# Maximum number of snapshots passed to a single `zfs set` call
+ZFS_SET_BATCH_SIZE = 1000
+# Maximum number of parsed snapshot names kept by `SnapshotOwnersIndex`
+PARSED_NAMES_CACHE_SIZE = 10000
+
+
+class SnapshotOwnersIndex:
+    """
+    Periodic snapshot tasks' snapshot owners indexed by dataset so that only the tasks that can own a snapshot are
+    checked for it. Snapshot names parsed with each naming schema are cached.
+    """
+
+    def __init__(self, zettarepl_tasks):
+        now = datetime.utcnow()
+        # Task dataset -> snapshot owners
+        self.by_dataset = defaultdict(list)
+        for zettarepl_task in zettarepl_tasks:
+            self.by_dataset[zettarepl_task.dataset].append(PeriodicSnapshotTaskSnapshotOwner(now, zettarepl_task))
+
+        # Dataset -> snapshot owners that own it
+        self.dataset_owners = {}
+        # (naming schema, snapshot name) -> parsed snapshot name (or `None` if it does not match)
+        self.parsed_names = {}
+
+    def owners(self, dataset):
+        owners = self.dataset_owners.get(dataset)
+        if owners is None:
+            owners = []
+            parts = dataset.split("/")
+            for i in range(1, len(parts) + 1):
+                prefix = "/".join(parts[:i])
+                for snapshot_owner in self.by_dataset.get(prefix, []):
+                    if prefix != dataset and not snapshot_owner.periodic_snapshot_task.recursive:
+                        continue
+
+                    if snapshot_owner.owns_dataset(dataset):
+                        owners.append(snapshot_owner)
+
+            self.dataset_owners[dataset] = owners
+
+        return owners
+
+    def parse_snapshot_name(self, name, naming_schema):
+        key = naming_schema, name
+        try:
+            return self.parsed_names[key]
+        except KeyError:
+            pass
+
+        try:
+            parsed_snapshot_name = parse_snapshot_name(name, naming_schema)
+        except ValueError:
+            parsed_snapshot_name = None
+
+        if len(self.parsed_names) >= PARSED_NAMES_CACHE_SIZE:
+            self.parsed_names.clear()
+        self.parsed_names[key] = parsed_snapshot_name
+        return parsed_snapshot_name
+
+    def task_destroy_at(self, dataset, name):
+        """
+        Returns the latest removal date (and the id of the task that defines it) of snapshot `dataset@name` among
+        the periodic snapshot tasks that own it.
+        """
+        task_destroy_at = None
+        task_destroy_at_id = None
+        for snapshot_owner in self.owners(dataset):
+            task = snapshot_owner.periodic_snapshot_task
+            parsed_snapshot_name = self.parse_snapshot_name(name, task.naming_schema)
+            if parsed_snapshot_name is None:
+                continue
+
+            if snapshot_owner.owns_snapshot(dataset, parsed_snapshot_name):
+                destroy_at = parsed_snapshot_name.datetime + task.lifetime
+
+                if task_destroy_at is None or task_destroy_at < destroy_at:
+                    task_destroy_at = destroy_at
+                    task_destroy_at_id = task.id
+
+        return task_destroy_at, task_destroy_at_id
+
 
 class ZettareplService(Service):
     removal_dates = defaultdict(dict)
     removal_dates_loaded = False
+    snapshot_owners_index = None
+    snapshot_owners_index_lock = threading.Lock()
 
     def load_removal_dates(self, pool=None):
         property_name = self.middleware.call_sync("pool.snapshottask.removal_date_property")
         cmd = ["zfs", "list", "-t", "snapshot", "-H", "-o", f"name,{property_name}"]
         if pool is not None:
             cmd.extend(["-r", pool])
-            removal_dates = self.removal_dates.copy()
+            removal_dates = defaultdict(dict, self.removal_dates)
             removal_dates[pool] = {}
         else:
             removal_dates = defaultdict(dict)
@@ -34,7 +118,7 @@ class ZettareplService(Service):
             if destroy_at == "-":
                 continue
 
-            snapshot_pool = snapshot.split("/")[0]
+            snapshot_pool = snapshot.split("/")[0].split("@")[0]
 
             try:
                 destroy_at = isodate.parse_datetime(destroy_at)
@@ -51,7 +135,79 @@ class ZettareplService(Service):
         if not self.removal_dates_loaded:
             return None
 
-        return dict(sum([list(d.items()) for d in self.removal_dates.values()], []))
+        removal_dates = {}
+        for pool_removal_dates in list(self.removal_dates.values()):
+            removal_dates.update(pool_removal_dates)
+
+        return removal_dates
+
+    def unload_removal_dates(self, pool):
+        self.removal_dates.pop(pool, None)
+
+    def update_removal_dates(self, removal_dates):
+        """
+        Update removal dates index with `{snapshot: removal date}` that were set on snapshots.
+        """
+        for snapshot, destroy_at in removal_dates.items():
+            self.removal_dates[snapshot.split("/")[0].split("@")[0]][snapshot] = destroy_at
+
+    def remove_removal_dates(self, snapshot, recursive=False):
+        """
+        Remove destroyed `snapshot` (and the same snapshots of child datasets if `recursive`) from removal dates
+        index.
+        """
+        pool_removal_dates = self.removal_dates.get(snapshot.split("/")[0].split("@")[0])
+        if not pool_removal_dates:
+            return
+
+        pool_removal_dates.pop(snapshot, None)
+        if recursive:
+            dataset, name = snapshot.split("@", 1)
+            for child_snapshot in [
+                child_snapshot for child_snapshot in pool_removal_dates
+                if child_snapshot.startswith(f"{dataset}/") and child_snapshot.endswith(f"@{name}")
+            ]:
+                pool_removal_dates.pop(child_snapshot)
+
+    def set_removal_dates(self, removal_dates):
+        """
+        Set removal date property to `{snapshot: removal date}`. Snapshots that share the same removal date (i.e. the
+        same snapshot of a recursive task) are updated with a single `zfs set` call.
+        """
+        property_name = self.middleware.call_sync("pool.snapshottask.removal_date_property")
+
+        by_destroy_at = defaultdict(list)
+        for snapshot, destroy_at in removal_dates.items():
+            by_destroy_at[destroy_at].append(snapshot)
+
+        for destroy_at, snapshots in by_destroy_at.items():
+            for i in range(0, len(snapshots), ZFS_SET_BATCH_SIZE):
+                batch = snapshots[i:i + ZFS_SET_BATCH_SIZE]
+                try:
+                    self._zfs_set(property_name, destroy_at, batch)
+                except subprocess.CalledProcessError as e:
+                    if len(batch) == 1:
+                        self.middleware.logger.warning("Error setting snapshot %s removal date: %r", batch[0],
+                                                       e.stderr)
+                        continue
+
+                    # Find out which snapshots have failed
+                    for snapshot in batch:
+                        try:
+                            self._zfs_set(property_name, destroy_at, [snapshot])
+                        except subprocess.CalledProcessError as e:
+                            self.middleware.logger.warning("Error setting snapshot %s removal date: %r", snapshot,
+                                                           e.stderr)
+                        else:
+                            self.update_removal_dates({snapshot: destroy_at})
+                else:
+                    self.update_removal_dates({snapshot: destroy_at for snapshot in batch})
+
+    def _zfs_set(self, property_name, destroy_at, snapshots):
+        subprocess.run(
+            ["zfs", "set", f"{property_name}={destroy_at.isoformat()}"] + snapshots,
+            check=True, capture_output=True, encoding="utf-8", errors="ignore",
+        )
 
     def periodic_snapshot_task_snapshots(self, task):
         snapshots = list_snapshots(LocalShell(), task["dataset"], task["recursive"])
@@ -74,10 +230,10 @@ class ZettareplService(Service):
         return task_snapshots
 
     def fixate_removal_date(self, datasets, task):
-        property_name = self.middleware.call_sync("pool.snapshottask.removal_date_property")
         zettarepl_task = PeriodicSnapshotTask.from_data(None, self.middleware.call_sync(
             "zettarepl.periodic_snapshot_task_definition", task,
         ))
+        removal_dates = {}
         for dataset, snapshots in datasets.items():
             for snapshot in snapshots:
                 try:
@@ -94,48 +250,34 @@ class ZettareplService(Service):
                     if existing_destroy_at is not None and existing_destroy_at >= destroy_at:
                         continue
 
-                    try:
-                        subprocess.run(
-                            ["zfs", "set", f"{property_name}={destroy_at.isoformat()}", f"{dataset}@{snapshot}"],
-                            check=True, capture_output=True, encoding="utf-8", errors="ignore",
-                        )
-                    except subprocess.CalledProcessError as e:
-                        self.middleware.logger.warning("Error setting snapshot %s@%s removal date: %r", dataset,
-                                                       snapshot, e.stderr)
-                    else:
-                        self.removal_dates[k1][k2] = destroy_at
+                    removal_dates[k2] = destroy_at
+
+        self.set_removal_dates(removal_dates)
+
+    def get_snapshot_owners_index(self):
+        with self.snapshot_owners_index_lock:
+            if self.snapshot_owners_index is None:
+                self.snapshot_owners_index = SnapshotOwnersIndex([
+                    PeriodicSnapshotTask.from_data(task["id"], self.middleware.call_sync(
+                        "zettarepl.periodic_snapshot_task_definition", task,
+                    ))
+                    for task in self.middleware.call_sync("pool.snapshottask.query", [["enabled", "=", True]])
+                ])
+
+            return self.snapshot_owners_index
+
+    def invalidate_snapshot_owners_index(self):
+        with self.snapshot_owners_index_lock:
+            self.snapshot_owners_index = None
 
     def annotate_snapshots(self, snapshots):
         property_name = self.middleware.call_sync("pool.snapshottask.removal_date_property")
-        zettarepl_tasks = [
-            PeriodicSnapshotTask.from_data(task["id"], self.middleware.call_sync(
-                "zettarepl.periodic_snapshot_task_definition", task,
-            ))
-            for task in self.middleware.call_sync("pool.snapshottask.query", [["enabled", "=", True]])
-        ]
-        snapshot_owners = [
-            PeriodicSnapshotTaskSnapshotOwner(datetime.utcnow(), zettarepl_task)
-            for zettarepl_task in zettarepl_tasks
-        ]
+        snapshot_owners_index = self.get_snapshot_owners_index()
 
         for snapshot in snapshots:
-            task_destroy_at = None
-            task_destroy_at_id = None
-            for snapshot_owner in snapshot_owners:
-                if snapshot_owner.owns_dataset(snapshot["dataset"]):
-                    try:
-                        parsed_snapshot_name = parse_snapshot_name(
-                            snapshot["snapshot_name"], snapshot_owner.periodic_snapshot_task.naming_schema
-                        )
-                    except ValueError:
-                        pass
-                    else:
-                        if snapshot_owner.owns_snapshot(snapshot["dataset"], parsed_snapshot_name):
-                            destroy_at = parsed_snapshot_name.datetime + snapshot_owner.periodic_snapshot_task.lifetime
-
-                            if task_destroy_at is None or task_destroy_at < destroy_at:
-                                task_destroy_at = destroy_at
-                                task_destroy_at_id = snapshot_owner.periodic_snapshot_task.id
+            task_destroy_at, task_destroy_at_id = snapshot_owners_index.task_destroy_at(
+                snapshot["dataset"], snapshot["snapshot_name"],
+            )
 
             property_destroy_at = None
             if property_name in snapshot["properties"]:
@@ -168,11 +310,17 @@ class ZettareplService(Service):
         return snapshots
 
 
-async def pool_configuration_change(middleware, *args, **kwargs):
-    asyncio.ensure_future(middleware.call("zettarepl.load_removal_dates"))
+async def pool_post_import(middleware, pool):
+    # `pool` is `None` when all pools are imported on boot
+    asyncio.ensure_future(middleware.call("zettarepl.load_removal_dates", pool["name"] if pool else None))
+
+
+async def pool_post_export(middleware, pool, *args, **kwargs):
+    await middleware.call("zettarepl.unload_removal_dates", pool)
 
 
 async def setup(middleware):
     asyncio.ensure_future(middleware.call("zettarepl.load_removal_dates"))
 
-    middleware.register_hook("pool.post_import", pool_configuration_change)
+    middleware.register_hook("pool.post_import", pool_post_import)
+    middleware.register_hook("pool.post_export", pool_post_export)
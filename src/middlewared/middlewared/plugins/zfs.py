@@ -2,10 +2,10 @@ import copy
 import errno
 import subprocess
 from collections import defaultdict
-from copy import deepcopy
 
 import libzfs
 
+from middlewared.plugins.zfs_.snapshot_query import snapshot_query_kwargs
 from middlewared.schema import accepts, Any, Bool, Dict, Int, List, Str
 from middlewared.service import (
     CallError, CRUDService, ValidationErrors, filterable, job, private,
@@ -433,7 +433,7 @@ class ZFSDatasetService(CRUDService):
                 'flat': False,  # So child datasets are also queried
                 'properties': ['encryption', 'keystatus', 'mountpoint']
             },
-        }))
+        }), children_names=True)
 
         post_filters = [['encrypted', '=', True]]
 
@@ -457,8 +457,25 @@ class ZFSDatasetService(CRUDService):
             for dataset in filter_list(result, post_filters)
         ]
 
-    def flatten_datasets(self, datasets):
-        return sum([[deepcopy(ds)] + self.flatten_datasets(ds.get('children') or []) for ds in datasets], [])
+    def flatten_datasets(self, datasets, children_names=False):
+        """
+        Flatten `datasets` hierarchy (in pre-order) in a single pass.
+
+        Each flattened dataset is a shallow copy of its hierarchical entry; embedded `children` subtrees are
+        shared between a dataset and its ancestors instead of being copied once per ancestor so they must be
+        treated as read-only. If `children_names` is set, `children` only lists the names of direct children.
+        """
+        rv = []
+        stack = list(reversed(datasets))
+        while stack:
+            ds = stack.pop()
+            entry = dict(ds)
+            children = ds.get('children') or []
+            if children_names and 'children' in ds:
+                entry['children'] = [child['id'] for child in children]
+            rv.append(entry)
+            stack.extend(reversed(children))
+        return rv
 
     @filterable
     def query(self, filters, options):
@@ -483,6 +500,9 @@ class ZFSDatasetService(CRUDService):
         Second type is hierarchical where only top level datasets are returned in the list and they contain all the
         children there are for them in `children` key. This retrieval type is slightly faster.
         These options are controlled by `query-options.extra.flat` attribute which defaults to true.
+        In flat structure, `children` of each dataset are shared with its ancestors and should not be modified. If
+        `query-options.extra.children_names` is set, `children` will only contain names of direct children instead
+        of their data.
 
         `query-options.extra.user_properties` controls if user defined properties of datasets should be retrieved
         or not.
@@ -495,6 +515,7 @@ class ZFSDatasetService(CRUDService):
         extra = options.get('extra', {}).copy()
         props = extra.get('properties', None)
         flat = extra.get('flat', True)
+        children_names = extra.get('children_names', False)
         user_properties = extra.get('user_properties', True)
         retrieve_properties = extra.get('retrieve_properties', True)
         retrieve_children = extra.get('retrieve_children', True)
@@ -521,7 +542,7 @@ class ZFSDatasetService(CRUDService):
 
             datasets = zfs.datasets_serialized(**kwargs)
             if flat:
-                datasets = self.flatten_datasets(datasets)
+                datasets = self.flatten_datasets(datasets, children_names)
             else:
                 datasets = list(datasets)
 
@@ -1016,57 +1037,23 @@ class ZFSSnapshot(CRUDService):
         `query-options.extra.min_txg` can be specified to limit snapshot retrieval based on minimum transaction group.
 
         `query-options.extra.max_txg` can be specified to limit snapshot retrieval based on maximum transaction group.
+
+        `pool`, `dataset`, `id`/`name` (`=`, `in` and `^` operators) and `createtxg` range filters are used to limit
+        which snapshots are retrieved. Unless `query-options.extra.properties` is specified, only properties that
+        are referenced by `query-filters`, `order_by` and `select` are retrieved.
         """
-        # Special case for faster listing of snapshot names (#53149)
-        filters_attrs = filter_getattrs(filters)
         extra = copy.deepcopy(options['extra'])
-        min_txg = extra.get('min_txg', 0)
-        max_txg = extra.get('max_txg', 0)
-        if (
-            (
-                options.get('select') == ['name'] or
-                options.get('count')
-            ) and filters_attrs.issubset({'name', 'pool', 'dataset'})
-        ):
-            kwargs = {}
-            other_filters = []
-            for f in filters:
-                if len(f) == 3 and f[0] in ['pool', 'dataset'] and f[1] in ['=', 'in']:
-                    if f[1] == '=':
-                        kwargs['datasets'] = [f[2]]
-                    else:
-                        kwargs['datasets'] = f[2]
-
-                    if f[0] == 'dataset':
-                        kwargs['recursive'] = False
-                else:
-                    other_filters.append(f)
-            filters = other_filters
-
-            with libzfs.ZFS() as zfs:
-                snaps = zfs.snapshots_serialized(['name'], min_txg=min_txg, max_txg=max_txg, **kwargs)
-
-            if filters or len(options) > 1:
-                return filter_list(snaps, filters, options)
-
-            return snaps
-
-        if options['extra'].get('retention'):
+        retention_properties = []
+        if extra.get('retention'):
             if 'id' not in filter_getattrs(filters) and not options.get('limit'):
                 raise CallError('`id` or `limit` is required if `retention` is requested', errno.EINVAL)
 
-        properties = extra.get('properties')
-        with libzfs.ZFS() as zfs:
-            # Handle `id` filter to avoid getting all snapshots first
-            kwargs = dict(holds=False, mounted=False, props=properties, min_txg=min_txg, max_txg=max_txg)
-            if filters and len(filters) == 1 and len(filters[0]) == 3 and filters[0][0] in (
-                'id', 'name'
-            ) and filters[0][1] == '=':
-                kwargs['datasets'] = [filters[0][2]]
+            retention_properties.append(self.middleware.call_sync('pool.snapshottask.removal_date_property'))
 
-            snapshots = zfs.snapshots_serialized(**kwargs)
+        with libzfs.ZFS() as zfs:
+            # Only iterate over datasets and retrieve properties that are relevant for the query
+            snapshots = zfs.snapshots_serialized(**snapshot_query_kwargs(filters, options, retention_properties))
 
-        # FIXME: awful performance with hundreds/thousands of snapshots
         select = options.pop('select', None)
         result = filter_list(snapshots, filters, options)
 
@@ -1229,6 +1216,7 @@ class ZFSSnapshot(CRUDService):
         except libzfs.ZFSException as e:
             raise CallError(str(e))
         else:
+            self.middleware.call_sync('zettarepl.remove_removal_dates', id, options['recursive'])
             return True
 
     @accepts(Dict(
@@ -0,0 +1,121 @@
+# -*- coding=utf-8 -*-
+from middlewared.utils import filter_getattrs, partition
+
+__all__ = ["snapshot_query_kwargs"]
+
+# Scopes ordered by how selective they are. Lower rank wins.
+SCOPE_SNAPSHOT = 0
+SCOPE_DATASET = 1
+SCOPE_RECURSIVE = 2
+
+
+def snapshot_query_kwargs(filters, options, extra_properties=None):
+    """
+    Translate `zfs.snapshot.query` `query-filters` and `query-options` into `libzfs.ZFS.snapshots_serialized`
+    keyword arguments so that only snapshots (and properties) that can possibly match are retrieved.
+
+    The retrieved set is only guaranteed to be a superset of the result, filters must still be applied afterwards.
+    """
+    extra = options.get('extra') or {}
+    kwargs = dict(holds=False, mounted=False, props=snapshot_query_properties(filters, options, extra_properties))
+
+    scope = None
+    min_txg = extra.get('min_txg', 0)
+    max_txg = extra.get('max_txg', 0)
+    for f in filters or []:
+        if len(f) != 3:
+            # `OR` filters can't narrow down the scope
+            continue
+
+        name, op, value = f
+        if name == 'createtxg':
+            if not isinstance(value, int) or isinstance(value, bool):
+                # Leave it to `filter_list` to decide how other values compare
+                continue
+
+            if op in ('=', '>=', '>'):
+                min_txg = max(min_txg, value + (1 if op == '>' else 0))
+            if op in ('=', '<=', '<'):
+                value -= 1 if op == '<' else 0
+                if value > 0:
+                    max_txg = min(max_txg, value) if max_txg else value
+            continue
+
+        candidate = snapshot_query_scope(name, op, value)
+        if candidate is not None and (scope is None or candidate[0] < scope[0]):
+            scope = candidate
+
+    if scope is not None:
+        rank, datasets, recursive = scope
+        kwargs['datasets'] = datasets
+        if recursive is not None:
+            kwargs['recursive'] = recursive
+
+    kwargs['min_txg'] = min_txg
+    kwargs['max_txg'] = max_txg
+    return kwargs
+
+
+def snapshot_query_scope(name, op, value):
+    """
+    Returns `(rank, datasets, recursive)` libzfs iteration scope for a single filter or `None` if it can't be
+    used to narrow down iteration. `recursive` of `None` means the libzfs default.
+    """
+    if op == '=' and isinstance(value, str):
+        values = [value]
+    elif op == 'in' and isinstance(value, (list, tuple)) and value and all(isinstance(v, str) for v in value):
+        values = list(value)
+    elif op == '^' and isinstance(value, str):
+        values = None
+    else:
+        return None
+
+    if name in ('id', 'name'):
+        if values is not None:
+            # libzfs accepts snapshot names and will only retrieve these
+            return SCOPE_SNAPSHOT, values, None
+
+        if '@' in value:
+            return SCOPE_DATASET, [value.split('@', 1)[0]], False
+
+        name = 'dataset'
+
+    if name == 'dataset':
+        if values is not None:
+            return SCOPE_DATASET, values, False
+
+        if '/' in value:
+            # `tank/foo` prefix matches `tank/foo`, `tank/foobar` and their children
+            return SCOPE_RECURSIVE, [value.rsplit('/', 1)[0]], True
+
+        return None
+
+    if name == 'pool' and values is not None:
+        return SCOPE_RECURSIVE, values, True
+
+    return None
+
+
+def snapshot_query_properties(filters, options, extra_properties=None):
+    """
+    Returns a list of ZFS properties that need to be retrieved to evaluate `filters` and `order_by` and build the
+    result for `select`, or `None` if all of them are needed.
+    """
+    extra = options.get('extra') or {}
+    if extra.get('properties') is not None:
+        return extra['properties']
+
+    if not options.get('count') and (not options.get('select') or 'properties' in options['select']):
+        return None
+
+    properties = set(extra_properties or [])
+    for attr in filter_getattrs(filters) | {o.lstrip('-') for o in options.get('order_by') or []}:
+        left, right = partition(attr)
+        if left != 'properties':
+            continue
+        if not right:
+            return None
+
+        properties.add(partition(right)[0])
+
+    return sorted(properties)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+"""
+Compare `filter_list` against the per-row interpreting implementation it replaced.
+
+    python -m middlewared.pytest.benchmark.filter_list --rows 100000
+"""
+import argparse
+import random
+import re
+import time
+
+from middlewared.service_exception import MatchNotFound
+from middlewared.utils import filter_list, get
+
+
+def legacy_filter_list(_list, filters=None, options=None):
+    opmap = {
+        '=': lambda x, y: x == y,
+        '!=': lambda x, y: x != y,
+        '>': lambda x, y: x > y,
+        '>=': lambda x, y: x >= y,
+        '<': lambda x, y: x < y,
+        '<=': lambda x, y: x <= y,
+        '~': lambda x, y: re.match(y, x),
+        'in': lambda x, y: x in y,
+        'nin': lambda x, y: x not in y,
+        '^': lambda x, y: x is not None and x.startswith(y),
+    }
+
+    filters = filters or []
+    options = options or {}
+
+    def filterop(i, f):
+        name, op, value = f
+        return opmap[op](get(i, name), value)
+
+    rv = []
+    for i in _list:
+        for f in filters:
+            if len(f) == 2:
+                if not any(filterop(i, of) for of in f[1]):
+                    break
+            elif not filterop(i, f):
+                break
+        else:
+            rv.append(i)
+            if options.get('get') is True and not options.get('order_by'):
+                return i
+
+    if options.get('count') is True:
+        return len(rv)
+
+    for o in options.get('order_by') or []:
+        if o.startswith('-'):
+            rv = sorted(rv, key=lambda x: x[o[1:]], reverse=True)
+        else:
+            rv = sorted(rv, key=lambda x: x[o])
+
+    if options.get('get') is True:
+        try:
+            return rv[0]
+        except IndexError:
+            raise MatchNotFound() from None
+
+    if options.get('offset'):
+        rv = rv[options['offset']:]
+
+    if options.get('limit'):
+        return rv[:options['limit']]
+
+    return rv
+
+
+def generate(rows):
+    random.seed(rows)
+    data = []
+    for i in range(rows):
+        dataset = f'tank/ds{i % 5000}'
+        data.append({
+            'id': f'{dataset}@auto-{i}',
+            'name': f'{dataset}@auto-{i}',
+            'dataset': dataset,
+            'pool': 'tank',
+            'properties': {
+                'createtxg': {'parsed': i, 'value': str(i)},
+                'used': {'parsed': random.randint(0, 1 << 30)},
+            },
+            'createtxg': i,
+        })
+    random.shuffle(data)
+    return data
+
+
+CASES = [
+    ('equality', [['dataset', '=', 'tank/ds42']], {}),
+    ('nested path', [['properties.used.parsed', '>', 1 << 29]], {}),
+    ('regex', [['name', '~', r'.*@auto-\d*7$']], {}),
+    ('in', [['pool', 'in', ['tank', 'dozer']], ['dataset', 'in', [f'tank/ds{i}' for i in range(50)]]], {}),
+    ('OR', [['OR', [['dataset', '=', 'tank/ds1'], ['dataset', '^', 'tank/ds49']]]], {}),
+    ('order_by + limit', [], {'order_by': ['-createtxg'], 'limit': 50}),
+    ('order_by 2 keys', [], {'order_by': ['createtxg', 'dataset']}),
+    ('get', [['dataset', '=', 'tank/ds10']], {'get': True}),
+    ('count', [['dataset', '^', 'tank/ds1']], {'count': True}),
+]
+
+
+def measure(func, data, filters, options, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        func(data, filters, options)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    data = generate(args.rows)
+    print(f'{"case":<20}{"legacy":>12}{"compiled":>12}{"speedup":>10}')
+    for name, filters, options in CASES:
+        assert legacy_filter_list(data, filters, options) == filter_list(data, filters, options), name
+        old = measure(legacy_filter_list, data, filters, options, args.repeat)
+        new = measure(filter_list, data, filters, options, args.repeat)
+        print(f'{name:<20}{old * 1000:>10.1f}ms{new * 1000:>10.1f}ms{old / new:>9.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+"""
+Compare HA journal recording and replay against the whole-file pickle journal that was synced one statement at a
+time.
+
+The other controller is replaced with a local in-memory SQLite database that is reached with a simulated network
+round trip.
+
+    python -m middlewared.pytest.benchmark.ha_journal --statements 10000 --rtt 0.5
+"""
+import argparse
+import os
+import pickle
+import sqlite3
+import tempfile
+import time
+
+from middlewared.plugins.failover_.journal import Journal, JournalSync
+
+
+class LegacyJournal:
+    def __init__(self, path):
+        self.path = path
+        self.journal = []
+        self.persisted_journal = []
+
+    def __bool__(self):
+        return bool(self.journal)
+
+    def peek(self):
+        return self.journal[0]
+
+    def shift(self):
+        self.journal = self.journal[1:]
+
+    def append(self, item):
+        self.journal.append(item)
+
+    def write(self):
+        if self.persisted_journal != self.journal:
+            tmp_file = f'{self.path}.tmp'
+            with open(tmp_file, 'wb') as f:
+                pickle.dump(self.journal, f)
+
+            os.rename(tmp_file, self.path)
+            self.persisted_journal = self.journal.copy()
+
+
+class Peer:
+    """
+    Stand-in for the middleware of both controllers: `failover.call_remote` is executed against a local database.
+    """
+
+    def __init__(self, rtt):
+        self.rtt = rtt
+        self.round_trips = 0
+        self.db = sqlite3.connect(':memory:', isolation_level=None)
+        self.db.execute('CREATE TABLE storage_disk (disk_identifier TEXT PRIMARY KEY, disk_name TEXT)')
+
+    def call_sync(self, method, *args):
+        if method == 'failover.status':
+            return 'MASTER'
+
+        if method == 'failover.call_remote':
+            remote_method, remote_args = args
+            self.round_trips += 1
+            time.sleep(self.rtt)
+            if remote_method == 'datastore.sql':
+                query, params = remote_args
+                self.db.execute(query, params)
+            elif remote_method == 'datastore.execute_bulk':
+                statements, = remote_args
+                self.db.execute('BEGIN')
+                for sql, params in statements:
+                    self.db.executemany(sql, params)
+                self.db.execute('COMMIT')
+            else:
+                raise ValueError(remote_method)
+
+
+def statements(count):
+    for i in range(count):
+        if i % 2 == 0:
+            yield 'INSERT INTO storage_disk (disk_identifier, disk_name) VALUES (?, ?)', [f'serial{i}', f'sd{i}']
+        else:
+            yield 'UPDATE storage_disk SET disk_name = ? WHERE disk_identifier = ?', [f'nvme{i}', f'serial{i - 1}']
+
+
+def legacy(path, count, rtt):
+    journal = LegacyJournal(path)
+    peer = Peer(rtt)
+
+    start = time.perf_counter()
+    for item in statements(count):
+        journal.append(item)
+        journal.write()
+    record = time.perf_counter() - start
+
+    start = time.perf_counter()
+    while journal:
+        query, params = journal.peek()
+        peer.call_sync('failover.call_remote', 'datastore.sql', [query, params])
+        journal.shift()
+    journal.write()
+    replay = time.perf_counter() - start
+
+    return record, replay, peer
+
+
+def current(path, count, rtt):
+    Journal.path = path
+    journal = Journal()
+    peer = Peer(rtt)
+    journal_sync = JournalSync(peer, None, journal)
+
+    start = time.perf_counter()
+    for item in statements(count):
+        journal.append(item)
+        journal.write()
+    record = time.perf_counter() - start
+
+    start = time.perf_counter()
+    assert journal_sync._flush_journal()
+    journal.write()
+    replay = time.perf_counter() - start
+
+    return record, replay, peer
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--statements', type=int, default=10000)
+    parser.add_argument('--rtt', type=float, default=0.5, help='Simulated round trip time (ms)')
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, func in (('legacy', legacy), ('batched', current)):
+            record, replay, peer = func(os.path.join(tmp, f'{name}-journal'), args.statements, args.rtt / 1000)
+            results[name] = peer.db.execute('SELECT * FROM storage_disk ORDER BY disk_identifier').fetchall()
+            print(f'{name:<10}record {record:>8.2f}s  replay {replay:>8.2f}s  round trips {peer.round_trips:>6}')
+
+    assert results['legacy'] == results['batched']
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+"""
+Compare per-call schema overhead of compiled cleaners against deep-copying `clean` they replaced, for `accepts`
+arguments (that are still deep-copied, but after cleaning) and `returns` validation of a large
+`pool.dataset.query`-like result.
+
+    python -m middlewared.pytest.benchmark.schema --datasets 1000
+"""
+import argparse
+import copy
+import time
+
+from middlewared.schema import Any, Bool, clean_and_validate_arg, Dict, Int, List, Str, ValidationErrors
+
+PROPERTIES = [
+    'aclmode', 'acltype', 'atime', 'casesensitivity', 'checksum', 'compression', 'copies', 'deduplication',
+    'encryption', 'exec', 'keyformat', 'mountpoint', 'quota', 'readonly', 'recordsize', 'refquota',
+    'refreservation', 'reservation', 'snapdir', 'sync', 'used', 'usedbychildren', 'usedbydataset',
+    'usedbysnapshots', 'available', 'xattr',
+]
+
+
+def property_schema(name):
+    return Dict(name, Str('value', null=True), Str('rawvalue', null=True), Any('parsed', null=True),
+                Str('source', null=True), null=True)
+
+
+DATASET = Dict(
+    'pool_dataset_entry',
+    Str('id', required=True),
+    Str('name', required=True),
+    Str('pool', required=True),
+    Str('type', enum=['FILESYSTEM', 'VOLUME']),
+    Str('mountpoint', null=True),
+    Bool('encrypted'),
+    *[property_schema(name) for name in PROPERTIES],
+    List('children', items=[Any('child')]),
+    Dict('user_properties', additional_attrs=True),
+    additional_attrs=True,
+)
+
+QUERY_RESULT = List('pool_dataset_query', items=[DATASET])
+
+QUERY_OPTIONS = Dict(
+    'query-options',
+    Dict('extra', additional_attrs=True),
+    List('order_by', items=[Str('order_by')]),
+    List('select', items=[Str('select')]),
+    Int('offset', default=0),
+    Int('limit', default=0),
+)
+
+
+def generate(datasets):
+    data = []
+    for i in range(datasets):
+        name = f'tank/ds{i}'
+        dataset = {
+            'id': name,
+            'name': name,
+            'pool': 'tank',
+            'type': 'FILESYSTEM',
+            'mountpoint': f'/mnt/{name}',
+            'encrypted': False,
+            'children': [],
+            'user_properties': {'org.truenas:managedby': 'benchmark'},
+        }
+        for prop in PROPERTIES:
+            dataset[prop] = {'value': str(i), 'rawvalue': str(i), 'parsed': i, 'source': 'LOCAL'}
+        data.append(dataset)
+    return data
+
+
+def legacy_clean_and_validate_arg(verrors, attr, arg):
+    # What `accepts` and `validate_return_type` did before: deep copy the value then clean it in place
+    try:
+        value = attr.clean(copy.deepcopy(arg))
+        attr.validate(value)
+        return value
+    except ValidationErrors as e:
+        verrors.extend(e)
+
+
+def accepts_clean_and_validate_arg(verrors, attr, arg):
+    # `accepts` copies cleaned containers so that the method can modify them
+    value = clean_and_validate_arg(verrors, attr, arg)
+    if isinstance(value, (dict, list)):
+        value = copy.deepcopy(value)
+    return value
+
+
+def measure(func, attr, value, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        verrors = ValidationErrors()
+        func(verrors, attr, value)
+        verrors.check()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--datasets', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    data = generate(args.datasets)
+    cases = [
+        (f'returns ({args.datasets} datasets)', clean_and_validate_arg, QUERY_RESULT, data),
+        ('accepts (query options)', accepts_clean_and_validate_arg, QUERY_OPTIONS,
+         {'extra': {'flat': False, 'properties': PROPERTIES}}),
+        ('accepts (dataset)', accepts_clean_and_validate_arg, DATASET, data[0]),
+    ]
+
+    print(f'{"case":<32}{"legacy":>12}{"compiled":>12}{"speedup":>10}')
+    for name, func, attr, value in cases:
+        legacy = ValidationErrors()
+        compiled = ValidationErrors()
+        assert legacy_clean_and_validate_arg(legacy, attr, value) == func(compiled, attr, value)
+        assert not legacy and not compiled
+
+        repeat = args.repeat if isinstance(value, list) else args.repeat * 1000
+        old = measure(legacy_clean_and_validate_arg, attr, value, repeat)
+        new = measure(func, attr, value, repeat)
+        print(f'{name:<32}{old * 1000000:>10.1f}us{new * 1000000:>10.1f}us{old / new:>9.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+"""
+Compare `user.query` against the implementation that read every user's `authorized_keys` and all group memberships
+before filtering, on a temporary datastore with synthetic local users.
+
+    python -m middlewared.pytest.benchmark.user_query --users 10000
+"""
+import argparse
+import asyncio
+from contextlib import suppress
+import os
+import tempfile
+import time
+from unittest.mock import patch
+
+import middlewared.plugins.datastore.connection  # noqa
+from middlewared.plugins.account import GroupMembershipModel, GroupModel, UserModel, UserService
+from middlewared.pytest.unit.helpers import load_compound_service
+from middlewared.pytest.unit.middleware import Middleware
+from middlewared.sqlalchemy import Model
+from middlewared.utils import filter_list
+
+DatastoreService = load_compound_service("datastore")
+
+
+class ThreadedMiddleware(Middleware):
+    async def run_in_thread(self, method, *args, **kwargs):
+        return await asyncio.get_event_loop().run_in_executor(None, lambda: method(*args, **kwargs))
+
+
+class LegacyUserQuery:
+    """
+    `user.query` as it was: every row is extended (reading its `authorized_keys`) before filtering.
+    """
+
+    def __init__(self, service):
+        self.service = service
+        self.middleware = service.middleware
+        self.middleware['user.legacy_user_extend_context'] = self.user_extend_context
+        self.middleware['user.legacy_user_extend'] = self.user_extend
+
+    async def user_extend_context(self, rows, extra):
+        memberships = {}
+        res = await self.middleware.call(
+            'datastore.query', 'account.bsdgroupmembership',
+            [], {'prefix': 'bsdgrpmember_'}
+        )
+
+        for i in res:
+            uid = i['user']['id']
+            if uid in memberships:
+                memberships[uid].append(i['group']['id'])
+            else:
+                memberships[uid] = [i['group']['id']]
+
+        return {"memberships": memberships}
+
+    async def user_extend(self, user, ctx):
+        if user['email'] == '':
+            user['email'] = None
+
+        user['groups'] = ctx['memberships'].get(user['id'], [])
+        user['sshpubkey'] = await self.middleware.run_in_thread(self.service._read_authorized_keys, user['home'])
+
+        return user
+
+    async def query(self, filters, options):
+        options = dict(options)
+        options['extend'] = 'user.legacy_user_extend'
+        options['extend_context'] = 'user.legacy_user_extend_context'
+        options['prefix'] = 'bsdusr_'
+
+        datastore_options = options.copy()
+        datastore_options.pop('count', None)
+        datastore_options.pop('get', None)
+        datastore_options.pop('limit', None)
+        datastore_options.pop('offset', None)
+        datastore_options.pop('select', None)
+
+        result = await self.middleware.call('datastore.query', 'account.bsdusers', [], datastore_options)
+        for entry in result:
+            entry.update({'local': True, 'id_type_both': False, 'nt_name': None, 'sid': None})
+
+        return await self.middleware.run_in_thread(filter_list, result, filters, options)
+
+
+def populate(ds, users, home):
+    connection = next(part.connection for part in ds.parts if hasattr(part, "connection"))
+    Model.metadata.create_all(bind=connection, tables=[
+        GroupModel.__table__, UserModel.__table__, GroupMembershipModel.__table__,
+    ])
+
+    connection.execute(GroupModel.__table__.insert(), [
+        {'id': i, 'bsdgrp_gid': 1000 + i, 'bsdgrp_group': f'group{i}', 'bsdgrp_sudo_nopasswd': False,
+         'bsdgrp_sudo_commands': []}
+        for i in range(1, 11)
+    ])
+    connection.execute(UserModel.__table__.insert(), [
+        {
+            'id': i,
+            'bsdusr_uid': 1000 + i,
+            'bsdusr_username': f'user{i}',
+            'bsdusr_smbhash': '',
+            'bsdusr_home': os.path.join(home, f'user{i}'),
+            'bsdusr_full_name': f'User {i}',
+            'bsdusr_sudo_nopasswd': False,
+            'bsdusr_sudo_commands': [],
+            'bsdusr_microsoft_account': False,
+            'bsdusr_group_id': i % 10 + 1,
+            'bsdusr_attributes': {},
+            'bsdusr_email': '',
+        }
+        for i in range(1, users + 1)
+    ])
+    connection.execute(GroupMembershipModel.__table__.insert(), [
+        {'bsdgrpmember_group_id': (i + 1) % 10 + 1, 'bsdgrpmember_user_id': i} for i in range(1, users + 1)
+    ])
+
+    # Every tenth user has authorized keys, the others still need a failed `open` to find that out
+    for i in range(1, users + 1, 10):
+        os.makedirs(os.path.join(home, f'user{i}', '.ssh'))
+        with open(os.path.join(home, f'user{i}', '.ssh', 'authorized_keys'), 'w') as f:
+            f.write(f'ssh-ed25519 AAAA user{i}\n')
+
+
+async def measure(func, filters, options, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = await func(filters, options)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        m = ThreadedMiddleware()
+        with patch("middlewared.plugins.datastore.connection.FREENAS_DATABASE", os.path.join(tmp, 'db.sqlite')):
+            ds = DatastoreService(m)
+            await ds.setup()
+        m["datastore.query"] = ds.query
+        m["datastore.fetchall"] = ds.fetchall
+
+        populate(ds, args.users, os.path.join(tmp, 'home'))
+
+        service = UserService(m)
+        m['user.user_extend_context'] = service.user_extend_context
+        legacy = LegacyUserQuery(service)
+
+        query = UserService.query.wraps.wraps
+        cases = [
+            ('all fields', [], {}),
+            ('select username, uid', [], {'select': ['username', 'uid']}),
+            ('get by id', [['id', '=', args.users // 2]], {'get': True}),
+            ('count', [], {'count': True}),
+            ('filter by groups', [['groups', 'rin', 5]], {'select': ['username']}),
+        ]
+
+        print(f'{"case":<24}{"legacy":>12}{"lazy":>12}{"speedup":>10}')
+        for name, filters, options in cases:
+            old, old_result = await measure(legacy.query, filters, options, args.repeat)
+            new, new_result = await measure(lambda f, o: query(service, f, dict(o)), filters, options, args.repeat)
+            assert old_result == new_result, name
+            print(f'{name:<24}{old * 1000:>10.1f}ms{new * 1000:>10.1f}ms{old / new:>9.1f}x')
+
+        with suppress(Exception):
+            for part in ds.parts:
+                if getattr(part, 'engine', None) is not None:
+                    part.engine.dispose()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
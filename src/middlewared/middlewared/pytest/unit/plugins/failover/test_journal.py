@@ -1,6 +1,9 @@
 import errno
+import pickle
 from unittest.mock import MagicMock, Mock, patch
 
+import pytest
+
 from middlewared.plugins.failover_.journal import Journal, JournalSync
 from middlewared.service import CallError
 from middlewared.pytest.unit.middleware import Middleware
@@ -66,6 +69,96 @@ def test__journal_write__append_shift_append__write():
     journal._write.assert_called_once()
 
 
+@pytest.fixture
+def journal_path(tmp_path):
+    with patch.object(Journal, "path", str(tmp_path / "ha-journal")):
+        yield Journal.path
+
+
+def test__journal_file__append_only(journal_path):
+    journal = Journal()
+    journal.append(("INSERT 1", []))
+    journal.append(("INSERT 2", []))
+    journal.write()
+    journal.shift()
+    journal.append(("INSERT 3", []))
+    journal.write()
+
+    with open(journal_path, "rb") as f:
+        data = f.read()
+
+    assert list(Journal()) == [("INSERT 2", []), ("INSERT 3", [])]
+
+    journal.shift(2)
+    journal.write()
+
+    with open(journal_path, "rb") as f:
+        assert f.read() == b""
+
+    assert data
+
+
+def test__journal_file__clear(journal_path):
+    journal = Journal()
+    journal.append(("INSERT 1", []))
+    journal.append(("INSERT 2", []))
+    journal.write()
+    journal.clear()
+    journal.append(("INSERT 3", []))
+    journal.write()
+
+    assert list(Journal()) == [("INSERT 3", [])]
+
+
+def test__journal_file__clear__empty(journal_path):
+    journal = Journal()
+    journal.append(("INSERT 1", []))
+    journal.write()
+    journal.clear()
+    journal.write()
+
+    assert list(Journal()) == []
+
+
+def test__journal_file__compaction(journal_path):
+    with patch.object(Journal, "compact_threshold", 10):
+        journal = Journal()
+        journal.append(("INSERT 0", []))
+        journal.write()
+        for i in range(1, 50):
+            journal.append((f"INSERT {i}", []))
+            journal.write()
+            journal.shift()
+            journal.write()
+
+            assert journal.records <= 20
+
+    assert list(Journal()) == [("INSERT 49", [])]
+
+
+def test__journal_file__truncated(journal_path):
+    journal = Journal()
+    journal.append(("INSERT 1", []))
+    journal.append(("INSERT 2", []))
+    journal.write()
+
+    with open(journal_path, "r+b") as f:
+        f.truncate(len(f.read()) - 1)
+
+    assert list(Journal()) == [("INSERT 1", [])]
+
+
+def test__journal_file__legacy(journal_path):
+    with open(journal_path, "wb") as f:
+        pickle.dump([("INSERT 1", []), ("INSERT 2", [])], f)
+
+    journal = Journal()
+    assert list(journal) == [("INSERT 1", []), ("INSERT 2", [])]
+    journal.write()
+
+    assert list(Journal()) == [("INSERT 1", []), ("INSERT 2", [])]
+
+
 def test__journal_sync__flush_journal():
     middleware = Middleware()
     middleware['failover.status'] = Mock(return_value='MASTER')
@@ -73,15 +166,18 @@ def test__journal_sync__flush_journal():
     middleware['alert.oneshot_delete'] = Mock()
     journal = MagicMock()
     journal.__bool__.side_effect = [True, False]
-    journal.peek.return_value = [Mock(), Mock()]
+    journal.peek.return_value = [("UPDATE t SET a = ?", [1]), ([["DELETE FROM t WHERE a = ?", [[2], [3]]]], None)]
     journal_sync = JournalSync(middleware, Mock(), journal)
 
     assert journal_sync._flush_journal()
 
-    middleware['failover.call_remote'].assert_called_once_with('datastore.sql', journal.peek.return_value)
+    middleware['failover.call_remote'].assert_called_once_with('datastore.execute_bulk', [[
+        ["UPDATE t SET a = ?", [[1]]],
+        ["DELETE FROM t WHERE a = ?", [[2], [3]]],
+    ]])
     assert not journal_sync.last_query_failed
     middleware['alert.oneshot_delete'].assert_called_once_with('FailoverSyncFailed', None)
-    journal.shift.assert_called_once()
+    journal.shift.assert_called_once_with(2)
 
 
 def test__journal_sync__flush_journal__error():
@@ -91,7 +187,7 @@ def test__journal_sync__flush_journal__error():
     middleware['alert.oneshot_create'] = Mock()
     journal = MagicMock()
     journal.__bool__.side_effect = [True, False]
-    journal.peek.return_value = [Mock(), Mock()]
+    journal.peek.return_value = [("UPDATE t SET a = ?", [1]), ([["DELETE FROM t WHERE a = ?", [[2], [3]]]], None)]
     journal_sync = JournalSync(middleware, Mock(), journal)
 
     assert not journal_sync._flush_journal()
@@ -107,7 +203,7 @@ def test__journal_sync__flush_journal__network_error():
     middleware['failover.call_remote'] = Mock(side_effect=CallError('Connection refused', errno.ECONNREFUSED))
     journal = MagicMock()
     journal.__bool__.side_effect = [True, False]
-    journal.peek.return_value = [Mock(), Mock()]
+    journal.peek.return_value = [("UPDATE t SET a = ?", [1]), ([["DELETE FROM t WHERE a = ?", [[2], [3]]]], None)]
     journal_sync = JournalSync(middleware, Mock(), journal)
 
     assert not journal_sync._flush_journal()
@@ -0,0 +1,110 @@
+from unittest.mock import Mock
+
+import pytest
+
+from middlewared.plugins.account import UserService
+from middlewared.pytest.unit.middleware import Middleware
+from middlewared.schema import resolve_methods, Schemas, validate_return_type
+
+
+def user(id, username, home):
+    return {"id": id, "uid": 1000 + id, "username": username, "home": str(home), "email": ""}
+
+
+@pytest.fixture
+def users(tmp_path):
+    (tmp_path / "alice" / ".ssh").mkdir(parents=True)
+    (tmp_path / "alice" / ".ssh" / "authorized_keys").write_text("ssh-rsa alice\n")
+    (tmp_path / "bob").mkdir()
+
+    m = Middleware()
+    m["datastore.query"] = Mock(side_effect=lambda name, filters, options: {
+        "account.bsdusers": [user(1, "alice", tmp_path / "alice"), user(2, "bob", tmp_path / "bob")],
+        "account.bsdgroupmembership": [{"id": 1, "user_id": 1, "group_id": 10},
+                                       {"id": 2, "user_id": 1, "group_id": 20}],
+    }[name])
+    m["smb.passdb_list"] = Mock(return_value=[{"Unix username": "bob", "NT username": "", "User SID": "S-1-5-bob"}])
+
+    service = UserService(m)
+    m["user.user_extend_context"] = service.user_extend_context
+    return service
+
+
+async def query(service, filters=None, options=None):
+    return await UserService.query.wraps.wraps(service, filters or [], options or {})
+
+
+def datastore_queries(service):
+    return [call.args[0] for call in service.middleware["datastore.query"].call_args_list]
+
+
+@pytest.mark.asyncio
+async def test__user_query(users):
+    result = await query(users)
+
+    assert [(u["username"], u["groups"], u["sshpubkey"], u["email"]) for u in result] == [
+        ("alice", [10, 20], "ssh-rsa alice\n", None),
+        ("bob", [], None, None),
+    ]
+    assert result[0]["local"] is True
+    assert result[0]["sid"] is None
+    users.middleware["smb.passdb_list"].assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test__user_query__select(users):
+    users._read_authorized_keys = Mock()
+
+    result = await query(users, [], {"select": ["username", "uid"]})
+
+    assert result == [{"username": "alice", "uid": 1001}, {"username": "bob", "uid": 1002}]
+    users._read_authorized_keys.assert_not_called()
+    assert datastore_queries(users) == ["account.bsdusers"]
+
+
+@pytest.mark.asyncio
+async def test__user_query__extra(users):
+    result = await query(users, [], {"extra": {"sshpubkey": False}})
+
+    assert [(u["groups"], u["sshpubkey"]) for u in result] == [([10, 20], None), ([], None)]
+
+
+@pytest.mark.asyncio
+async def test__user_query__extra__returns_validation(users):
+    resolve_methods(Schemas(), [
+        {"keys": [key], "has_key": lambda key: True, "get_attr": lambda key, method=method: getattr(method, key)}
+        for method, key in [(UserService.do_create, "accepts"), (UserService.query, "returns")]
+    ])
+
+    result = await query(users, [], {"extra": {"groups": False, "sshpubkey": False}})
+
+    assert [(u["groups"], u["sshpubkey"]) for u in result] == [(None, None), (None, None)]
+    validate_return_type(UserService.query, result, UserService.query.returns)
+
+
+@pytest.mark.asyncio
+async def test__user_query__only_extends_matching_users(users):
+    users._read_authorized_keys = Mock(return_value="ssh-rsa bob\n")
+
+    result = await query(users, [["username", "=", "bob"]], {"get": True})
+
+    assert result["sshpubkey"] == "ssh-rsa bob\n"
+    users._read_authorized_keys.assert_called_once_with(result["home"])
+
+
+@pytest.mark.asyncio
+async def test__user_query__filter_lazy_field(users):
+    result = await query(users, [["groups", "rin", 20]], {"select": ["username"]})
+
+    assert result == [{"username": "alice"}]
+
+
+@pytest.mark.asyncio
+async def test__user_query__smb(users):
+    result = await query(users, [], {"extra": {"additional_information": ["SMB"]}, "select": ["username", "sid"]})
+
+    assert result == [{"username": "alice", "sid": ""}, {"username": "bob", "sid": "S-1-5-bob"}]
+
+    users.middleware["smb.passdb_list"].reset_mock()
+    await query(users, [], {"extra": {"additional_information": ["SMB"]}, "select": ["username"]})
+    users.middleware["smb.passdb_list"].assert_not_called()
@@ -0,0 +1,150 @@
+import asyncio
+from unittest.mock import patch
+
+import pytest
+
+from middlewared.alert.base import Alert, AlertCategory, AlertClass, AlertLevel, AlertSource
+from middlewared.plugins.alert import AlertService, AlertStore
+from middlewared.pytest.unit.middleware import Middleware
+
+
+class SchedulerTestAlertClass(AlertClass):
+    category = AlertCategory.SYSTEM
+    level = AlertLevel.WARNING
+    title = "Test"
+    text = "Test"
+
+
+class FastAlertSource(AlertSource):
+    async def check(self):
+        return Alert(SchedulerTestAlertClass)
+
+
+class HungAlertSource(AlertSource):
+    run_timeout = 0.1
+
+    started = 0
+
+    async def check(self):
+        HungAlertSource.started += 1
+        await asyncio.sleep(3600)
+
+
+@pytest.mark.asyncio
+async def test__run_sources__hung_source():
+    m = Middleware()
+    sources = {"Fast": FastAlertSource(m), "Hung": HungAlertSource(m)}
+    with patch("middlewared.plugins.alert.ALERT_SOURCES", sources):
+        alert_service = AlertService(m)
+
+        for i in range(2):
+            result = await alert_service.run_sources(["Fast", "Hung"])
+
+            assert [alert["klass"] for alert in result["Fast"]] == ["SchedulerTest"]
+            assert [alert["klass"] for alert in result["Hung"]] == ["AlertSourceRunFailed"]
+
+        # Hung source is not started again while it is still running
+        assert HungAlertSource.started == 1
+
+        stats = await alert_service.source_stats()
+        assert not stats["Fast"]["timed_out"]
+        assert stats["Hung"]["timed_out"]
+        assert stats["Hung"]["duration"] >= 0.2
+
+        alert_service.alert_source_tasks["Hung"][0].cancel()
+
+
+class SlowAlertSource(AlertSource):
+    started = 0
+
+    async def check(self):
+        SlowAlertSource.started += 1
+        await asyncio.sleep(0.1)
+        return Alert(SchedulerTestAlertClass)
+
+
+@pytest.mark.asyncio
+async def test__run_sources__concurrent_calls():
+    m = Middleware()
+    with patch("middlewared.plugins.alert.ALERT_SOURCES", {"Slow": SlowAlertSource(m)}):
+        alert_service = AlertService(m)
+
+        results = await asyncio.gather(alert_service.run_sources(["Slow"]), alert_service.run_source("Slow"))
+
+        assert [alert["klass"] for alert in results[0]["Slow"]] == ["SchedulerTest"]
+        assert [alert["klass"] for alert in results[1]] == ["SchedulerTest"]
+        assert SlowAlertSource.started == 1
+        assert alert_service.alert_source_tasks == {}
+
+
+def test__alert_store():
+    a = Alert(SchedulerTestAlertClass, args={"n": 1}, node="A", _uuid="a", _source="Fast")
+    b = Alert(SchedulerTestAlertClass, args={"n": 2}, node="B", _uuid="b", _source="Fast")
+    c = Alert(SchedulerTestAlertClass, args={"n": 3}, node="A", _uuid="c", _source="Other")
+    store = AlertStore([a, b, c])
+
+    assert store.get("b") is b
+    assert store.get_by_key("A", "Fast", SchedulerTestAlertClass, a.key) is a
+    assert store.source_alerts("Fast", "A") == [a]
+    assert store.klass_alerts(SchedulerTestAlertClass, "A") == [a, c]
+
+    d = Alert(SchedulerTestAlertClass, args={"n": 4}, node="A", _uuid="d", _source="Fast")
+    store.replace_source("Fast", [d])
+    assert list(store) == [c, d]
+    assert store.get("a") is None
+    assert store.get_by_key("A", "Fast", SchedulerTestAlertClass, a.key) is None
+    assert store.source_alerts("Fast") == [d]
+
+    store.remove(c)
+    assert list(store) == [d]
+    assert store.klass_alerts(SchedulerTestAlertClass) == [d]
+    assert "Other" not in store.by_source
+
+
+@pytest.mark.asyncio
+async def test__flush_alerts__only_changes():
+    rows = [
+        {"id": id, "node": "A", "source": "Fast", "key": str(id), "datetime": None, "last_occurrence": None,
+         "text": "Test", "args": id, "dismissed": False, "uuid": uuid, "klass": "SchedulerTest"}
+        for id, uuid in [(1, "a"), (2, "b"), (3, "c")]
+    ]
+
+    bulk = []
+
+    async def datastore_bulk(operations):
+        bulk.append(operations)
+        return [10 if operation["type"] == "INSERT" else True for operation in operations]
+
+    m = Middleware()
+    m["system.is_enterprise"] = lambda: False
+    m["datastore.query"] = lambda *args: [dict(row) for row in rows]
+    m["failover.licensed"] = lambda: False
+    m["datastore.bulk"] = datastore_bulk
+
+    alert_service = AlertService(m)
+    await alert_service.initialize()
+
+    await alert_service.flush_alerts()
+    assert bulk == []
+
+    alert_service.alerts.get("a").dismissed = True
+    alert_service.alerts.remove(alert_service.alerts.get("b"))
+    alert_service.alerts.add(Alert(SchedulerTestAlertClass, args=4, node="A", _uuid="d", _source="Fast"))
+
+    await alert_service.flush_alerts()
+    assert bulk.pop() == [
+        {"type": "UPDATE", "name": "system.alert", "id_or_filters": 1, "data": {"dismissed": True}},
+        {"type": "INSERT", "name": "system.alert", "data": {
+            "uuid": "d", "source": "Fast", "klass": "SchedulerTest", "args": 4, "node": "A", "key": "4",
+            "datetime": None, "last_occurrence": None, "dismissed": None, "text": "Test",
+        }},
+        {"type": "DELETE", "name": "system.alert", "id_or_filters": [["id", "in", [2]]]},
+    ]
+
+    alert_service.alerts.remove(alert_service.alerts.get("d"))
+    await alert_service.flush_alerts()
+    assert bulk.pop() == [{"type": "DELETE", "name": "system.alert", "id_or_filters": [["id", "in", [10]]]}]
+
+    await alert_service.initialize(False)
+    await alert_service.flush_alerts()
+    assert bulk.pop() == [{"type": "DELETE", "name": "system.alert", "id_or_filters": []}]
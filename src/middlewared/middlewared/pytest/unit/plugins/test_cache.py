@@ -0,0 +1,118 @@
+from unittest.mock import patch
+
+import pytest
+
+from middlewared.plugins.cache import cache_namespace, estimate_size, LocalCache
+
+
+def monotonic(value):
+    return patch("middlewared.plugins.cache.time.monotonic", return_value=value)
+
+
+@pytest.mark.parametrize("key,namespace", [
+    ("failover_status", "failover"),
+    ("update.applied", "update"),
+    ("SMB_HA_MODE", "SMB"),
+    ("interfaces", "interfaces"),
+])
+def test__cache_namespace(key, namespace):
+    assert cache_namespace(key) == namespace
+
+
+def test__estimate_size():
+    value = ["x" * 1000]
+    assert estimate_size(value) > 1000
+    assert estimate_size({"a": value, "b": value}) < 2000
+
+
+def test__local_cache__lru():
+    cache = LocalCache(size=2)
+    cache.put("a_key", 1, 60)
+    cache.put("b_key", 2, 60)
+    assert cache.get("a_key") == 1
+    cache.put("c_key", 3, 60)
+
+    assert "a_key" in cache
+    assert "b_key" not in cache
+    assert "c_key" in cache
+    assert cache.namespaces_stats()["b"]["evictions"] == 1
+
+
+def test__local_cache__lru_does_not_evict_entries_without_timeout():
+    cache = LocalCache(size=2)
+    cache.put("failover_status", "MASTER")
+    for i in range(10):
+        cache.put(f"key_{i}", i, 60)
+
+    assert cache.get("failover_status") == "MASTER"
+    assert sorted(cache.entries) == ["key_8", "key_9"]
+
+    # Changing the timeout moves the entry between the two kinds
+    cache.put("failover_status", "BACKUP", 60)
+    cache.put("key_10", 10, 60)
+    assert "failover_status" in cache
+    assert "key_9" not in cache
+    cache.put("key_10", 10)
+    assert list(cache.entries) == ["failover_status"]
+    assert cache.pop("key_10") == 10
+    assert "key_10" not in cache
+
+
+def test__local_cache__timeout():
+    cache = LocalCache()
+    with monotonic(100):
+        cache.put("key", "value", 10)
+        cache.put("forever", "value")
+
+    with monotonic(109):
+        assert cache.get("key") == "value"
+
+    with monotonic(110):
+        with pytest.raises(KeyError):
+            cache.get("key")
+
+        assert cache.get("forever") == "value"
+
+    stats = cache.namespaces_stats()["key"]
+    assert (stats["hits"], stats["misses"], stats["expirations"], stats["entries"]) == (1, 1, 1, 0)
+
+
+def test__local_cache__expire():
+    cache = LocalCache()
+    with monotonic(100):
+        for i in range(10):
+            cache.put(f"key_{i}", i, i + 1)
+        # Overwritten with a longer timeout
+        cache.put("key_0", 0, 100)
+        cache.put("forever", "value")
+
+    with monotonic(105):
+        cache.expire()
+
+    assert sorted(cache.entries) == ["key_0"] + [f"key_{i}" for i in range(5, 10)]
+    assert "forever" in cache
+    assert cache.namespaces_stats()["key"]["expirations"] == 4
+    assert len(cache.expirations) == 6
+
+
+def test__local_cache__expirations_heap_is_compacted():
+    cache = LocalCache()
+    for i in range(1000):
+        cache.put("key", i, 60)
+
+    assert len(cache.expirations) < 200
+
+
+def test__local_cache__stats():
+    cache = LocalCache()
+    cache.put("catalog_feature_map", {"feature": ["x" * 1000]})
+    cache.put("catalog_train_details", "details")
+    cache.pop("catalog_train_details")
+
+    with pytest.raises(KeyError):
+        cache.get("failover_status")
+
+    stats = cache.namespaces_stats()
+    assert stats["catalog"]["entries"] == 1
+    assert stats["catalog"]["bytes"] > 1000
+    assert stats["failover"] == {"hits": 0, "misses": 1, "evictions": 0, "expirations": 0, "entries": 0, "bytes": 0}
@@ -1,13 +1,16 @@
 # flake8: noqa
 import io
+import shutil
 import textwrap
 from unittest.mock import Mock
 
 import pytest
 
 from middlewared.plugins.cloud_sync import (
-    get_dataset_recursive, FsLockManager, lsjson_error_excerpt, RcloneVerboseLogCutter
+    get_dataset_recursive, FsLockManager, lsjson_error_excerpt, rclone_rcd, RcloneConfigTuple, RcloneVerboseLogCutter
 )
+from middlewared.rclone.rcd import RcloneRcd
+from middlewared.service_exception import CallError
 
 
 def test__get_dataset_recursive_1():
@@ -339,3 +342,39 @@ def test__RcloneVerboseLogCutter(input, output):
         out += result
 
     assert out == output
+
+
+@pytest.mark.skipif(shutil.which("rclone") is None, reason="rclone is not available")
+@pytest.mark.asyncio
+async def test__rclone_rcd(tmp_path):
+    src = tmp_path / "src"
+    src.mkdir()
+    (src / "file").write_bytes(b"0" * 1000)
+    (src / "link").symlink_to(src / "file")
+    dst = tmp_path / "dst"
+
+    cloud_sync = {
+        "attributes": {"folder": str(dst)},
+        "direction": "PUSH",
+        "transfer_mode": "COPY",
+        "transfers": 2,
+        "follow_symlinks": True,
+    }
+    config = RcloneConfigTuple(None, f"remote:{dst}", [], {"remote": {"type": "local"}}, None)
+
+    job = Mock(internal_data={}, logs_fd=io.BytesIO())
+    rcd = RcloneRcd(str(tmp_path / "rcd"), stats_interval=0.1)
+    try:
+        remote_config = await rclone_rcd(rcd, job, cloud_sync, config, str(src), config.remote_path, False)
+        assert remote_config == {"type": "local"}
+        assert (dst / "link").read_bytes() == b"0" * 1000
+        assert job.set_progress.call_args[0][0] == 100
+        assert job.set_progress.call_args[0][2]["total_transfers"] == 2
+        assert b"file: Transferred 1000 bytes" in job.logs_fd.getvalue()
+
+        with pytest.raises(CallError) as e:
+            await rclone_rcd(rcd, job, cloud_sync, config, str(tmp_path / "nonexistent"), config.remote_path,
+                             False)
+        assert "directory not found" in e.value.errmsg
+    finally:
+        await rcd.stop()
@@ -1,6 +1,7 @@
 from contextlib import asynccontextmanager
 import datetime
-from unittest.mock import ANY, patch
+import os
+from unittest.mock import ANY, Mock, patch
 
 import pytest
 import sqlalchemy as sa
@@ -24,9 +25,9 @@ Model = declarative_base()
 
 
 @asynccontextmanager
-async def datastore_test():
+async def datastore_test(database=":memory:"):
     m = Middleware()
-    with patch("middlewared.plugins.datastore.connection.FREENAS_DATABASE", ":memory:"):
+    with patch("middlewared.plugins.datastore.connection.FREENAS_DATABASE", database):
         with patch("middlewared.plugins.datastore.schema.Model", Model):
             with patch("middlewared.plugins.datastore.util.Model", Model):
                 ds = DatastoreService(m)
@@ -41,12 +42,14 @@ async def datastore_test():
 
                 m["datastore.execute"] = ds.execute
                 m["datastore.execute_write"] = ds.execute_write
+                m["datastore.execute_write_bulk"] = ds.execute_write_bulk
                 m["datastore.fetchall"] = ds.fetchall
 
                 m["datastore.query"] = ds.query
                 m["datastore.send_insert_events"] = ds.send_insert_events
                 m["datastore.send_update_events"] = ds.send_update_events
                 m["datastore.send_delete_events"] = ds.send_delete_events
+                m["datastore.send_update_events_bulk"] = ds.send_update_events_bulk
 
                 m["datastore.update"] = ds.update
 
@@ -145,6 +148,82 @@ async def test__prefix():
         ]
 
 
+@pytest.mark.asyncio
+async def test__extend():
+    async with datastore_test() as ds:
+        await ds.execute("INSERT INTO `account_bsdgroups` VALUES (10, 1010)")
+        await ds.execute("INSERT INTO `account_bsdgroups` VALUES (20, 2020)")
+
+        ds.middleware["test.extend_context"] = Mock(return_value=1)
+        ds.middleware["test.extend"] = lambda row, context: {**row, "gid": row["bsdgrp_gid"] + context}
+
+        assert await ds.query("account.bsdgroups", [], {
+            "extend": "test.extend", "extend_context": "test.extend_context", "select": ["id", "gid"],
+        }) == [{"id": 10, "gid": 1011}, {"id": 20, "gid": 2021}]
+
+
+@pytest.mark.asyncio
+async def test__extend_batch():
+    async with datastore_test() as ds:
+        await ds.execute("INSERT INTO `account_bsdgroups` VALUES (10, 1010)")
+        await ds.execute("INSERT INTO `account_bsdgroups` VALUES (20, 2020)")
+
+        ds.middleware["test.extend"] = Mock()
+        ds.middleware["test.extend_batch"] = Mock(side_effect=lambda rows: [{**row, "count": len(rows)} for row in rows])
+
+        assert await ds.query("account.bsdgroups", [], {
+            "extend": "test.extend", "extend_batch": "test.extend_batch", "select": ["id", "count"],
+        }) == [{"id": 10, "count": 2}, {"id": 20, "count": 2}]
+        ds.middleware["test.extend_batch"].assert_called_once()
+        ds.middleware["test.extend"].assert_not_called()
+
+        ds.middleware["test.extend_batch"].reset_mock()
+        assert await ds.query("account.bsdgroups", [("bsdgrp_gid", "=", 3030)], {
+            "extend": "test.extend", "extend_batch": "test.extend_batch",
+        }) == []
+        ds.middleware["test.extend_batch"].assert_not_called()
+        ds.middleware["test.extend"].assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test__prepared_query_reused():
+    async with datastore_test() as ds:
+        query_cache = [part for part in ds.parts if hasattr(part, "query_cache")][0].query_cache
+        query_cache.clear()
+        await ds.execute("INSERT INTO `account_bsdgroups` VALUES (10, 1010)")
+        await ds.execute("INSERT INTO `account_bsdgroups` VALUES (20, 2020)")
+
+        assert await ds.query("account.bsdgroups", [("bsdgrp_gid", "=", 1010)]) == [{"id": 10, "bsdgrp_gid": 1010}]
+        assert len(query_cache) == 1
+        assert await ds.query("account.bsdgroups", [("bsdgrp_gid", "=", 2020)]) == [{"id": 20, "bsdgrp_gid": 2020}]
+        assert len(query_cache) == 1
+
+        assert await ds.query("account.bsdgroups", [("bsdgrp_gid", "in", [1010, None])]) == [
+            {"id": 10, "bsdgrp_gid": 1010},
+        ]
+        assert await ds.query("account.bsdgroups", [("bsdgrp_gid", "in", [1010, 2020, None])]) == [
+            {"id": 10, "bsdgrp_gid": 1010},
+            {"id": 20, "bsdgrp_gid": 2020},
+        ]
+        assert await ds.query("account.bsdgroups", [("bsdgrp_gid", "in", [None])]) == []
+        assert len(query_cache) == 3
+
+
+@pytest.mark.asyncio
+async def test__read_connections(tmp_path):
+    async with datastore_test(str(tmp_path / "freenas-v1.db")) as ds:
+        part = [part for part in ds.parts if hasattr(part, "read_engine")][0]
+        assert part.read_engine is not None
+        assert (await ds.fetchall("PRAGMA journal_mode"))[0][0] == "wal"
+
+        await ds.insert("account.bsdgroups", {"bsdgrp_gid": 1010})
+        assert await ds.query("account.bsdgroups", [("bsdgrp_gid", "=", 1010)]) == [{"id": 1, "bsdgrp_gid": 1010}]
+        assert (await ds.fetchall("SELECT 'abc' REGEXP 'B'"))[0][0] == 1
+
+        with pytest.raises(Exception):
+            await ds.fetchall("DELETE FROM account_bsdgroups")
+
+
 @pytest.mark.asyncio
 async def test__prefix_filter():
     async with datastore_test() as ds:
@@ -652,6 +731,66 @@ async def test__mtm_update():
         ]
 
 
+@pytest.mark.asyncio
+async def test__bulk():
+    async with datastore_test() as ds:
+        await ds.execute("INSERT INTO storage_disk VALUES (10)")
+        await ds.execute("INSERT INTO storage_disk VALUES (20)")
+        await ds.execute("INSERT INTO tasks_smarttest VALUES (100)")
+        await ds.execute("INSERT INTO tasks_smarttest VALUES (200)")
+
+        assert await ds.bulk([
+            {"type": "INSERT", "name": "tasks.smarttest", "data": {"disks": [10, 20]}},
+            {"type": "INSERT", "name": "tasks.smarttest", "data": {"disks": [20]}},
+            {"type": "UPDATE", "name": "tasks.smarttest", "id_or_filters": 100, "data": {"disks": [10]}},
+            {"type": "DELETE", "name": "tasks.smarttest", "id_or_filters": 200},
+        ], {"prefix": "smarttest_"}) == [201, 202, 100, True]
+
+        assert await ds.query("tasks.smarttest", [], {"prefix": "smarttest_"}) == [
+            {"id": 100, "disks": [{"id": 10}]},
+            {"id": 201, "disks": [{"id": 10}, {"id": 20}]},
+            {"id": 202, "disks": [{"id": 20}]},
+        ]
+
+        ds.middleware.call_hook_inline.assert_called_once_with("datastore.post_execute_write_bulk", ANY, ANY)
+
+
+@pytest.mark.asyncio
+async def test__bulk_executemany():
+    async with datastore_test() as ds:
+        await ds.execute("INSERT INTO `account_bsdgroups` VALUES (10, 1010)")
+        await ds.execute("INSERT INTO `account_bsdgroups` VALUES (20, 2020)")
+
+        await ds.bulk([
+            {"type": "UPDATE", "name": "account.bsdgroups", "id_or_filters": 10, "data": {"bsdgrp_gid": 1011}},
+            {"type": "UPDATE", "name": "account.bsdgroups", "id_or_filters": 20, "data": {"bsdgrp_gid": 2021}},
+        ])
+
+        assert ds.middleware.call_hook_inline.call_args[0][1] == [
+            [
+                "UPDATE account_bsdgroups SET bsdgrp_gid=? WHERE account_bsdgroups.id = ?",
+                [[1011, 10], [2021, 20]],
+            ],
+        ]
+        assert [row["bsdgrp_gid"] for row in await ds.query("account.bsdgroups")] == [1011, 2021]
+
+
+@pytest.mark.asyncio
+async def test__bulk_rollback():
+    async with datastore_test() as ds:
+        await ds.execute("INSERT INTO `account_bsdgroups` VALUES (10, 1010)")
+
+        with pytest.raises(RuntimeError):
+            await ds.bulk([
+                {"type": "UPDATE", "name": "account.bsdgroups", "id_or_filters": 10, "data": {"bsdgrp_gid": 1011}},
+                {"type": "INSERT", "name": "account.bsdgroups", "data": {"bsdgrp_gid": 2020}},
+                {"type": "UPDATE", "name": "account.bsdgroups", "id_or_filters": 30, "data": {"bsdgrp_gid": 3030}},
+            ])
+
+        assert await ds.query("account.bsdgroups") == [{"id": 10, "bsdgrp_gid": 1010}]
+        ds.middleware.call_hook_inline.assert_not_called()
+
+
 class DefaultModel(Model):
     __tablename__ = "test_default"
 
@@ -776,3 +915,20 @@ async def test__null_order_by(order_by, result):
         await ds.insert("test.null", {"value": 1})
 
         assert [row["id"] for row in await ds.query("test.null", [], {"order_by": order_by})] == result
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("keep_source", [True, False])
+async def test__replace(tmp_path, keep_source):
+    backup = str(tmp_path / "backup.db")
+    async with datastore_test(str(tmp_path / "freenas-v1.db")) as ds:
+        await ds.insert("account.bsdgroups", {"bsdgrp_gid": 1010})
+        await ds.execute(f"VACUUM INTO '{backup}'")
+        # Stays in the write-ahead log of the database that is being replaced
+        await ds.insert("account.bsdgroups", {"bsdgrp_gid": 2020})
+
+        part = [part for part in ds.parts if hasattr(part, "replace")][0]
+        await ds.middleware.run_in_executor(part.thread_pool, part.replace, backup, keep_source)
+
+        assert await ds.query("account.bsdgroups") == [{"id": 1, "bsdgrp_gid": 1010}]
+        assert os.path.exists(backup) == keep_source
@@ -0,0 +1,107 @@
+import asyncio
+import os
+from unittest.mock import Mock
+
+import pytest
+
+from middlewared.plugins.etc import EtcService, PyRenderer
+from middlewared.pytest.unit.middleware import Middleware
+
+
+@pytest.mark.asyncio
+async def test__generate_checkpoint__dependencies():
+    etc = EtcService(Middleware())
+    etc.GROUPS = {"nginx": [], "ssl": [], "motd": []}
+    etc.DEPENDENCIES = {"nginx": ["ssl"]}
+
+    events = []
+
+    async def generate(name, checkpoint):
+        events.append(f"{name} started")
+        await asyncio.sleep(0.01 if name == "ssl" else 0)
+        events.append(f"{name} finished")
+
+    etc.generate = generate
+    await etc.generate_checkpoint("initial")
+
+    assert events.index("nginx started") > events.index("ssl finished")
+    # Independent groups are generated concurrently
+    assert events.index("motd started") < events.index("ssl finished")
+
+
+@pytest.mark.asyncio
+async def test__generate_checkpoint__failed_dependency():
+    etc = EtcService(Middleware())
+    etc.GROUPS = {"nginx": [], "ssl": []}
+    etc.DEPENDENCIES = {"nginx": ["ssl"]}
+    etc.logger = Mock()
+
+    generated = []
+
+    async def generate(name, checkpoint):
+        if name == "ssl":
+            raise ValueError()
+
+        generated.append(name)
+
+    etc.generate = generate
+    await etc.generate_checkpoint("initial")
+
+    assert generated == ["nginx"]
+    etc.logger.error.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test__gather_ctx():
+    m = Middleware()
+    m["nfs.config"] = Mock(return_value={"servers": 4})
+    m["sharing.nfs.query"] = Mock(return_value=[])
+    etc = EtcService(m)
+
+    assert await etc.gather_ctx([
+        {"method": "sharing.nfs.query", "args": [[("enabled", "=", True)]]},
+        {"method": "nfs.config"},
+    ]) == {"sharing.nfs.query": [], "nfs.config": {"servers": 4}}
+    m["sharing.nfs.query"].assert_called_once_with([("enabled", "=", True)])
+
+
+def test__make_changes(tmp_path):
+    etc = EtcService(Middleware())
+    path = str(tmp_path / "dir" / "file.conf")
+
+    assert etc.make_changes(path, {}, "contents")
+    with open(path) as f:
+        assert f.read() == "contents"
+    assert os.stat(path).st_mode & 0o777 == 0o644
+
+    assert not etc.make_changes(path, {}, "contents")
+
+    # Modified outside of middleware
+    with open(path, "w") as f:
+        f.write("modified")
+    assert etc.make_changes(path, {}, "contents")
+    with open(path) as f:
+        assert f.read() == "contents"
+
+    os.chmod(path, 0o600)
+    assert etc.make_changes(path, {}, "contents")
+    assert os.stat(path).st_mode & 0o777 == 0o644
+
+    assert etc.make_changes(path, {}, "new contents")
+    with open(path) as f:
+        assert f.read() == "new contents"
+
+
+@pytest.mark.asyncio
+async def test__py_renderer__module_is_cached(tmp_path):
+    path = tmp_path / "renderer"
+    (tmp_path / "renderer.py").write_text("def render(service, middleware):\n    return 'first'\n")
+
+    renderer = PyRenderer(EtcService(Middleware()))
+    assert await renderer.render(str(path), None) == "first"
+    module = renderer.load_module(str(path))
+    assert renderer.load_module(str(path)) is module
+
+    (tmp_path / "renderer.py").write_text("def render(service, middleware, ctx):\n    return ctx\n")
+    os.utime(tmp_path / "renderer.py", ns=(0, os.stat(tmp_path / "renderer.py").st_mtime_ns + 1000))
+    assert await renderer.render(str(path), "second") == "second"
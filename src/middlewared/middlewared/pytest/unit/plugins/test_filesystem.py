@@ -0,0 +1,67 @@
+import os
+from unittest.mock import Mock
+
+import pytest
+
+from middlewared.plugins.filesystem import FilesystemService
+from middlewared.plugins.filesystem_.listdir import iter_directory
+from middlewared.service_exception import CallError
+
+
+def listdir(path, filters=None, options=None):
+    service = FilesystemService(Mock())
+    return FilesystemService.listdir.wraps(service, str(path), filters or [], options or {})
+
+
+def create_tree(path):
+    for i in range(10):
+        (path / f"file{i}").write_text("x" * i)
+    (path / "dir").mkdir()
+    (path / "ix-applications").mkdir()
+    os.symlink(path / "file1", path / "link")
+    os.symlink(path / "missing", path / "broken")
+
+
+def test__listdir(tmp_path):
+    create_tree(tmp_path)
+
+    entries = {entry["name"]: entry for entry in listdir(tmp_path)}
+
+    assert set(entries) == {f"file{i}" for i in range(10)} | {"dir", "link"}
+    assert entries["file3"]["type"] == "FILE"
+    assert entries["file3"]["size"] == 3
+    assert entries["file3"]["path"] == str(tmp_path / "file3")
+    assert entries["file3"]["acl"] is False
+    assert entries["dir"]["type"] == "DIRECTORY"
+    assert entries["link"]["type"] == "SYMLINK"
+    assert entries["link"]["realpath"] == str(tmp_path / "file1")
+
+
+def test__listdir__paginated(tmp_path):
+    create_tree(tmp_path)
+
+    assert [entry["name"] for entry in listdir(tmp_path, [["type", "=", "FILE"]], {
+        "order_by": ["-size"], "offset": 2, "limit": 3,
+    })] == ["file7", "file6", "file5"]
+    assert [entry["name"] for entry in listdir(tmp_path, [["name", ">", "file7"]], {
+        "order_by": ["name"], "limit": 2,
+    })] == ["file8", "file9"]
+    assert listdir(tmp_path, [["type", "=", "DIRECTORY"]], {"count": True}) == 1
+
+
+def test__listdir__acl(tmp_path):
+    create_tree(tmp_path)
+
+    assert listdir(tmp_path, [["name", "=", "dir"]], {"select": ["name", "acl"]}) == [{"name": "dir", "acl": False}]
+    assert listdir(tmp_path, [["name", "=", "dir"]], {"get": True, "extra": {"acl": False}})["acl"] is None
+
+
+def test__listdir__ix_applications(tmp_path):
+    create_tree(tmp_path)
+    (tmp_path / "ix-applications" / "releases").mkdir()
+    (tmp_path / "ix-applications" / "releases" / "file").write_text("x")
+
+    assert list(iter_directory(str(tmp_path / "ix-applications"))) == []
+    assert list(iter_directory(str(tmp_path / "ix-applications" / "releases"))) == []
+    with pytest.raises(CallError):
+        listdir(tmp_path / "ix-applications" / "releases")
@@ -0,0 +1,163 @@
+import errno
+import os
+import shutil
+import struct
+import subprocess
+import threading
+import time
+from unittest.mock import Mock, patch
+
+import pytest
+
+from middlewared.plugins.filesystem_.acl_linux import FilesystemService
+from middlewared.plugins.filesystem_.perm_walk import PermWalk, POSIX_ACL_ACCESS, POSIX_ACL_DEFAULT
+from middlewared.service_exception import CallError
+
+ACLTOOL = "/usr/bin/nfs4xdr_winacl"
+
+
+def posix_acl(*entries):
+    # `posix_acl_xattr_header` followed by `posix_acl_xattr_entry` (tag, perm, id)
+    return struct.pack("<I", 2) + b"".join(struct.pack("<HHI", *entry) for entry in entries)
+
+
+ACL = posix_acl((0x01, 7, 0xFFFFFFFF), (0x02, 5, 1234), (0x04, 5, 0xFFFFFFFF), (0x10, 7, 0xFFFFFFFF),
+                (0x20, 0, 0xFFFFFFFF))
+
+
+def create_tree(path, width=3, depth=3):
+    path.mkdir()
+    for i in range(width):
+        (path / f"file{i}").write_text("")
+    os.symlink("file0", path / "link")
+    os.mkfifo(path / "fifo")
+    if depth:
+        for i in range(width):
+            create_tree(path / f"dir{i}", width, depth - 1)
+
+
+def snapshot(path):
+    rv = {}
+    for root, dirs, files in os.walk(path):
+        for name in dirs + files + [None]:
+            p = os.path.join(root, name) if name else root
+            st = os.lstat(p)
+            xattrs = {}
+            if not os.path.islink(p):
+                for xattr in (POSIX_ACL_ACCESS, POSIX_ACL_DEFAULT):
+                    try:
+                        xattrs[xattr] = os.getxattr(p, xattr)
+                    except OSError as e:
+                        if e.errno != errno.ENODATA:
+                            raise
+            rv[os.path.relpath(p, path)] = (st.st_uid, st.st_gid, st.st_mode, xattrs)
+    return rv
+
+
+@pytest.fixture
+def tree(tmp_path):
+    path = tmp_path / "tree"
+    create_tree(path)
+    try:
+        os.setxattr(path, POSIX_ACL_ACCESS, ACL)
+    except OSError as e:
+        if e.errno == errno.EOPNOTSUPP:
+            pytest.skip("POSIX1e ACL are not supported")
+        raise
+    os.setxattr(path / "dir0" / "file0", POSIX_ACL_ACCESS, ACL)
+    return path
+
+
+def test__perm_walk__chown(tree):
+    before = snapshot(tree)
+
+    assert PermWalk(str(tree), "chown", 1234, -1, workers=4).run() == {"files": 200, "directories": 40}
+
+    for name, (uid, gid, mode, xattrs) in snapshot(tree).items():
+        assert (uid, gid, mode, xattrs) == (1234, before[name][1], before[name][2], before[name][3]), name
+
+
+def test__perm_walk__strip(tree):
+    before = snapshot(tree)
+
+    PermWalk(str(tree), "strip", -1, 1234, 0o750, workers=4).run()
+
+    for name, (uid, gid, mode, xattrs) in snapshot(tree).items():
+        assert gid == 1234
+        assert xattrs == {}, name
+        if name.endswith(("link", "fifo")):
+            assert mode == before[name][2]
+        else:
+            assert mode & 0o777 == 0o750, name
+
+
+def test__perm_walk__clone(tree):
+    os.setxattr(tree, POSIX_ACL_DEFAULT, ACL)
+
+    PermWalk(str(tree), "clone", workers=4).run()
+
+    tree_snapshot = snapshot(tree)
+    assert tree_snapshot["."][3] == {POSIX_ACL_ACCESS: ACL, POSIX_ACL_DEFAULT: ACL}
+    assert tree_snapshot["dir1/dir2"][3] == {POSIX_ACL_ACCESS: ACL, POSIX_ACL_DEFAULT: ACL}
+    assert tree_snapshot["dir1/dir2/file0"][3] == {POSIX_ACL_ACCESS: ACL}
+    assert tree_snapshot["dir1/dir2/fifo"][3] == {}
+
+
+def test__perm_walk__dry_run(tree):
+    before = snapshot(tree)
+
+    assert PermWalk(str(tree), "strip", 1234, 1234, 0o700, dry_run=True).run() == {"files": 200, "directories": 40}
+
+    assert snapshot(tree) == before
+
+
+def test__perm_walk__abort(tree):
+    with pytest.raises(CallError) as e:
+        PermWalk(str(tree), "chown", 1234, 1234, is_aborted=lambda: True).run()
+
+    assert e.value.errno == errno.EINTR
+
+
+def test__acltool__killed_on_abort(tmp_path):
+    popen = subprocess.Popen
+    processes = []
+
+    def sleep(args, **kwargs):
+        processes.append(popen(["sleep", "60"], **kwargs))
+        return processes[-1]
+
+    job = Mock(aborted=False)
+    threading.Timer(0.2, lambda: setattr(job, "aborted", True)).start()
+
+    started_at = time.monotonic()
+    with patch("middlewared.plugins.filesystem_.acl_linux.subprocess.Popen", sleep):
+        with pytest.raises(CallError) as e:
+            FilesystemService(Mock()).acltool(str(tmp_path), "clone", 0, 0, {}, job)
+
+    assert e.value.errno == errno.EINTR
+    assert time.monotonic() - started_at < 5
+    assert processes[0].returncode is not None
+
+
+@pytest.mark.skipif(not os.path.exists(ACLTOOL), reason="acltool is not available")
+@pytest.mark.parametrize("action,mode,default_acl", [
+    ("chown", None, False),
+    ("strip", 0o750, False),
+    ("clone", 0o750, False),
+    ("clone", None, True),
+])
+def test__perm_walk__same_as_acltool(tree, action, mode, default_acl):
+    if default_acl:
+        os.setxattr(tree, POSIX_ACL_DEFAULT, ACL)
+    if mode is not None:
+        os.removexattr(tree, POSIX_ACL_ACCESS)
+        os.chmod(tree, mode)
+
+    acltool_tree = tree.parent / "acltool"
+    shutil.copytree(tree, acltool_tree, symlinks=True)
+
+    PermWalk(str(tree), action, 1234, 1234, mode).run()
+    subprocess.run([ACLTOOL, "-a", action, "-O", "1234", "-G", "1234", "-rCP" if mode else "-rP",
+                    "-c", str(acltool_tree), "-p", str(acltool_tree)], check=True)
+
+    assert snapshot(tree) == snapshot(acltool_tree)
@@ -1,7 +1,15 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+import subprocess
+from unittest.mock import Mock, patch
+
 import pytest
 
 import middlewared.plugins.zettarepl  # noqa
 import middlewared.plugins.zettarepl_.util  # noqa
+from middlewared.plugins.zettarepl_.snapshot_removal_date import (
+    SnapshotOwnersIndex, ZettareplService as ZettareplRemovalDateService,
+)
 
 from middlewared.pytest.unit.helpers import load_compound_service
 
@@ -22,3 +30,100 @@ async def test__reverse_source_target_datasets(source_datasets, target_dataset,
         reversed_source_datasets,
         reversed_target_dataset,
     )
+
+
+def test__set_removal_dates__batched():
+    zs = ZettareplRemovalDateService(Mock(call_sync=Mock(return_value="org.truenas:destroy_at_12345678")))
+    zs.removal_dates = defaultdict(dict)
+    zs.removal_dates_loaded = True
+
+    def run(args, **kwargs):
+        if "tank/b@auto-1" in args:
+            raise subprocess.CalledProcessError(1, args, stderr="dataset does not exist")
+
+    destroy_at_1 = datetime(2021, 1, 1)
+    destroy_at_2 = datetime(2021, 1, 2)
+    with patch("middlewared.plugins.zettarepl_.snapshot_removal_date.subprocess.run", Mock(side_effect=run)) as run:
+        zs.set_removal_dates({
+            "tank@auto-1": destroy_at_1,
+            "tank/a@auto-1": destroy_at_1,
+            "tank/b@auto-1": destroy_at_1,
+            "tank/a@auto-2": destroy_at_2,
+        })
+
+    assert [call.args[0][3:] for call in run.mock_calls] == [
+        ["tank@auto-1", "tank/a@auto-1", "tank/b@auto-1"],
+        ["tank@auto-1"],
+        ["tank/a@auto-1"],
+        ["tank/b@auto-1"],
+        ["tank/a@auto-2"],
+    ]
+    assert zs.get_removal_dates() == {
+        "tank@auto-1": destroy_at_1,
+        "tank/a@auto-1": destroy_at_1,
+        "tank/a@auto-2": destroy_at_2,
+    }
+
+
+def test__remove_removal_dates():
+    zs = ZettareplRemovalDateService(None)
+    zs.removal_dates = defaultdict(dict)
+    zs.removal_dates_loaded = True
+    zs.update_removal_dates({
+        snapshot: datetime(2021, 1, 1)
+        for snapshot in ["tank/a@auto-1", "tank/a/b@auto-1", "tank/a/b@auto-2", "tank/ab@auto-1", "backup@auto-1"]
+    })
+
+    zs.remove_removal_dates("tank/a@auto-1", recursive=True)
+
+    assert set(zs.get_removal_dates()) == {"tank/a/b@auto-2", "tank/ab@auto-1", "backup@auto-1"}
+
+
+class SnapshotOwner:
+    def __init__(self, now, periodic_snapshot_task):
+        self.periodic_snapshot_task = periodic_snapshot_task
+
+    def owns_dataset(self, dataset):
+        task = self.periodic_snapshot_task
+        return (
+            (dataset == task.dataset or (task.recursive and dataset.startswith(f"{task.dataset}/"))) and
+            dataset not in task.exclude
+        )
+
+    def owns_snapshot(self, dataset, parsed_snapshot_name):
+        return True
+
+
+def test__snapshot_owners_index():
+    tasks = [
+        Mock(id=1, dataset="tank", recursive=True, exclude=["tank/excluded"], naming_schema="auto-%Y",
+             lifetime=timedelta(days=1)),
+        Mock(id=2, dataset="tank/work", recursive=False, exclude=[], naming_schema="auto-%Y",
+             lifetime=timedelta(days=2)),
+        Mock(id=3, dataset="tank/work", recursive=True, exclude=[], naming_schema="manual-%Y",
+             lifetime=timedelta(days=3)),
+    ]
+
+    def parse(name, naming_schema):
+        if not name.startswith(naming_schema[:-2]):
+            raise ValueError(name)
+        return Mock(datetime=datetime(int(name[-4:]), 1, 1))
+
+    parse_snapshot_name = Mock(side_effect=parse)
+
+    with patch("middlewared.plugins.zettarepl_.snapshot_removal_date.PeriodicSnapshotTaskSnapshotOwner",
+               SnapshotOwner):
+        with patch("middlewared.plugins.zettarepl_.snapshot_removal_date.parse_snapshot_name", parse_snapshot_name):
+            index = SnapshotOwnersIndex(tasks)
+
+            assert index.task_destroy_at("tank/work", "auto-2020") == (datetime(2020, 1, 3), 2)
+            assert index.task_destroy_at("tank/work/child", "auto-2020") == (datetime(2020, 1, 2), 1)
+            assert index.task_destroy_at("tank/work/child", "manual-2020") == (datetime(2020, 1, 4), 3)
+            assert index.task_destroy_at("tank/excluded", "auto-2020") == (None, None)
+            assert index.task_destroy_at("backup", "auto-2020") == (None, None)
+
+            for i in range(10):
+                index.task_destroy_at(f"tank/dataset{i}", "auto-2020")
+
+    # Snapshot names are only parsed once per naming schema
+    assert len(parse_snapshot_name.mock_calls) == 4
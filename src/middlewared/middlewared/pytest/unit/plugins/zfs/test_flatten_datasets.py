@@ -0,0 +1,47 @@
+from unittest.mock import Mock
+
+from middlewared.plugins.zfs import ZFSDatasetService
+
+
+def dataset(name, children=None):
+    return {'id': name, 'name': name, 'properties': {}, 'children': children or []}
+
+
+DATASETS = [
+    dataset('tank', [
+        dataset('tank/a', [
+            dataset('tank/a/b'),
+        ]),
+        dataset('tank/c'),
+    ]),
+    dataset('dozer'),
+]
+
+
+def test__flatten_datasets__order():
+    assert [ds['id'] for ds in ZFSDatasetService(Mock()).flatten_datasets(DATASETS)] == [
+        'tank', 'tank/a', 'tank/a/b', 'tank/c', 'dozer',
+    ]
+
+
+def test__flatten_datasets__embedded_children():
+    flat = ZFSDatasetService(Mock()).flatten_datasets(DATASETS)
+    assert [ds['id'] for ds in flat[0]['children']] == ['tank/a', 'tank/c']
+    assert flat[0]['children'][0]['children'][0]['id'] == 'tank/a/b'
+
+
+def test__flatten_datasets__does_not_modify_input():
+    flat = ZFSDatasetService(Mock()).flatten_datasets(DATASETS)
+    flat[1]['children'] = []
+    assert DATASETS[0]['children'][0]['children'][0]['id'] == 'tank/a/b'
+
+
+def test__flatten_datasets__children_names():
+    flat = ZFSDatasetService(Mock()).flatten_datasets(DATASETS, children_names=True)
+    assert [(ds['id'], ds['children']) for ds in flat] == [
+        ('tank', ['tank/a', 'tank/c']),
+        ('tank/a', ['tank/a/b']),
+        ('tank/a/b', []),
+        ('tank/c', []),
+        ('dozer', []),
+    ]
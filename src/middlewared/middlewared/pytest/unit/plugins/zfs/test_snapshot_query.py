@@ -0,0 +1,62 @@
+import pytest
+
+from middlewared.plugins.zfs_.snapshot_query import snapshot_query_kwargs
+
+
+def options(**kwargs):
+    return {'extra': {}, **kwargs}
+
+
+@pytest.mark.parametrize('filters,datasets,recursive', [
+    ([], None, None),
+    ([['pool', '=', 'tank']], ['tank'], True),
+    ([['dataset', '=', 'tank/a']], ['tank/a'], False),
+    ([['dataset', 'in', ['tank/a', 'tank/b']]], ['tank/a', 'tank/b'], False),
+    ([['id', '=', 'tank/a@snap']], ['tank/a@snap'], None),
+    ([['name', 'in', ['tank/a@snap1', 'tank/b@snap2']]], ['tank/a@snap1', 'tank/b@snap2'], None),
+    ([['name', '^', 'tank/a@auto-']], ['tank/a'], False),
+    ([['name', '^', 'tank/a/b']], ['tank/a'], True),
+    ([['name', '^', 'tank']], None, None),
+    ([['pool', '=', 'tank'], ['dataset', '=', 'tank/a']], ['tank/a'], False),
+    ([['OR', [['pool', '=', 'tank'], ['pool', '=', 'dozer']]]], None, None),
+    ([['pool', '!=', 'tank']], None, None),
+])
+def test__snapshot_query_kwargs__scope(filters, datasets, recursive):
+    kwargs = snapshot_query_kwargs(filters, options())
+    assert kwargs.get('datasets') == datasets
+    assert kwargs.get('recursive') == recursive
+
+
+@pytest.mark.parametrize('filters,extra,min_txg,max_txg', [
+    ([['createtxg', '>=', 10]], {}, 10, 0),
+    ([['createtxg', '>', 10]], {}, 11, 0),
+    ([['createtxg', '<', 10]], {}, 0, 9),
+    ([['createtxg', '<=', 10], ['createtxg', '>', 5]], {}, 6, 10),
+    ([['createtxg', '=', 10]], {}, 10, 10),
+    ([['createtxg', '<', 1]], {}, 0, 0),
+    ([['createtxg', '<=', 20]], {'min_txg': 5, 'max_txg': 15}, 5, 15),
+    ([['createtxg', '>=', '10'], ['createtxg', '<', 10.5], ['createtxg', '=', True]], {}, 0, 0),
+])
+def test__snapshot_query_kwargs__txg(filters, extra, min_txg, max_txg):
+    kwargs = snapshot_query_kwargs(filters, {'extra': extra})
+    assert (kwargs['min_txg'], kwargs['max_txg']) == (min_txg, max_txg)
+
+
+@pytest.mark.parametrize('filters,query_options,props', [
+    ([], options(), None),
+    ([], options(select=['name']), []),
+    ([], options(count=True), []),
+    ([['properties.used.parsed', '>', 0]], options(select=['name']), ['used']),
+    ([], options(select=['name'], order_by=['properties']), None),
+    ([['properties.org\\.truenas:x.value', '=', '1']], options(count=True), ['org.truenas:x']),
+    ([], options(select=['name', 'properties']), None),
+    ([], {'extra': {'properties': ['used']}, 'select': ['name']}, ['used']),
+])
+def test__snapshot_query_kwargs__properties(filters, query_options, props):
+    assert snapshot_query_kwargs(filters, query_options)['props'] == props
+
+
+def test__snapshot_query_kwargs__extra_properties():
+    assert snapshot_query_kwargs([], options(select=['name']), ['org.truenas:destroy_at'])['props'] == [
+        'org.truenas:destroy_at',
+    ]
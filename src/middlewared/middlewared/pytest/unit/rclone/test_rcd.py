@@ -0,0 +1,104 @@
+import shutil
+
+import pytest
+
+from middlewared.rclone.rcd import RcdRemotes, RcloneRcd, stats_progress
+
+STATS = {
+    "bytes": 1048576,
+    "totalBytes": 4194304,
+    "transfers": 1,
+    "totalTransfers": 2,
+    "checks": 3,
+    "totalChecks": 3,
+    "errors": 0,
+    "speed": 524288.0,
+    "eta": 6,
+    "transferring": [
+        {
+            "name": "dir/file",
+            "size": 3145728,
+            "bytes": 0,
+            "percentage": 0,
+            "speed": 0,
+            "speedAvg": 0,
+            "eta": None,
+        },
+    ],
+}
+
+
+def test__rcd_remotes__path():
+    remotes = RcdRemotes({"remote": "remote-1", "encrypted": "encrypted-1"})
+
+    assert remotes.path("remote:bucket/folder") == "remote-1:bucket/folder"
+    assert remotes.path("encrypted:/") == "encrypted-1:/"
+    assert remotes.path("/mnt/tank/data") == "/mnt/tank/data"
+    assert remotes.path("other:folder") == "other:folder"
+
+
+def test__stats_progress():
+    percent, description, extra = stats_progress(STATS)
+
+    assert percent == 25
+    assert description == "1 MiB / 4 MiB, 512 KiB/s, ETA 6s, transfers: 1 / 2, checks: 3 / 3"
+    assert extra["bytes"] == 1048576
+    assert extra["total_transfers"] == 2
+    assert extra["transferring"] == [
+        {"name": "dir/file", "size": 3145728, "bytes": 0, "percentage": 0, "speed": 0, "speed_avg": 0, "eta": None},
+    ]
+
+
+def test__stats_progress__nothing_to_do():
+    percent, description, extra = stats_progress(dict(STATS, bytes=0, totalBytes=0, transfers=0, totalTransfers=0,
+                                                      checks=0, totalChecks=0, transferring=[]))
+
+    assert percent is None
+    assert description is None
+
+
+@pytest.mark.skipif(shutil.which("rclone") is None, reason="rclone is not available")
+@pytest.mark.asyncio
+async def test__rcd__local_remote(tmp_path):
+    src = tmp_path / "src"
+    (src / "dir").mkdir(parents=True)
+    (src / "dir" / "file").write_bytes(b"0" * 100000)
+    (src / "excluded").write_text("excluded")
+    dst = tmp_path / "dst"
+    (tmp_path / "filter").write_text("- excluded")
+
+    rcd = RcloneRcd(str(tmp_path / "rcd"))
+    try:
+        progress = []
+        transferred = []
+        async with rcd.remotes({"remote": {"type": "local"}}) as remotes:
+            status, stats = await rcd.run_job("sync/copy", {
+                "srcFs": str(src),
+                "dstFs": remotes.path(f"remote:{dst}"),
+                "_filter": {"FilterFrom": [str(tmp_path / "filter")]},
+            }, progress.append, transferred.extend)
+
+            assert status["success"]
+            assert stats["bytes"] == 100000
+            assert stats["transfers"] == 1
+            assert progress[-1] == stats
+            assert [t["name"] for t in transferred] == ["dir/file"]
+            assert (dst / "dir" / "file").read_bytes() == b"0" * 100000
+            assert not (dst / "excluded").exists()
+
+            result = await rcd.call("operations/list", fs=remotes.path(f"remote:{dst}"), remote="")
+            assert [(item["Name"], item["IsDir"]) for item in result["list"]] == [("dir", True)]
+
+            name = remotes.names["remote"]
+            assert (await rcd.call("config/get", name=name)) == {"type": "local"}
+
+        # Remotes are only kept for the duration of the context
+        assert (await rcd.call("config/get", name=name)) == {}
+
+        status, stats = await rcd.run_job("sync/copy", {"srcFs": str(tmp_path / "nonexistent"), "dstFs": str(dst)})
+        assert not status["success"]
+        assert "directory not found" in status["error"]
+    finally:
+        await rcd.stop()
+
+    assert not rcd.running
@@ -0,0 +1,123 @@
+import asyncio
+from unittest.mock import AsyncMock, Mock, patch
+
+import pytest
+
+from middlewared.job import Job as RealJob, JobsDeque, JobsQueue, State
+
+
+class Job:
+    def __init__(self, id, method_name="test.job", state=State.RUNNING):
+        self.id = id
+        self.method_name = method_name
+        self.options = {"transient": False}
+        self.state = state
+        self.progress = {"percent": 0, "description": "", "extra": None}
+        self.progress_sent_at = 0
+        self.time_finished = None
+
+    def set_id(self, id):
+        self.id = id
+
+    def cleanup(self):
+        pass
+
+    def encode_changed(self, fields):
+        encoded = {"id": self.id, "state": self.state.name}
+        if "progress" in fields:
+            encoded["progress"] = dict(self.progress)
+        return encoded
+
+
+@pytest.mark.asyncio
+async def test__jobs_queue__progress_coalesced():
+    middleware = Mock(loop=asyncio.get_event_loop())
+    jobs = JobsQueue(middleware, 0.1)
+    job = Job(1)
+
+    for percent in range(1, 101):
+        job.progress["percent"] = percent
+        jobs.send_progress(job)
+
+    await asyncio.sleep(0.2)
+
+    assert [call.kwargs["fields"]["progress"]["percent"] for call in middleware.send_event.mock_calls] == [1, 100]
+    assert middleware.send_event.mock_calls[-1].kwargs["fields"] == {
+        "id": 1,
+        "state": "RUNNING",
+        "progress": {"percent": 100, "description": "", "extra": None},
+    }
+    assert jobs.pending_progress == set()
+
+
+@pytest.mark.asyncio
+async def test__jobs_queue__progress_not_sent_for_finished_job():
+    middleware = Mock(loop=asyncio.get_event_loop())
+    jobs = JobsQueue(middleware, 0.1)
+    job = Job(1)
+
+    jobs.send_progress(job)
+    jobs.send_progress(job)
+    job.state = State.SUCCESS
+    job.time_finished = 1
+
+    await asyncio.sleep(0.2)
+
+    assert len(middleware.send_event.mock_calls) == 1
+
+
+@pytest.mark.asyncio
+async def test__job_run__running_event_has_logs_path(tmp_path):
+    middleware = Mock(loop=asyncio.get_event_loop())
+    middleware.jobs = JobsQueue(middleware)
+    middleware.run_in_thread = AsyncMock(side_effect=lambda f, *args: f(*args))
+
+    async def method(job):
+        return 1
+
+    options = {
+        "abortable": False, "check_pipes": False, "description": None, "lock": None, "lock_queue_size": None,
+        "logs": True, "pipes": [], "process": False, "transient": False,
+    }
+    job = RealJob(middleware, "test.job", None, method, [], options, None, None)
+    middleware.jobs.add(job)
+
+    with patch("middlewared.job.LOGS_DIR", str(tmp_path)):
+        await job.run(middleware.jobs)
+
+    changed = [call.kwargs["fields"] for call in middleware.send_event.mock_calls if call.args[1] == "CHANGED"]
+    assert changed[0] == {"id": job.id, "state": "RUNNING", "logs_path": str(tmp_path / f"{job.id}.log")}
+
+
+def test__jobs_deque__filter():
+    jobs = JobsDeque()
+    for method_name in ["pool.scrub", "cloudsync.sync", "pool.scrub"]:
+        jobs.add(Job(None, method_name, State.WAITING))
+
+    job = jobs[3]
+    job.state = State.RUNNING
+    jobs.state_changed(job, State.WAITING)
+
+    assert [job.id for job in jobs.filter([["state", "=", "RUNNING"]])] == [3]
+    assert [job.id for job in jobs.filter([["state", "in", ["WAITING", "RUNNING"]]])] == [1, 2, 3]
+    assert [job.id for job in jobs.filter([["method", "=", "pool.scrub"], ["state", "=", "WAITING"]])] == [1]
+    assert [job.id for job in jobs.filter([["id", "=", 2]])] == [2]
+    assert [job.id for job in jobs.filter([["state", "=", "SUCCESS"]])] == []
+    # Not indexed
+    assert [job.id for job in jobs.filter([["description", "=", None]])] == [1, 2, 3]
+
+
+def test__jobs_deque__evicts_first_finished_job():
+    jobs = JobsDeque(maxlen=3)
+    for i in range(4):
+        jobs.add(Job(None, state=State.WAITING))
+
+    for id in [3, 2]:
+        job = jobs[id]
+        job.state = State.SUCCESS
+        jobs.state_changed(job, State.WAITING)
+
+    jobs.add(Job(None, state=State.WAITING))
+
+    assert list(jobs.all().keys()) == [1, 2, 4, 5]
+    assert [job.id for job in jobs.filter([["state", "=", "SUCCESS"]])] == [2]
@@ -0,0 +1,94 @@
+import asyncio
+from collections import deque
+from unittest.mock import Mock, patch
+
+import pytest
+
+from middlewared.client import ejson as json
+from middlewared.main import Application, event_message, Middleware
+
+
+class Response:
+    def __init__(self):
+        self.sent = []
+        self.unblocked = asyncio.Event()
+
+    async def send_str(self, data):
+        await self.unblocked.wait()
+        self.sent.append(json.loads(data))
+
+
+def application():
+    middleware = Mock(socket_messages_queue=deque(maxlen=200))
+    return Application(middleware, asyncio.get_event_loop(), Mock(), Response())
+
+
+def send_event(app, name, event_type, **kwargs):
+    event = event_message(name, event_type, kwargs)
+    app._send_serialized(json.dumps(event), event)
+
+
+@pytest.mark.asyncio
+async def test__outbound_queue__coalesce_and_drop():
+    app = application()
+    with patch("middlewared.main.OUTBOUND_QUEUE_SIZE", 3):
+        app._send({"msg": "result", "id": "1", "result": None})
+        send_event(app, "core.get_jobs", "ADDED", id=1, fields={"state": "WAITING", "progress": 0})
+        send_event(app, "disk.query", "CHANGED", id="sda", fields={"name": "sda"})
+        send_event(app, "disk.query", "CHANGED", id="sdb", fields={"name": "sdb"})
+        # Queue is full: merged into the queued `ADDED` event
+        send_event(app, "core.get_jobs", "CHANGED", id=1, fields={"state": "RUNNING"})
+        # Queue is full and there is nothing to merge into: the oldest event is dropped
+        send_event(app, "disk.query", "REMOVED", id="sdc")
+        app._send({"msg": "result", "id": "2", "result": None})
+        await asyncio.sleep(0)
+
+        app.response.unblocked.set()
+        await asyncio.sleep(0.1)
+
+    assert app.response.sent == [
+        {"msg": "result", "id": "1", "result": None},
+        {"msg": "changed", "collection": "disk.query", "id": "sda", "fields": {"name": "sda"}},
+        {"msg": "changed", "collection": "disk.query", "id": "sdb", "fields": {"name": "sdb"}},
+        {"msg": "removed", "collection": "disk.query", "id": "sdc"},
+        {"msg": "result", "id": "2", "result": None},
+    ]
+    assert app._outbound_coalesced == 1
+    assert app._outbound_dropped == 1
+    assert app._outbound_events == 0
+
+    app._writer.cancel()
+
+
+@pytest.mark.asyncio
+async def test__outbound_queue__coalesce_does_not_modify_shared_event():
+    app = application()
+    with patch("middlewared.main.OUTBOUND_QUEUE_SIZE", 1):
+        event = event_message("core.get_jobs", "ADDED", {"id": 1, "fields": {"state": "WAITING"}})
+        app._send_serialized(json.dumps(event), event)
+        send_event(app, "core.get_jobs", "CHANGED", id=1, fields={"state": "RUNNING"})
+        await asyncio.sleep(0)
+
+        app.response.unblocked.set()
+        await asyncio.sleep(0.1)
+
+    assert app.response.sent == [
+        {"msg": "added", "collection": "core.get_jobs", "id": 1, "fields": {"state": "RUNNING"}},
+    ]
+    assert event["fields"] == {"state": "WAITING"}
+
+    app._writer.cancel()
+
+
+def test__worker_stats__forgets_exited_workers():
+    middleware = Mock(worker_stats={})
+    middleware._Middleware__procpool.pids.return_value = {1, 2}
+    Middleware.update_worker_stats(middleware, {"pid": 1, "requests": 1})
+    Middleware.update_worker_stats(middleware, {"pid": 2, "requests": 1})
+
+    # Pool was rebuilt
+    middleware._Middleware__procpool.pids.return_value = {2, 3}
+    assert Middleware.get_worker_stats(middleware) == [{"pid": 2, "requests": 1}]
+    Middleware.update_worker_stats(middleware, {"pid": 3, "requests": 1})
+
+    assert middleware.worker_stats == {2: {"pid": 2, "requests": 1}, 3: {"pid": 3, "requests": 1}}
@@ -1,11 +1,15 @@
+import copy
+
 import pytest
-from mock import Mock
+from mock import Mock, patch
 
 from middlewared.service import job
 from middlewared.service_exception import ValidationErrors
 from middlewared.schema import (
-    accepts, Bool, Cron, Dict, Dir, File, Float, Int, IPAddr, List, Str, URI, UnixPerm,
+    accepts, Bool, compile_attr, Cron, Dict, Dir, Error, File, Float, Int, IPAddr, List, OROperator, Patch, returns,
+    Schemas, Str, URI, UnixPerm,
 )
+from middlewared.settings import conf
 
 
 def test__nonhidden_after_hidden():
@@ -768,3 +772,121 @@ def test__uri_schema(test_value, expected_error):
         assert ei.value.errors[0].errmsg == 'Not a valid URI'
     else:
         assert strv(self, test_value) == test_value
+
+
+COMPILED_SCHEMA = Dict(
+    'dataset',
+    Str('name', required=True),
+    Int('quota', default=0),
+    Dict(
+        'properties',
+        Str('compression', default='lz4'),
+        Str('sync', enum=['STANDARD', 'ALWAYS']),
+        additional_attrs=True,
+    ),
+    List('children', items=[Dict('child', Str('name'), Bool('locked', default=False))]),
+    OROperator(Int('size'), Str('size'), name='size'),
+    Cron('schedule', begin_end=True),
+    Str('mode', enum=['AUTO', 'MANUAL'], default='AUTO'),
+    Int('interval'),
+    conditional_defaults={'interval': {'filters': [['mode', '=', 'MANUAL']], 'attrs': ['interval']}},
+)
+
+
+@pytest.mark.parametrize('value', [
+    {'name': 'tank'},
+    {'name': 'tank', 'properties': {'sync': 'ALWAYS', 'custom:prop': {'value': 1}}, 'size': '1G'},
+    {'name': 'tank', 'children': [{'name': 'tank/a'}, {'name': 'tank/b', 'locked': True}], 'quota': '10'},
+    {'name': 'tank', 'schedule': {'hour': '1'}, 'mode': 'MANUAL', 'interval': 5},
+    {'name': 'tank', 'properties': {'sync': 'NEVER'}},
+    {'name': 'tank', 'children': [1]},
+    {'quota': 1, 'unexpected': True},
+])
+def test__compile_attr__matches_clean(value):
+    orig = copy.deepcopy(value)
+
+    try:
+        expected = COMPILED_SCHEMA.clean(copy.deepcopy(value))
+    except (Error, ValidationErrors) as e:
+        with pytest.raises(type(e)) as ei:
+            compile_attr(COMPILED_SCHEMA)(value)
+        assert str(ei.value) == str(e)
+    else:
+        assert compile_attr(COMPILED_SCHEMA)(value) == expected
+
+    assert value == orig
+
+
+def test__compile_attr__copy_on_write():
+    value = {
+        'name': 'tank',
+        'quota': 0,
+        'properties': {'compression': 'lz4', 'custom:prop': {'value': 1}},
+        'children': [{'name': 'tank/a', 'locked': False}, {'name': 'tank/b'}],
+        'size': 1,
+        'schedule': {'minute': '00', 'hour': '*', 'dom': '*', 'month': '*', 'dow': '*', 'begin': '00:00',
+                     'end': '23:59'},
+        'mode': 'AUTO',
+    }
+
+    result = compile_attr(COMPILED_SCHEMA)(value)
+
+    assert result is not value
+    assert result['properties'] is value['properties']
+    assert result['children'] is not value['children']
+    assert result['children'][0] is value['children'][0]
+    assert result['children'][1] == {'name': 'tank/b', 'locked': False}
+    assert 'locked' not in value['children'][1]
+
+
+def test__compile_attr__patched_copy():
+    schemas = Schemas()
+    schemas.add(Dict('orig', Int('a', default=1)))
+    compile_attr(schemas['orig'])
+
+    patched = Patch('orig', 'patched', ('add', Int('b', default=2))).resolve(schemas)
+
+    assert compile_attr(schemas['orig'])({}) == {'a': 1}
+    assert compile_attr(patched)({}) == {'a': 1, 'b': 2}
+
+
+def test__accepts__argument_is_not_modified():
+    @accepts(Dict('data', Dict('nested', additional_attrs=True), Int('id', default=1)))
+    def f(self, data):
+        data.pop('nested')
+        return data
+
+    data = {'nested': {'a': 1}, 'id': 2}
+    assert f(Mock(), data) == {'id': 2}
+    assert data == {'nested': {'a': 1}, 'id': 2}
+
+
+def test__accepts__nested_argument_is_not_modified():
+    @accepts(Dict('data', Dict('options', Bool('recursive', default=False)), List('items'), Int('id', default=1)))
+    def f(self, data):
+        data['options']['do_chmod'] = True
+        data['items'].append(2)
+        return data
+
+    data = {'options': {'recursive': True}, 'items': [1]}
+    assert f(Mock(), data) == {'options': {'recursive': True, 'do_chmod': True}, 'items': [1, 2], 'id': 1}
+    assert data == {'options': {'recursive': True}, 'items': [1]}
+
+
+@pytest.mark.parametrize('rate,validated', [
+    (1, [1, 2, 3, 4, 5]),
+    (3, [1, 4]),
+    (0, []),
+])
+def test__returns__validation_rate(rate, validated):
+    @returns(Int('result'))
+    def f(i):
+        return i
+
+    calls = []
+    with patch.object(conf, 'debug_mode', True), patch.object(conf, 'returns_validation_rate', rate):
+        with patch('middlewared.schema.validate_return_type', lambda func, result, schemas: calls.append(result)):
+            for i in range(1, 6):
+                f(i)
+
+    assert calls == validated
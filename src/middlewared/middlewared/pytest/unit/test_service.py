@@ -4,7 +4,8 @@ import time
 
 import pytest
 
-from middlewared.service import throttle
+from middlewared.pytest.unit.middleware import Middleware
+from middlewared.service import SharingService, throttle
 
 
 @pytest.mark.timeout(10)
@@ -69,3 +70,29 @@ async def test__async_throttle():
     assert values[0] - start < 1
     assert 1.99 <= values[1] - values[0] < 3
     assert 1.99 <= values[2] - values[1] < 3
+
+
+class ShareService(SharingService):
+    class Config:
+        namespace = "sharing.test"
+        datastore = "sharing.test"
+        datastore_extend = "sharing.test.extend"
+
+
+@pytest.mark.asyncio
+async def test__sharing_service__extend_batch():
+    m = Middleware()
+    m["sharing.test.extend"] = lambda row: {**row, "extended": True}
+    m["pool.dataset.path_in_locked_datasets"] = lambda path, locked: path in locked
+    service = ShareService(m)
+    m["sharing.test.sharing_task_determine_locked"] = service.sharing_task_determine_locked
+
+    options = await service.get_options({})
+    assert options["extend_batch"] == "sharing.test.sharing_task_extend_batch"
+    assert options["extend"] is None
+
+    rows = [{"id": 1, "path": "/mnt/tank/a"}, {"id": 2, "path": "/mnt/tank/b"}]
+    assert await service.sharing_task_extend_batch(rows, {"locked_datasets": ["/mnt/tank/b"]}) == [
+        {"id": 1, "path": "/mnt/tank/a", "extended": True, "locked": False},
+        {"id": 2, "path": "/mnt/tank/b", "extended": True, "locked": True},
+    ]
@@ -0,0 +1,48 @@
+from unittest.mock import patch
+
+from middlewared.worker import WorkerConnection
+
+
+class Client:
+    instances = []
+
+    def __init__(self, uri, py_exceptions=False):
+        self.closed = False
+        self.subscriptions = []
+        self.calls = []
+        Client.instances.append(self)
+
+    def subscribe(self, name, callback):
+        self.subscriptions.append(name)
+
+    def call(self, method, *params, **kwargs):
+        self.calls.append(method)
+        return method
+
+
+def test__worker_connection__reused_and_reconnected():
+    Client.instances = []
+    on_connect = []
+    with patch("middlewared.worker.Client", Client):
+        connection = WorkerConnection([("core.environ", lambda *args, **kwargs: None)], on_connect.append)
+
+        for i in range(3):
+            connection.requests += 1
+            assert connection.call("zfs.pool.query") == "zfs.pool.query"
+
+        assert len(Client.instances) == 1
+        assert Client.instances[0].calls == ["zfs.pool.query"] * 3
+
+        Client.instances[0].closed = True
+        connection.requests += 1
+        connection.call("core.event_send")
+
+    assert len(Client.instances) == 2
+    assert Client.instances[1].subscriptions == ["core.environ"]
+    assert Client.instances[1].calls == ["core.event_send"]
+    assert on_connect == Client.instances
+
+    stats = connection.stats()
+    assert stats["connections"] == 2
+    assert stats["requests"] == 4
+    assert stats["handshake_time_saved"] == stats["handshake_time"]
@@ -0,0 +1,46 @@
+from unittest.mock import patch
+
+from middlewared.utils.credentials import VerifiedCredentialsCache
+
+
+def test__verified_credentials_cache():
+    cache = VerifiedCredentialsCache()
+    assert not cache.verified("root", "password", "$6$hash")
+
+    cache.add("root", "password", "$6$hash")
+    assert cache.verified("root", "password", "$6$hash")
+    assert not cache.verified("root", "wrong", "$6$hash")
+    assert not cache.verified("admin", "password", "$6$hash")
+
+
+def test__verified_credentials_cache__stored_hash_changed():
+    cache = VerifiedCredentialsCache()
+    cache.add("root", "password", "$6$hash")
+
+    assert not cache.verified("root", "password", "$6$newhash")
+
+
+def test__verified_credentials_cache__ttl():
+    cache = VerifiedCredentialsCache(ttl=60)
+    with patch("middlewared.utils.credentials.time.monotonic", return_value=1000):
+        cache.add("root", "password", "$6$hash")
+
+    with patch("middlewared.utils.credentials.time.monotonic", return_value=1059):
+        assert cache.verified("root", "password", "$6$hash")
+
+    with patch("middlewared.utils.credentials.time.monotonic", return_value=1060):
+        assert not cache.verified("root", "password", "$6$hash")
+
+    assert not cache.entries
+
+
+def test__verified_credentials_cache__size():
+    cache = VerifiedCredentialsCache(size=2)
+    cache.add(1, "key1", "hash1")
+    cache.add(2, "key2", "hash2")
+    cache.add(1, "key1", "hash1")
+    cache.add(3, "key3", "hash3")
+
+    assert cache.verified(1, "key1", "hash1")
+    assert not cache.verified(2, "key2", "hash2")
+    assert cache.verified(3, "key3", "hash3")
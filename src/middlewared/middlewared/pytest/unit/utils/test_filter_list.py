@@ -84,3 +84,52 @@ def test__filter_list_OR_eq2():
         ['number', '=', 1],
         ['number', '=', 2],
     ]]])) == 2
+
+
+def test__filter_list_nested_path():
+    assert filter_list(DATA, [['list.0', '=', 2]]) == [DATA[1]]
+
+
+def test__filter_list_select():
+    assert filter_list(DATA, [['number', '>', 1]], {'select': ['foo']}) == [{'foo': 'foo2'}, {'foo': '_foo_'}]
+
+
+def test__filter_list_count():
+    assert filter_list(DATA, [['foo', '^', 'foo']], {'count': True}) == 2
+
+
+def test__filter_list_order_by_limit():
+    assert filter_list(DATA, [], {'order_by': ['-number'], 'limit': 2}) == [DATA[2], DATA[1]]
+
+
+def test__filter_list_order_by_offset_limit():
+    assert filter_list(DATA, [], {'order_by': ['foo'], 'offset': 1, 'limit': 1}) == [DATA[0]]
+
+
+def test__filter_list_order_by_multiple_keys():
+    data = [
+        {'a': 1, 'b': 2},
+        {'a': 2, 'b': 1},
+        {'a': 1, 'b': 1},
+    ]
+    # Last `order_by` entry is the most significant one
+    assert filter_list(data, [], {'order_by': ['a', 'b']}) == [data[2], data[1], data[0]]
+    assert filter_list(data, [], {'order_by': ['-a', 'b']}) == [data[1], data[2], data[0]]
+
+
+def test__filter_list_get_order_by():
+    assert filter_list(DATA, [['number', '<', 3]], {'get': True, 'order_by': ['-number']}) == DATA[1]
+
+
+def test__filter_list_plan_cache():
+    assert filter_list(DATA, [['foo', '~', '^foo']]) == filter_list(DATA, [['foo', '~', '^foo']])
+    assert len(filter_list(DATA, [['number', 'in', [1]]])) == 1
+    assert len(filter_list(DATA, [['number', 'in', [1, 2]]])) == 2
+
+
+def test__filter_list_plan_cache_mutated_value():
+    v = [1]
+    assert filter_list(DATA, [['list', '=', v]]) == [DATA[0]]
+    v.append(5)
+    assert filter_list(DATA, [['list', '=', v]]) == []
+    assert filter_list(DATA, [['list', '=', [1]]]) == [DATA[0]]
@@ -0,0 +1,75 @@
+import asyncio
+import os
+import signal
+import time
+
+import pytest
+
+from middlewared.utils.process_pool import ProcessPool
+
+
+def sleep(seconds):
+    time.sleep(seconds)
+    return os.getpid()
+
+
+@pytest.mark.asyncio
+async def test__process_pool__grows_with_queue_depth():
+    pool = ProcessPool(None, 1, 3)
+    pool.start()
+    try:
+        await pool.warm()
+        assert pool.workers == 1
+
+        await asyncio.gather(*[pool.run(sleep, 0.5, key=str(i)) for i in range(3)])
+
+        assert pool.workers == 3
+        assert len(pool.executor._processes) == 3
+
+        stats = pool.stats()
+        assert stats["calls"] == 3
+        assert stats["queued_calls"] == 2
+        assert stats["queue_depth"] == 0
+        assert stats["running"] == 0
+    finally:
+        pool.executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test__process_pool__budget():
+    pool = ProcessPool(None, 3, 3)
+    pool.start()
+    try:
+        await pool.warm()
+
+        snapshots = [asyncio.ensure_future(pool.run(sleep, 0.5, key="zfs.snapshot")) for i in range(4)]
+        await asyncio.sleep(0.1)
+
+        stats = pool.stats()
+        assert stats["services"] == {"zfs.snapshot": {"running": 2, "queued": 2}}
+
+        # One worker is always left for the other services
+        start = time.monotonic()
+        await pool.run(sleep, 0, key="zfs.pool")
+        assert time.monotonic() - start < 0.4
+
+        await asyncio.gather(*snapshots)
+    finally:
+        pool.executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test__process_pool__pids_after_restart():
+    pool = ProcessPool(None, 1, 1)
+    pool.start()
+    try:
+        pid = await pool.run(sleep, 0)
+        assert pool.pids() == {pid}
+
+        os.kill(pid, signal.SIGKILL)
+        new_pid = await pool.run(sleep, 0)
+
+        assert new_pid != pid
+        assert pool.pids() == {new_pid}
+    finally:
+        pool.executor.shutdown()
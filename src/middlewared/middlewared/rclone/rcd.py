@@ -0,0 +1,268 @@
+import asyncio
+import contextlib
+import logging
+import os
+import shutil
+import subprocess
+import time
+import uuid
+
+import aiohttp
+
+from middlewared.service_exception import CallError
+from middlewared.utils import Popen
+from middlewared.utils.size import format_size
+
+RCD_DIR = "/var/run/rclone-rcd"
+
+logger = logging.getLogger(__name__)
+
+
+class RcloneRcd:
+    """
+    Persistent `rclone rcd` process listening on a local unix socket. Remote operations are submitted through its
+    RC API (https://rclone.org/rc/) so that every listing or transfer does not have to spawn a new `rclone` process,
+    and transfer progress is read from structured `core/stats` instead of parsing the log output.
+
+    The process is started on first use and restarted if it has died.
+    """
+
+    def __init__(self, directory=RCD_DIR, startup_timeout=10, stats_interval=1):
+        self.directory = directory
+        self.socket_path = os.path.join(directory, "rcd.sock")
+        self.config_path = os.path.join(directory, "rclone.conf")
+        self.log_path = os.path.join(directory, "rcd.log")
+        self.startup_timeout = startup_timeout
+        self.stats_interval = stats_interval
+
+        self.proc = None
+        self.session = None
+        self.lock = None
+
+    @property
+    def running(self):
+        return self.proc is not None and self.proc.returncode is None
+
+    async def start(self):
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+
+        async with self.lock:
+            if self.running:
+                return
+
+            await self._stop()
+
+            shutil.rmtree(self.directory, ignore_errors=True)
+            os.makedirs(self.directory, mode=0o700)
+            # Remotes are created in this file and they contain credentials
+            os.close(os.open(self.config_path, os.O_WRONLY | os.O_CREAT, 0o600))
+
+            with open(self.log_path, "wb") as log:
+                self.proc = await Popen([
+                    "rclone",
+                    "--config", self.config_path,
+                    "rcd",
+                    "--rc-addr", f"unix://{self.socket_path}",
+                    # There is no authentication on the unix socket, only root can access it
+                    "--rc-no-auth",
+                ], stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT)
+
+            self.session = aiohttp.ClientSession(connector=aiohttp.UnixConnector(path=self.socket_path))
+
+            deadline = time.monotonic() + self.startup_timeout
+            while True:
+                try:
+                    await self._call("core/version", {})
+                except CallError:
+                    if not self.running or time.monotonic() > deadline:
+                        with open(self.log_path, errors="ignore") as f:
+                            output = f.read().strip()
+
+                        await self._stop()
+                        raise CallError(f"Unable to start rclone rcd: {output or 'timed out'}")
+
+                    await asyncio.sleep(0.1)
+                else:
+                    break
+
+            logger.debug("Started rclone rcd with pid %d", self.proc.pid)
+
+    async def stop(self):
+        if self.lock is None:
+            return
+
+        async with self.lock:
+            await self._stop()
+
+    async def _stop(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+        if self.proc is not None:
+            if self.proc.returncode is None:
+                self.proc.terminate()
+                try:
+                    await asyncio.wait_for(self.proc.wait(), 10)
+                except asyncio.TimeoutError:
+                    self.proc.kill()
+                    await self.proc.wait()
+
+            self.proc = None
+
+    async def call(self, method, **params):
+        """
+        Call RC `method` with `params`. The process is started if it is not running.
+        """
+        await self.start()
+        return await self._call(method, params)
+
+    async def _call(self, method, params):
+        try:
+            async with self.session.post(f"http://rcd/{method}", json=params) as response:
+                result = await response.json(content_type=None)
+        except (aiohttp.ClientError, ValueError) as e:
+            raise CallError(f"rclone rcd {method!r} call failed: {e}")
+
+        if response.status != 200:
+            raise CallError(result.get("error") or f"rclone rcd {method!r} call failed with status {response.status}")
+
+        return result
+
+    @contextlib.asynccontextmanager
+    async def remotes(self, sections):
+        """
+        Create remotes from rclone config `sections` (`{name: {key: value}}`) for the duration of the context. Remote
+        names are made unique so that concurrent users do not collide; a returned `RcdRemotes` translates paths that
+        refer to the original names.
+        """
+        remotes = RcdRemotes({name: f"{name}-{uuid.uuid4().hex}" for name in sections})
+        created = []
+        try:
+            for name, section in sections.items():
+                parameters = {k: str(v) for k, v in section.items() if k != "type"}
+                if "remote" in parameters:
+                    # `crypt` wraps another remote
+                    parameters["remote"] = remotes.path(parameters["remote"])
+
+                await self.call("config/create", name=remotes.names[name], type=section["type"],
+                                parameters=parameters, opt={"nonInteractive": True, "noObscure": True})
+                created.append(remotes.names[name])
+
+            yield remotes
+        finally:
+            for name in created:
+                try:
+                    await self.call("config/delete", name=name)
+                except CallError as e:
+                    logger.warning("Error deleting rclone rcd remote %r: %r", name, e)
+
+    async def run_job(self, method, params, progress=None, transferred=None):
+        """
+        Run RC `method` asynchronously and poll its stats until it is finished.
+
+        :param progress: called with `core/stats` of the job every `stats_interval` seconds.
+        :param transferred: called with the list of transfers completed since the previous call.
+        :return: `job/status` of the finished job and its final `core/stats`.
+        """
+        jobid = (await self.call(method, _async=True, **params))["jobid"]
+        group = f"job/{jobid}"
+        seen = set()
+        try:
+            while True:
+                status = await self.call("job/status", jobid=jobid)
+                stats = await self.call("core/stats", group=group)
+                if progress is not None:
+                    progress(stats)
+
+                if transferred is not None:
+                    # Only last 100 completed transfers are kept by rclone
+                    completed = (await self.call("core/transferred", group=group))["transferred"]
+                    keys = {(t["name"], t["completed_at"]) for t in completed}
+                    new = [t for t in completed if (t["name"], t["completed_at"]) not in seen]
+                    if new:
+                        transferred(new)
+                    seen = keys
+
+                if status["finished"]:
+                    return status, stats
+
+                await asyncio.sleep(self.stats_interval)
+        except asyncio.CancelledError:
+            try:
+                await self.call("job/stop", jobid=jobid)
+            except CallError as e:
+                logger.warning("Error stopping rclone rcd job %r: %r", jobid, e)
+            raise
+        finally:
+            try:
+                await self.call("core/stats-delete", group=group)
+            except CallError:
+                pass
+
+
+class RcdRemotes:
+    def __init__(self, names):
+        self.names = names
+
+    def path(self, path):
+        """
+        Translate `remote:path` that refers to the original remote name.
+        """
+        name, sep, rest = path.partition(":")
+        if sep and name in self.names:
+            return f"{self.names[name]}:{rest}"
+
+        return path
+
+
+def stats_progress(stats):
+    """
+    Convert rclone `core/stats` to job progress `(percent, description, extra)`.
+    """
+    progresses = []
+    description = []
+
+    if stats["totalBytes"]:
+        progresses.append(int(stats["bytes"] * 100 / stats["totalBytes"]))
+        transferred = f"{format_size(stats['bytes'])} / {format_size(stats['totalBytes'])}"
+        if stats["speed"]:
+            transferred += f", {format_size(stats['speed'])}/s"
+        if stats["eta"] is not None:
+            transferred += f", ETA {stats['eta']}s"
+        description.append(transferred)
+
+    if stats["totalTransfers"]:
+        progresses.append(int(stats["transfers"] * 100 / stats["totalTransfers"]))
+        description.append(f"transfers: {stats['transfers']} / {stats['totalTransfers']}")
+
+    if stats["totalChecks"]:
+        progresses.append(int(stats["checks"] * 100 / stats["totalChecks"]))
+        description.append(f"checks: {stats['checks']} / {stats['totalChecks']}")
+
+    extra = {
+        "bytes": stats["bytes"],
+        "total_bytes": stats["totalBytes"],
+        "transfers": stats["transfers"],
+        "total_transfers": stats["totalTransfers"],
+        "checks": stats["checks"],
+        "total_checks": stats["totalChecks"],
+        "errors": stats["errors"],
+        "speed": stats["speed"],
+        "eta": stats["eta"],
+        "transferring": [
+            {
+                "name": transfer["name"],
+                "size": transfer["size"],
+                "bytes": transfer["bytes"],
+                "percentage": transfer["percentage"],
+                "speed": transfer["speed"],
+                "speed_avg": transfer["speedAvg"],
+                "eta": transfer["eta"],
+            }
+            for transfer in stats.get("transferring", [])
+        ],
+    }
+
+    return min(progresses) if progresses else None, ", ".join(description) or None, extra
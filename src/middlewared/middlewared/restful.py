@@ -17,6 +17,15 @@ from .service_exception import adapt_exception, CallError, MatchNotFound, Valida
 
 
 async def authenticate(middleware, req, method, resource):
+    """
+    Authenticate REST API request using one of:
+
+    * `Authorization: Basic <base64(username:password)>`
+    * `Authorization: Bearer <API key>`
+    * `Authorization: Token <token>`, where token is generated with `auth.generate_token` so that scripts can
+      verify their password or API key only once. Tokens are not accepted from cookies as browsers would send
+      them along with cross-site requests.
+    """
 
     auth = req.headers.get('Authorization')
     if auth is None:
@@ -46,6 +55,11 @@ async def authenticate(middleware, req, method, resource):
 
         if not api_key.authorize(method, resource):
             raise web.HTTPForbidden()
+    elif auth.startswith('Token '):
+        token = await middleware.call('auth.use_token', auth.split(' ', 1)[1])
+        # Tokens generated for a single file download/upload job do not grant API access
+        if token is None or 'job' in token['attributes']:
+            raise web.HTTPUnauthorized()
     else:
         raise web.HTTPUnauthorized()
 
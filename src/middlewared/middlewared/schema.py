@@ -1092,6 +1092,9 @@ def resolver(schemas, obj):
         schema_obj.clear()
         schema_obj.extend(new_params)
 
+        for p in new_params:
+            compile_attr(p)
+
 
 def resolve_methods(schemas, to_resolve):
     while len(to_resolve) > 0:
@@ -1115,7 +1118,7 @@ def validate_return_type(func, result, schemas):
     elif not schemas:
         raise ValueError(f'Return schema missing for {func.__name__!r}')
 
-    result = copy.deepcopy(result)
+    # Compiled cleaners do not modify `result` so it does not need to be copied
     if not isinstance(result, tuple):
         result = [result]
 
@@ -1125,9 +1128,21 @@ def validate_return_type(func, result, schemas):
     verrors.check()
 
 
+def should_validate_return_type(nf):
+    """
+    Return value validation is only done in debug mode, for one of every `conf.returns_validation_rate` calls of
+    each method (`0` disables it).
+    """
+    if not conf.debug_mode or conf.returns_validation_rate <= 0:
+        return False
+
+    nf.returns_calls += 1
+    return (nf.returns_calls - 1) % conf.returns_validation_rate == 0
+
+
 def clean_and_validate_arg(verrors, attr, arg):
     try:
-        value = attr.clean(arg)
+        value = compile_attr(attr)(arg)
         attr.validate(value)
         return value
     except Error as e:
@@ -1136,18 +1151,182 @@ def clean_and_validate_arg(verrors, attr, arg):
         verrors.extend(e)
 
 
+def compile_attr(attr):
+    """
+    Returns a cleaner function for `attr` that is equivalent to `attr.clean` but does not modify its argument:
+    `Dict` and `List` values are only copied (shallowly) if some of their items were changed or defaults were
+    added, otherwise the original value is returned. That way arguments and return values do not have to be
+    deep-copied before they are cleaned.
+
+    Cleaners are compiled once per attribute (when methods are resolved at plugin load time or on first use) so
+    attribute changes after that are not picked up.
+    """
+    # Attribute id is stored along with the cleaner so that copies of the attribute do not reuse it
+    compiled = getattr(attr, '_compiled_clean', None)
+    if compiled is not None and compiled[0] == id(attr):
+        return compiled[1]
+
+    if isinstance(attr, Dict) and type(attr).clean is Dict.clean:
+        cleaner = _compile_dict(attr)
+    elif isinstance(attr, List) and type(attr).clean is List.clean:
+        cleaner = _compile_list(attr)
+    elif isinstance(attr, OROperator) and type(attr).clean is OROperator.clean:
+        cleaner = _compile_or(attr)
+    elif isinstance(attr, (Dict, List, OROperator)):
+        # Custom `clean` implementation might modify the value in place
+        def cleaner(value):
+            return attr.clean(copy.deepcopy(value))
+    elif hasattr(attr, 'clean'):
+        # Scalar attributes do not modify their values
+        cleaner = attr.clean
+    else:
+        def cleaner(value):
+            return attr.clean(value)
+
+        return cleaner
+
+    attr._compiled_clean = (id(attr), cleaner)
+    return cleaner
+
+
+def _compile_dict(attr):
+    attrs = {name: (child, compile_attr(child)) for name, child in attr.attrs.items()}
+
+    def clean_child(name, value, verrors):
+        child, cleaner = attrs[name]
+        try:
+            return cleaner(value)
+        except Error as e:
+            verrors.add(f'{attr.name}.{e.attribute}', e.errmsg, e.errno)
+        except ValidationErrors as e:
+            verrors.add_child(attr.name, e)
+
+    def with_defaults(data, skip_attrs, verrors, check_required=True):
+        result = data
+        for name, (child, cleaner) in attrs.items():
+            if (
+                name not in data and name not in skip_attrs and
+                ((check_required and child.required) or child.has_default)
+            ):
+                if result is data:
+                    result = dict(data)
+                result[name] = clean_child(name, NOT_PROVIDED, verrors)
+        return result
+
+    def attrs_to_skip(data):
+        skip_attrs = defaultdict(set)
+        check_data = with_defaults(data, {}, ValidationErrors(), False)
+        for name, attr_data in attr.conditional_defaults.items():
+            if not filter_list([check_data], attr_data['filters']):
+                for k in attr_data['attrs']:
+                    skip_attrs[k].add(name)
+        return skip_attrs
+
+    def clean(data):
+        data = Attribute.clean(attr, data)
+
+        if data is None:
+            if attr.null:
+                return None
+
+            return copy.deepcopy(attr.default)
+
+        if not isinstance(data, dict):
+            raise Error(attr.name, 'A dict was expected')
+
+        verrors = ValidationErrors()
+        result = data
+        for key, value in data.items():
+            if key not in attrs:
+                if not attr.additional_attrs:
+                    verrors.add(f'{attr.name}.{key}', 'Field was not expected')
+                continue
+
+            cleaned = clean_child(key, value, verrors)
+            if cleaned is not value:
+                if result is data:
+                    result = dict(data)
+                result[key] = cleaned
+
+        # Do not make any field and required and not populate default values
+        if not attr.update:
+            result = with_defaults(result, attrs_to_skip(result) if attr.conditional_defaults else {}, verrors)
+
+        verrors.check()
+
+        return result
+
+    return clean
+
+
+def _compile_list(attr):
+    items = [compile_attr(item) for item in attr.items]
+
+    def clean(value):
+        value = super(List, attr).clean(value)
+        if value is None:
+            return copy.deepcopy(attr.default)
+        if not isinstance(value, list):
+            raise Error(attr.name, 'Not a list')
+        if not attr.empty and not value:
+            raise Error(attr.name, 'Empty value not allowed')
+
+        result = value
+        if items:
+            for index, v in enumerate(value):
+                for cleaner in items:
+                    try:
+                        cleaned = cleaner(v)
+                        found = True
+                        break
+                    except (Error, ValidationErrors) as e:
+                        found = e
+                if found is not True:
+                    raise Error(attr.name, 'Item#{0} is not valid per list types: {1}'.format(index, found))
+
+                if cleaned is not v:
+                    if result is value:
+                        result = list(value)
+                    result[index] = cleaned
+        return result
+
+    return clean
+
+
+def _compile_or(attr):
+    schemas = [compile_attr(schema) for schema in attr.schemas]
+
+    def clean(value):
+        if attr.has_default and value == attr.default:
+            return copy.deepcopy(attr.default)
+
+        verrors = ValidationErrors()
+        for cleaner in schemas:
+            try:
+                return cleaner(value)
+            except (Error, ValidationErrors) as e:
+                if isinstance(e, Error):
+                    verrors.add(e.attribute, e.errmsg, e.errno)
+                else:
+                    verrors.extend(e)
+
+        raise Error(attr.name, f'Result does not match specified schema: {verrors}')
+
+    return clean
+
+
 def returns(*schema):
     def returns_internal(f):
         if asyncio.iscoroutinefunction(f):
             async def nf(*args, **kwargs):
                 res = await f(*args, **kwargs)
-                if conf.debug_mode:
+                if should_validate_return_type(nf):
                     validate_return_type(f, res, nf.returns)
                 return res
         else:
             def nf(*args, **kwargs):
                 res = f(*args, **kwargs)
-                if conf.debug_mode:
+                if should_validate_return_type(nf):
                     validate_return_type(f, res, nf.returns)
                 return res
 
@@ -1159,6 +1338,7 @@ def returns(*schema):
             if hasattr(s, 'title'):
                 s.title = s.title or s.name
         nf.returns = list(schema)
+        nf.returns_calls = 0
         return nf
     return returns_internal
 
@@ -1218,6 +1398,14 @@ def accepts(*schema, deprecated=None):
             args_index += f._skip_arg
         assert len(schema) == f.__code__.co_argcount - args_index  # -1 for self
 
+        def clean_arg(verrors, attr, arg):
+            value = clean_and_validate_arg(verrors, attr, arg)
+            if isinstance(value, (dict, list)):
+                # Cleaned containers share unchanged items with the argument. Copy them so that the method can modify
+                # its argument (at any depth) without affecting the caller.
+                value = copy.deepcopy(value)
+            return value
+
         def clean_and_validate_args(args, kwargs):
             args = list(args)
 
@@ -1232,8 +1420,9 @@ def accepts(*schema, deprecated=None):
                         had_warning = True
                     signature_args = adapt(*signature_args)
 
-            args = common_args + copy.deepcopy(signature_args)
-            kwargs = copy.deepcopy(kwargs)
+            # Arguments are not modified by cleaning so they are only copied after they are cleaned
+            args = common_args + list(signature_args)
+            kwargs = dict(kwargs)
 
             verrors = ValidationErrors()
 
@@ -1242,7 +1431,7 @@ def accepts(*schema, deprecated=None):
             if len(args[args_index:]) > len(nf.accepts):
                 raise CallError(f'Too many arguments (expected {len(nf.accepts)}, found {len(args[args_index:])})')
             for _ in args[args_index:]:
-                args[args_index + i] = clean_and_validate_arg(verrors, nf.accepts[i], args[args_index + i])
+                args[args_index + i] = clean_arg(verrors, nf.accepts[i], args[args_index + i])
                 i += 1
 
             # Use i counter to map keyword argument to rpc positional
@@ -1262,7 +1451,7 @@ def accepts(*schema, deprecated=None):
                     i += 1
                     continue
 
-                kwargs[kwarg] = clean_and_validate_arg(verrors, attr, value)
+                kwargs[kwarg] = clean_arg(verrors, attr, value)
 
             if verrors:
                 raise verrors
@@ -1,6 +1,6 @@
 import copy
 from collections import defaultdict, namedtuple
-from functools import wraps
+from functools import partial, wraps
 
 import asyncio
 import errno
@@ -28,6 +28,7 @@ from middlewared.service_exception import (  # noqa
 )
 from middlewared.settings import conf
 from middlewared.utils import filter_list, osc
+from middlewared.utils.asyncio_ import asyncio_map
 from middlewared.utils.debug import get_frame_details, get_threads_stacks
 from middlewared.logger import Logger, reconfigure_logging, stop_logging
 from middlewared.job import Job
@@ -41,6 +42,8 @@ get_or_insert_lock = asyncio.Lock()
 LOCKS = defaultdict(asyncio.Lock)
 THREADING_LOCKS = defaultdict(threading.Lock)
 MIDDLEWARE_STARTED_SENTINEL_PATH = "/var/run/middlewared-started"
+# How many shares/tasks without a batch extend method are extended simultaneously
+SHARING_TASK_EXTEND_CONCURRENCY = 10
 
 
 def lock(lock_str):
@@ -353,6 +356,8 @@ class ServiceBase(type):
     Currently the following options are allowed:
       - datastore: name of the datastore mainly used in the service
       - datastore_extend: datastore `extend` option used in common `query` method
+      - datastore_extend_batch: datastore `extend_batch` option used in common `query` method. Unlike
+                                `datastore_extend`, it is called once with the list of all queried rows.
       - datastore_prefix: datastore `prefix` option used in helper methods
       - service: system service `name` option used by `SystemServiceService`
       - service_model: system service datastore model option used by `SystemServiceService` (`service` if used if not provided)
@@ -364,6 +369,8 @@ class ServiceBase(type):
       - verbose_name: human-friendly singular name for the service
       - thread_pool: thread pool to use for threaded methods
       - process_pool: process pool to run service methods
+      - process_pool_budget: maximum number of process pool workers service methods can use simultaneously
+                             (defaults to all workers but one)
       - cli_namespace: replace namespace identifier for CLI
       - cli_private: if the service is not private, this flags whether or not the service is visible in the CLI
     """
@@ -395,6 +402,7 @@ def service_config(klass, config):
         'datastore': None,
         'datastore_prefix': '',
         'datastore_extend': None,
+        'datastore_extend_batch': None,
         'datastore_extend_context': None,
         'datastore_primary_key': 'id',
         'datastore_primary_key_type': 'integer',
@@ -409,6 +417,7 @@ def service_config(klass, config):
         'private': False,
         'thread_pool': None,
         'process_pool': None,
+        'process_pool_budget': None,
         'cli_namespace': None,
         'cli_private': False,
         'cli_description': None,
@@ -566,6 +575,7 @@ class ConfigService(ServiceChangeMixin, Service, metaclass=ConfigServiceMetabase
     async def config(self):
         options = {}
         options['extend'] = self._config.datastore_extend
+        options['extend_batch'] = self._config.datastore_extend_batch
         options['extend_context'] = self._config.datastore_extend_context
         options['prefix'] = self._config.datastore_prefix
         return await self._get_or_insert(self._config.datastore, options)
@@ -680,6 +690,9 @@ class TDBWrapConfigService(ConfigService):
             )
             data = copy.deepcopy(self.tdb_defaults)
 
+        if self._config.datastore_extend_batch:
+            return (await self.middleware.call(self._config.datastore_extend_batch, [data]))[0]
+
         if not self._config.datastore_extend:
             return data
 
@@ -731,6 +744,9 @@ class TDBWrapConfigService(ConfigService):
             "tdb-options": self.tdb_options.copy(),
         })
 
+        if self._config.datastore_extend_batch:
+            return (await self.middleware.call(self._config.datastore_extend_batch, [tdb_config["data"]]))[0]
+
         if not self._config.datastore_extend:
             return tdb_config["data"]
 
@@ -753,6 +769,7 @@ class SystemServiceService(ConfigService):
         return await self._get_or_insert(
             f'services.{self._config.service_model or self._config.service}', {
                 'extend': self._config.datastore_extend,
+                'extend_batch': self._config.datastore_extend_batch,
                 'extend_context': self._config.datastore_extend_context,
                 'prefix': self._config.datastore_prefix
             }
@@ -880,6 +897,7 @@ class CRUDService(ServiceChangeMixin, Service, metaclass=CRUDServiceMetabase):
     async def get_options(self, options):
         options = options or {}
         options['extend'] = self._config.datastore_extend
+        options['extend_batch'] = self._config.datastore_extend_batch
         options['extend_context'] = self._config.datastore_extend_context
         options['prefix'] = self._config.datastore_prefix
         return options
@@ -900,7 +918,7 @@ class CRUDService(ServiceChangeMixin, Service, metaclass=CRUDServiceMetabase):
         # In case we are extending which may transform the result in numerous ways
         # we can only filter the final result. Exception is when forced to use sql
         # for filters for performance reasons.
-        if not options['force_sql_filters'] and options['extend']:
+        if not options['force_sql_filters'] and (options['extend'] or options.get('extend_batch')):
             datastore_options = options.copy()
             datastore_options.pop('count', None)
             datastore_options.pop('get', None)
@@ -1126,12 +1144,29 @@ class SharingTaskService(CRUDService):
 
         return data
 
+    @private
+    async def sharing_task_extend_batch(self, rows, context):
+        if not self._config.datastore_extend_batch:
+            return await asyncio_map(
+                partial(self.sharing_task_extend, context=context), rows, SHARING_TASK_EXTEND_CONCURRENCY,
+            )
+
+        args = [rows] + ([context['service_extend']] if self._config.datastore_extend_context else [])
+
+        rows = await self.middleware.call(self._config.datastore_extend_batch, *args)
+
+        for row in rows:
+            row[self.locked_field] = await self.sharing_task_determine_locked(row, context['locked_datasets'])
+
+        return rows
+
     @private
     async def get_options(self, options):
         return {
             **(await super().get_options(options)),
-            'extend': f'{self._config.namespace}.sharing_task_extend',
+            'extend': None,
             'extend_context': f'{self._config.namespace}.sharing_task_extend_context',
+            'extend_batch': f'{self._config.namespace}.sharing_task_extend_batch',
         }
 
     @private
@@ -1294,14 +1329,16 @@ class TDBWrapCRUDService(CRUDService):
             )
             return copy.deepcopy(self.tdb_defaults)
 
-        if not self._config.datastore_extend:
+        if self._config.datastore_extend_batch:
+            to_filter = await self.middleware.call(self._config.datastore_extend_batch, data)
+        elif self._config.datastore_extend:
+            to_filter = []
+            for entry in data:
+                extended = await self.middleware.call(self._config.datastore_extend, entry)
+                to_filter.append(extended)
+        else:
             return filter_list(data, filters, options)
 
-        to_filter = []
-        for entry in data:
-            extended = await self.middleware.call(self._config.datastore_extend, entry)
-            to_filter.append(extended)
-
         if not to_filter and self.tdb_defaults:
             await self.insert_defaults()
             to_filter = copy.deepcopy(self.tdb_defaults)
@@ -1481,6 +1518,9 @@ class CoreService(Service):
                 ),
                 'authenticated': i.authenticated,
                 'call_count': i._softhardsemaphore.counter,
+                'outbound_queue': len(i._outbound),
+                'outbound_dropped': i._outbound_dropped,
+                'outbound_coalesced': i._outbound_coalesced,
             }
             for i in self.middleware.get_wsclients().values()
         ], filters, options)
@@ -1497,6 +1537,21 @@ class CoreService(Service):
     async def debug_mode_enabled(self):
         return conf.debug_mode
 
+    @private
+    async def process_pool_stats(self):
+        """
+        Process pool statistics: current number of workers, number of calls running and waiting for a worker
+        (overall and per service) and time the calls spent waiting (in seconds).
+
+        `workers_connections` are connection statistics reported by every process pool worker: how many connection
+        handshakes to the main middleware process it performed, how many `requests` (calls and events) were sent
+        over them and an estimate of the handshake time saved by reusing the connection.
+        """
+        return {
+            **self.middleware.get_process_pool_stats(),
+            'workers_connections': self.middleware.get_worker_stats(),
+        }
+
     @private
     def get_tasks(self):
         for task in asyncio.all_tasks(loop=self.middleware.loop):
@@ -1550,7 +1605,7 @@ class CoreService(Service):
         """Get the long running jobs."""
         raw_result = options['extra'].get('raw_result', True)
         jobs = filter_list([
-            i.__encode__(raw_result) for i in list(self.middleware.jobs.all().values())
+            i.__encode__(raw_result) for i in self.middleware.jobs.filter(filters)
         ], filters, options)
         return jobs
 
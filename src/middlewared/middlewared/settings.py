@@ -1,6 +1,8 @@
 class Configuration:
-    def __init__(self, debug_mode=True):
+    def __init__(self, debug_mode=True, returns_validation_rate=1):
         self.debug_mode = debug_mode
+        # Validate return value of one of every `returns_validation_rate` method calls in debug mode (0 to disable)
+        self.returns_validation_rate = returns_validation_rate
 
 
 conf = Configuration()
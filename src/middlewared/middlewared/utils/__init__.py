@@ -1,14 +1,13 @@
 import asyncio
 import logging
-import re
 import signal
 import subprocess
 from datetime import datetime, timedelta
 from functools import wraps
 from threading import Lock
 
-from middlewared.service_exception import MatchNotFound
 from middlewared.utils import osc
+from middlewared.utils.filters import compile_filters, partition  # noqa
 from middlewared.utils.threading import start_daemon_thread  # noqa
 
 BUILDTIME = None
@@ -65,19 +64,6 @@ async def run(*args, **kwargs):
     return cp
 
 
-def partition(s):
-    rv = ''
-    while True:
-        left, sep, right = s.partition('.')
-        if not sep:
-            return rv + left, right
-        if left[-1] == '\\':
-            rv += left[:-1] + sep
-            s = right
-        else:
-            return rv + left, right
-
-
 def get(obj, path):
     """
     Get a path in obj using dot notation
@@ -102,115 +88,17 @@ def get(obj, path):
 
 
 def filter_list(_list, filters=None, options=None):
+    """
+    Filter `_list` using `query-filters` and `query-options`.
 
-    opmap = {
-        '=': lambda x, y: x == y,
-        '!=': lambda x, y: x != y,
-        '>': lambda x, y: x > y,
-        '>=': lambda x, y: x >= y,
-        '<': lambda x, y: x < y,
-        '<=': lambda x, y: x <= y,
-        '~': lambda x, y: re.match(y, x),
-        'in': lambda x, y: x in y,
-        'nin': lambda x, y: x not in y,
-        'rin': lambda x, y: x is not None and y in x,
-        'rnin': lambda x, y: x is not None and y not in x,
-        '^': lambda x, y: x is not None and x.startswith(y),
-        '!^': lambda x, y: x is not None and not x.startswith(y),
-        '$': lambda x, y: x is not None and x.endswith(y),
-        '!$': lambda x, y: x is not None and not x.endswith(y),
-    }
-
-    if filters is None:
-        filters = {}
+    Filters, `select` and `order_by` are compiled once into a cached `FilterPlan` (see
+    `middlewared.utils.filters`), so repeated queries with the same shape do not re-parse
+    paths, operators or regular expressions.
+    """
     if options is None:
         options = {}
 
-    select = options.get('select')
-
-    rv = []
-    if filters:
-
-        def filterop(f):
-            if len(f) != 3:
-                raise ValueError(f'Invalid filter {f}')
-            name, op, value = f
-            if op not in opmap:
-                raise ValueError('Invalid operation: {}'.format(op))
-            if isinstance(i, dict):
-                source = get(i, name)
-            else:
-                source = getattr(i, name)
-            if opmap[op](source, value):
-                return True
-            return False
-
-        for i in _list:
-            valid = True
-            for f in filters:
-                if len(f) == 2:
-                    op, value = f
-                    if op == 'OR':
-                        for f in value:
-                            if filterop(f):
-                                break
-                        else:
-                            valid = False
-                            break
-                    else:
-                        raise ValueError(f'Invalid operation: {op}')
-                elif not filterop(f):
-                    valid = False
-                    break
-
-            if not valid:
-                continue
-            if select:
-                entry = {}
-                for s in select:
-                    if s in i:
-                        entry[s] = i[s]
-            else:
-                entry = i
-            rv.append(entry)
-            if options.get('get') is True:
-                return entry
-    elif select:
-        rv = []
-        for i in _list:
-            entry = {}
-            for s in select:
-                if s in i:
-                    entry[s] = i[s]
-            rv.append(entry)
-    else:
-        rv = _list
-
-    if options.get('count') is True:
-        return len(rv)
-
-    if options.get('order_by'):
-        for o in options.get('order_by'):
-            if o.startswith('-'):
-                o = o[1:]
-                reverse = True
-            else:
-                reverse = False
-            rv = sorted(rv, key=lambda x: x[o], reverse=reverse)
-
-    if options.get('get') is True:
-        try:
-            return rv[0]
-        except IndexError:
-            raise MatchNotFound() from None
-
-    if options.get('offset'):
-        rv = rv[options['offset']:]
-
-    if options.get('limit'):
-        return rv[:options['limit']]
-
-    return rv
+    return compile_filters(filters, options).execute(_list, options)
 
 
 def filter_getattrs(filters):
@@ -0,0 +1,65 @@
+# -*- coding=utf-8 -*-
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import crypt
+import hashlib
+import hmac
+import json
+import os
+import time
+
+from .threading import set_thread_name
+
+__all__ = ["hashing_executor", "verify_unixhash", "VerifiedCredentialsCache"]
+
+# Password hashing is CPU-bound and slow by design. It is run in a small dedicated pool so that it never blocks the
+# event loop, and a flood of authentication attempts can not occupy all the IO threads.
+hashing_executor = ThreadPoolExecutor(2, "HashThread", initializer=lambda: set_thread_name("HashThread"))
+
+
+def verify_unixhash(password, unixhash):
+    return hmac.compare_digest(crypt.crypt(password, unixhash), unixhash)
+
+
+class VerifiedCredentialsCache:
+    """
+    Remembers successful credential verifications for `ttl` seconds so that clients that authenticate every request
+    (i.e. REST API scripts) do not pay the hashing cost each time.
+
+    Credentials are not stored: entries are keyed by HMAC (with a random per-process key) of the credential together
+    with the hash it was verified against, so changing the password or API key invalidates them. Only up to `size`
+    most recently verified credentials are kept.
+    """
+
+    def __init__(self, ttl=60, size=1024):
+        self.ttl = ttl
+        self.size = size
+        self.key = os.urandom(32)
+        self.entries = OrderedDict()
+
+    def _digest(self, identity, credential, stored_hash):
+        return hmac.new(
+            self.key, json.dumps([identity, credential, stored_hash]).encode("utf-8", "surrogatepass"), hashlib.sha256,
+        ).digest()
+
+    def verified(self, identity, credential, stored_hash):
+        digest = self._digest(identity, credential, stored_hash)
+        expires_at = self.entries.get(digest)
+        if expires_at is None:
+            return False
+
+        if time.monotonic() >= expires_at:
+            self.entries.pop(digest, None)
+            return False
+
+        return True
+
+    def add(self, identity, credential, stored_hash):
+        digest = self._digest(identity, credential, stored_hash)
+        self.entries[digest] = time.monotonic() + self.ttl
+        self.entries.move_to_end(digest)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
@@ -0,0 +1,336 @@
+import copy
+import heapq
+import itertools
+import operator
+import re
+import threading
+from collections import OrderedDict
+
+from middlewared.service_exception import MatchNotFound
+
+PLAN_CACHE_SIZE = 512
+
+
+class FilterPlan(object):
+    """
+    Compiled form of `query-filters` and the shape-related part of `query-options`
+    (`select` and `order_by`).
+
+    Dotted paths, operators and regular expressions are resolved once when the plan
+    is built so that evaluating a row is a plain closure call. The same plan can be
+    executed against any number of lists with different `limit`/`offset`/`get`/`count`.
+    """
+
+    def __init__(self, filters, select, order_by):
+        self.predicate = compile_predicate(filters)
+        self.select = list(select) if select else None
+        self.sort_passes, self.top_key = compile_sort(order_by)
+
+    def execute(self, _list, options):
+        if self.predicate is not None:
+            rows = filter(self.predicate, _list)
+        else:
+            rows = _list
+
+        if options.get('count') is True:
+            if rows is _list and isinstance(_list, list):
+                return len(_list)
+            return sum(1 for i in rows)
+
+        if options.get('get') is True:
+            if self.sort_passes:
+                rows = self.sort(rows, 1)
+            for i in rows:
+                return self.project(i)
+            raise MatchNotFound()
+
+        offset = options.get('offset') or 0
+        limit = options.get('limit') or 0
+
+        if self.sort_passes:
+            rows = self.sort(rows, offset + limit if limit else None)
+        elif rows is _list and not self.select and not offset and not limit and isinstance(_list, list):
+            # Nothing to do, preserve historical behavior of returning the very same list
+            return _list
+
+        if offset or limit:
+            rows = itertools.islice(rows, offset, offset + limit if limit else None)
+
+        if self.select:
+            return [self.project(i) for i in rows]
+
+        return list(rows)
+
+    def project(self, i):
+        if not self.select:
+            return i
+        return {s: i[s] for s in self.select if s in i}
+
+    def sort(self, rows, top=None):
+        if top is not None and self.top_key is not None:
+            key, reverse = self.top_key
+            # `nsmallest`/`nlargest` are documented to be equivalent to a stable `sorted()[:n]`
+            return (heapq.nlargest if reverse else heapq.nsmallest)(top, rows, key=key)
+
+        rv = list(rows)
+        for key, reverse in self.sort_passes:
+            rv.sort(key=key, reverse=reverse)
+        if top is not None:
+            del rv[top:]
+        return rv
+
+
+def partition(s):
+    rv = ''
+    while True:
+        left, sep, right = s.partition('.')
+        if not sep:
+            return rv + left, right
+        if left[-1] == '\\':
+            rv += left[:-1] + sep
+            s = right
+        else:
+            return rv + left, right
+
+
+def compile_getter(name):
+    """
+    Returns a callable resolving `name` (in `get()` dot notation) for a row.
+    Non-dict rows are resolved using `getattr` with the full name.
+    """
+    if '.' not in name:
+        def getter(i):
+            if isinstance(i, dict):
+                return i.get(name)
+            return getattr(i, name)
+
+        return getter
+
+    path = []
+    right = name
+    while right:
+        left, right = partition(right)
+        path.append((left, int(left) if left.lstrip('-').isdigit() else None))
+
+    def getter(i):
+        if not isinstance(i, dict):
+            return getattr(i, name)
+
+        cur = i
+        for key, index in path:
+            if isinstance(cur, dict):
+                cur = cur.get(key)
+            elif isinstance(cur, (list, tuple)):
+                if index is None:
+                    index = int(key)
+                cur = cur[index] if index < len(cur) else None
+        return cur
+
+    return getter
+
+
+def _membership(value):
+    try:
+        values = frozenset(value)
+    except TypeError:
+        return lambda x: x in value
+
+    def contains(x):
+        try:
+            return x in values
+        except TypeError:
+            # Unhashable item, fall back to sequence scan
+            return x in value
+
+    return contains
+
+
+def compile_operator(op, value):
+    if op == '=':
+        return lambda x: x == value
+    if op == '!=':
+        return lambda x: x != value
+    if op == '>':
+        return lambda x: x > value
+    if op == '>=':
+        return lambda x: x >= value
+    if op == '<':
+        return lambda x: x < value
+    if op == '<=':
+        return lambda x: x <= value
+    if op == '~':
+        return re.compile(value).match
+    if op in ('in', 'nin'):
+        if isinstance(value, (list, tuple, set, frozenset)):
+            contains = _membership(value)
+        else:
+            def contains(x):
+                return x in value
+        if op == 'in':
+            return contains
+        return lambda x: not contains(x)
+    if op == 'rin':
+        return lambda x: x is not None and value in x
+    if op == 'rnin':
+        return lambda x: x is not None and value not in x
+    if op == '^':
+        return lambda x: x is not None and x.startswith(value)
+    if op == '!^':
+        return lambda x: x is not None and not x.startswith(value)
+    if op == '$':
+        return lambda x: x is not None and x.endswith(value)
+    if op == '!$':
+        return lambda x: x is not None and not x.endswith(value)
+    raise ValueError(f'Invalid operation: {op}')
+
+
+def compile_filter(f):
+    if len(f) != 3:
+        raise ValueError(f'Invalid filter {f}')
+
+    name, op, value = f
+    # Compiled filters outlive the call (see `FilterPlanCache`), they must not see later changes to caller's values
+    check = compile_operator(op, copy.deepcopy(value))
+    if '.' not in name:
+        # Most common case, avoid an extra call per row to resolve the value
+        def filterop(i):
+            if isinstance(i, dict):
+                return check(i.get(name))
+            return check(getattr(i, name))
+
+        return filterop
+
+    getter = compile_getter(name)
+
+    def filterop(i):
+        return check(getter(i))
+
+    return filterop
+
+
+def compile_predicate(filters):
+    """
+    Compile a `query-filters` list into a single callable returning whether a row matches,
+    or `None` if every row matches.
+    """
+    if not filters:
+        return None
+
+    predicates = []
+    for f in filters:
+        if len(f) == 2:
+            op, value = f
+            if op != 'OR':
+                raise ValueError(f'Invalid operation: {op}')
+
+            predicates.append(_any([compile_filter(of) for of in value]))
+        else:
+            predicates.append(compile_filter(f))
+
+    if len(predicates) == 1:
+        return predicates[0]
+
+    def predicate(i):
+        for p in predicates:
+            if not p(i):
+                return False
+        return True
+
+    return predicate
+
+
+def _any(predicates):
+    def predicate(i):
+        for p in predicates:
+            if p(i):
+                return True
+        return False
+
+    return predicate
+
+
+def compile_sort(order_by):
+    """
+    Returns a list of `(key, reverse)` sort passes for `order_by` and, when all entries share the
+    same direction, a single `(key, reverse)` composite key suitable for a top-N heap selection.
+
+    `order_by` has always been applied as consecutive stable sorts, so the last entry is the most
+    significant one. Consecutive in-place passes are kept for full sorts because CPython sorts
+    homogeneous scalar keys considerably faster than tuples.
+    """
+    if not order_by:
+        return [], None
+
+    keys = []
+    for o in order_by:
+        if o.startswith('-'):
+            keys.append((o[1:], True))
+        else:
+            keys.append((o, False))
+
+    passes = [(operator.itemgetter(name), reverse) for name, reverse in keys]
+
+    directions = {reverse for name, reverse in keys}
+    if len(directions) == 1:
+        top = operator.itemgetter(*[name for name, reverse in reversed(keys)]), directions.pop()
+    else:
+        top = None
+
+    return passes, top
+
+
+def _freeze(value):
+    if isinstance(value, (list, tuple)):
+        return type(value), tuple(map(_freeze, value))
+    if isinstance(value, dict):
+        return dict, tuple((k, _freeze(v)) for k, v in value.items())
+    hash(value)
+    return type(value), value
+
+
+class FilterPlanCache(object):
+    """
+    LRU cache of compiled plans keyed by the normalized filters, `select` and `order_by`.
+    """
+
+    def __init__(self, size=PLAN_CACHE_SIZE):
+        self.size = size
+        self.lock = threading.Lock()
+        self.plans = OrderedDict()
+
+    def get(self, filters, options):
+        select = options.get('select')
+        order_by = options.get('order_by')
+        try:
+            key = _freeze(filters), _freeze(select), _freeze(order_by)
+        except TypeError:
+            # Unhashable filter value, do not bother caching
+            return FilterPlan(filters, select, order_by)
+
+        with self.lock:
+            plan = self.plans.get(key)
+            if plan is not None:
+                self.plans.move_to_end(key)
+                return plan
+
+        plan = FilterPlan(filters, select, order_by)
+        with self.lock:
+            self.plans[key] = plan
+            while len(self.plans) > self.size:
+                self.plans.popitem(last=False)
+
+        return plan
+
+    def clear(self):
+        with self.lock:
+            self.plans.clear()
+
+
+plan_cache = FilterPlanCache()
+
+
+def compile_filters(filters=None, options=None):
+    """
+    Get a (cached) `FilterPlan` for `filters` and `options`.
+    """
+    return plan_cache.get(filters or [], options or {})
@@ -0,0 +1,207 @@
+# -*- coding=utf-8 -*-
+import asyncio
+from collections import defaultdict, deque
+import concurrent.futures
+import concurrent.futures.process
+import functools
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["ProcessPool"]
+
+
+class ProcessPool:
+    """
+    `ProcessPoolExecutor` that starts with `min_workers` processes and spawns more (up to `max_workers`) when calls
+    have to wait for a free worker.
+
+    Every call is accounted against a budget `key` (i.e. service name): no more than `budget` calls with the same key
+    are run simultaneously so that a storm of calls to one service can't occupy all the workers.
+    """
+
+    def __init__(self, initializer, min_workers, max_workers):
+        self.initializer = initializer
+        self.max_workers = max(max_workers, 1)
+        self.min_workers = max(min(min_workers, self.max_workers), 1)
+        self.default_budget = max(self.max_workers - 1, 1)
+
+        self.executor = None
+        self.workers = 0
+        self.running = 0
+        self.running_by_key = defaultdict(int)
+        # Calls waiting to be admitted as `(key, budget, future)`
+        self.queue = deque()
+
+        self.calls = 0
+        self.queued_calls = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+        self.create_executor()
+
+    def create_executor(self):
+        self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.max_workers,
+                                                               initializer=self.initializer)
+        # `ProcessPoolExecutor` can't be resized, but it spawns processes up to `_max_workers` when needed so it can
+        # be increased later.
+        self.executor._max_workers = self.workers = self.min_workers
+
+    def start(self):
+        """
+        Spawn initial worker processes.
+        """
+        self.executor._start_executor_manager_thread()
+
+    async def warm(self):
+        """
+        Make sure initial worker processes are spawned and have loaded the plugins so that the first call does
+        not have to wait for it.
+        """
+        start = time.monotonic()
+        loop = asyncio.get_event_loop()
+        try:
+            await asyncio.gather(*[loop.run_in_executor(self.executor, warmup) for i in range(self.workers)])
+        except concurrent.futures.process.BrokenProcessPool:
+            logger.warning("Process pool broke while warming up")
+        else:
+            logger.debug("Warmed up %d process pool workers in %.2f seconds", self.workers, time.monotonic() - start)
+
+    async def run(self, method, *args, key=None, budget=None, **kwargs):
+        budget = min(budget or self.default_budget, self.default_budget)
+
+        start = time.monotonic()
+        if not self._can_run(key, budget):
+            self.queued_calls += 1
+            fut = asyncio.get_event_loop().create_future()
+            self.queue.append((key, budget, fut))
+            self._grow()
+            self._dispatch()
+            try:
+                await fut
+            except asyncio.CancelledError:
+                if fut.done() and not fut.cancelled():
+                    # Admitted right before the cancellation
+                    self._release(key)
+                elif (key, budget, fut) in self.queue:
+                    self.queue.remove((key, budget, fut))
+                raise
+        else:
+            self._acquire(key)
+
+        self.calls += 1
+        try:
+            started_at, result = await self._run(method, *args, **kwargs)
+        finally:
+            self._release(key)
+
+        wait_time = max(started_at - start, 0)
+        self.wait_time += wait_time
+        self.max_wait_time = max(self.max_wait_time, wait_time)
+        return result
+
+    async def _run(self, method, *args, **kwargs):
+        retries = 2
+        for i in range(retries):
+            executor = self.executor
+            try:
+                return await asyncio.get_event_loop().run_in_executor(
+                    executor, functools.partial(run_timed, method, *args, **kwargs),
+                )
+            except concurrent.futures.process.BrokenProcessPool:
+                if i == retries - 1:
+                    raise
+
+                if self.executor is executor:
+                    logger.warning("Process pool is broken, restarting it")
+                    self.create_executor()
+                    asyncio.ensure_future(self.warm())
+
+    def _can_run(self, key, budget):
+        return self.running < self.workers and self.running_by_key.get(key, 0) < budget
+
+    def _acquire(self, key):
+        self.running += 1
+        self.running_by_key[key] += 1
+
+    def _release(self, key):
+        self.running -= 1
+        self.running_by_key[key] -= 1
+        if self.running_by_key[key] == 0:
+            del self.running_by_key[key]
+
+        self._dispatch()
+
+    def _dispatch(self):
+        for item in list(self.queue):
+            key, budget, fut = item
+            if fut.cancelled():
+                self.queue.remove(item)
+                continue
+
+            if self.running >= self.workers:
+                break
+
+            if self.running_by_key.get(key, 0) < budget:
+                self.queue.remove(item)
+                self._acquire(key)
+                fut.set_result(None)
+
+    def _grow(self):
+        """
+        Spawn one more worker process if some calls are waiting for a worker (not for their budget).
+        """
+        if self.workers >= self.max_workers or self.running < self.workers:
+            return
+
+        if not any(self.running_by_key.get(key, 0) < budget for key, budget, fut in self.queue):
+            return
+
+        self.workers += 1
+        self.executor._max_workers = self.workers
+        if not getattr(self.executor, "_safe_to_dynamically_spawn_children", False):
+            # Processes are only spawned on demand by Python 3.11+ when not using `fork` start method
+            spawn_process = getattr(self.executor, "_spawn_process", None)
+            if spawn_process is None:
+                self.executor._adjust_process_count()
+            else:
+                while len(self.executor._processes) < self.workers:
+                    spawn_process()
+        logger.debug("Process pool grown to %d workers", self.workers)
+
+    def pids(self):
+        """
+        Returns pids of the live worker processes.
+        """
+        return set(self.executor._processes or {})
+
+    def stats(self):
+        budgets = defaultdict(lambda: {"running": 0, "queued": 0})
+        for key, count in self.running_by_key.items():
+            budgets[key]["running"] = count
+        for key, budget, fut in self.queue:
+            budgets[key]["queued"] += 1
+
+        return {
+            "min_workers": self.min_workers,
+            "max_workers": self.max_workers,
+            "workers": self.workers,
+            "running": self.running,
+            "queue_depth": len(self.queue),
+            "calls": self.calls,
+            "queued_calls": self.queued_calls,
+            "wait_time": self.wait_time,
+            "average_wait_time": self.wait_time / self.calls if self.calls else 0.0,
+            "max_wait_time": self.max_wait_time,
+            "services": dict(budgets),
+        }
+
+
+def run_timed(method, *args, **kwargs):
+    return time.monotonic(), method(*args, **kwargs)
+
+
+def warmup():
+    # Keep the worker busy for a while so that other warmup calls are sent to the other workers
+    time.sleep(0.1)
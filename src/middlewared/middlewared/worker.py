@@ -5,6 +5,8 @@ import asyncio
 import inspect
 import os
 import setproctitle
+import threading
+import time
 
 from . import logger
 from .common.environ import environ_update
@@ -13,6 +15,64 @@ import middlewared.utils.osc as osc
 from .utils.service.call import MethodNotFoundError, ServiceCallMixin
 
 MIDDLEWARE = None
+MIDDLEWARE_SOCKET = 'ws+unix:///var/run/middlewared-internal.sock'
+
+
+class WorkerConnection:
+    """
+    Long-lived connection to the main middleware process shared by all calls executed by this worker (calls are
+    multiplexed by their ids). It is re-established (along with event subscriptions) if it is lost.
+    """
+
+    def __init__(self, subscriptions=None, on_connect=None):
+        self.subscriptions = subscriptions or []
+        self.on_connect = on_connect
+        self.lock = threading.Lock()
+        self.client = None
+
+        # Connection handshakes performed and how long they took
+        self.connections = 0
+        self.handshake_time = 0.0
+        # Worker calls and events that used to open their own connection each
+        self.requests = 0
+
+    def get(self):
+        with self.lock:
+            if self.client is None or self.client.closed:
+                self.client = self._connect()
+
+            return self.client
+
+    def _connect(self):
+        start = time.monotonic()
+        client = Client(MIDDLEWARE_SOCKET, py_exceptions=True)
+        self.handshake_time += time.monotonic() - start
+        self.connections += 1
+
+        for name, callback in self.subscriptions:
+            client.subscribe(name, callback)
+
+        if self.on_connect is not None:
+            self.on_connect(client)
+
+        return client
+
+    def call(self, method, *params, **kwargs):
+        return self.get().call(method, *params, **kwargs)
+
+    def stats(self):
+        if self.connections:
+            saved = max(self.requests - self.connections, 0) * self.handshake_time / self.connections
+        else:
+            saved = 0.0
+
+        return {
+            'pid': os.getpid(),
+            'connections': self.connections,
+            'requests': self.requests,
+            'handshake_time': self.handshake_time,
+            'handshake_time_saved': saved,
+        }
 
 
 class FakeMiddleware(LoadPluginsMixin, ServiceCallMixin):
@@ -22,23 +82,22 @@ class FakeMiddleware(LoadPluginsMixin, ServiceCallMixin):
 
     def __init__(self, overlay_dirs):
         super().__init__(overlay_dirs)
-        self.client = None
+        self.client = WorkerConnection([
+            ('core.environ', lambda *args, **kwargs: environ_update(kwargs['fields'])),
+            ('core.reconfigure_logging', reconfigure_logging),
+        ], lambda client: environ_update(client.call('core.environ')))
         _logger = logger.Logger('worker')
         self.logger = _logger.getLogger()
         _logger.configure_logging('console')
         self.loop = asyncio.get_event_loop()
 
     def _call(self, name, serviceobj, methodobj, params=None, app=None, pipes=None, job=None):
-        try:
-            with Client('ws+unix:///var/run/middlewared-internal.sock', py_exceptions=True) as c:
-                self.client = c
-                job_options = getattr(methodobj, '_job', None)
-                if job and job_options:
-                    params = list(params) if params else []
-                    params.insert(0, FakeJob(job['id'], self.client))
-                return methodobj(*params)
-        finally:
-            self.client = None
+        self.client.requests += 1
+        job_options = getattr(methodobj, '_job', None)
+        if job and job_options:
+            params = list(params) if params else []
+            params.insert(0, FakeJob(job['id'], self.client))
+        return methodobj(*params)
 
     def _run(self, name, args, job):
         serviceobj, methodobj = self._method_lookup(name)
@@ -84,8 +143,8 @@ class FakeMiddleware(LoadPluginsMixin, ServiceCallMixin):
         return []
 
     def send_event(self, name, event_type, **kwargs):
-        with Client(py_exceptions=True) as c:
-            return c.call('core.event_send', name, event_type, kwargs)
+        self.client.requests += 1
+        return self.client.call('core.event_send', name, event_type, kwargs)
 
 
 class FakeJob(object):
@@ -119,7 +178,7 @@ def main_worker(*call_args):
     # it using Pipe.
     if inspect.isgenerator(res):
         res = list(res)
-    return res
+    return res, MIDDLEWARE.client.stats()
 
 
 def reconfigure_logging(mtype, **message):
@@ -130,14 +189,6 @@ def reconfigure_logging(mtype, **message):
         logger.reconfigure_logging()
 
 
-def receive_events():
-    c = Client('ws+unix:///var/run/middlewared-internal.sock', py_exceptions=True)
-    c.subscribe('core.environ', lambda *args, **kwargs: environ_update(kwargs['fields']))
-    c.subscribe('core.reconfigure_logging', reconfigure_logging)
-
-    environ_update(c.call('core.environ'))
-
-
 def worker_init(overlay_dirs, debug_level, log_handler):
     global MIDDLEWARE
     MIDDLEWARE = FakeMiddleware(overlay_dirs)
@@ -147,4 +198,5 @@ def worker_init(overlay_dirs, debug_level, log_handler):
     setproctitle.setproctitle('middlewared (worker)')
     osc.die_with_parent()
     logger.setup_logging('worker', debug_level, log_handler)
-    receive_events()
+    # Connect (and subscribe to events) right away so that the first call does not pay for it
+    MIDDLEWARE.client.get()